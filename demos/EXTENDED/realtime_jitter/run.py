@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+realtime_jitter.run.py
+
+Compares the timing jitter of a 1000 Hz deadline loop, like the ioHub device
+poll loop, when the process runs at normal priority, in high priority mode,
+and in real-time priority mode. For each mode, the lateness of each wake up
+relative to its deadline is printed as mean, median, 99th percentile and max
+msec. Some garbage is created on every iteration, so the effect of the GC
+settings is included.
+
+On Linux, real-time mode needs the CAP_SYS_NICE capability or an rtprio
+limit, for example:
+
+    sudo setcap cap_sys_nice,cap_ipc_lock+ep `readlink -f \`which python\``
+
+Without it, the real-time results will match high priority mode, and a
+warning is printed.
+"""
+import time
+import numpy as N
+from iohub.devices import Computer
+
+PERIOD=0.001
+DURATION=10.0
+
+def measureLateness(period,duration):
+    getTime=Computer.getTime
+    lateness=[]
+    garbage=[]
+    deadline=getTime()+period
+    end_time=deadline+duration
+    while deadline < end_time:
+        remaining=deadline-getTime()
+        if remaining > 0:
+            time.sleep(remaining)
+        lateness.append(getTime()-deadline)
+        # create some cyclic garbage, as event processing would.
+        l=[deadline,]
+        l.append(l)
+        garbage.append(l)
+        if len(garbage) > 1000:
+            garbage=[]
+        deadline+=period
+    return N.array(lateness)*1000.0
+
+def printResults(mode,lateness):
+    print "%-10s mean: %.3f  median: %.3f  99%%: %.3f  max: %.3f msec"%(mode,lateness.mean(),
+                                    N.median(lateness),N.percentile(lateness,99),lateness.max())
+
+if __name__ == '__main__':
+    print "Measuring %.1f sec of %.1f msec deadlines per mode..."%(DURATION,PERIOD*1000.0)
+
+    printResults('normal',measureLateness(PERIOD,DURATION))
+
+    Computer.enableHighPriority(disable_gc=False)
+    printResults('high',measureLateness(PERIOD,DURATION))
+    Computer.disableHighPriority()
+
+    Computer.enableRealTimePriority(disable_gc=False)
+    printResults('realtime',measureLateness(PERIOD,DURATION))
+    Computer.disableRealTimePriority()
+
+    Computer.realTimeSettings['gc_threshold']=[100000,50,50]
+    Computer.enableRealTimePriority(disable_gc=False)
+    printResults('rt+gc',measureLateness(PERIOD,DURATION))
+    Computer.disableRealTimePriority()
@@ -14,9 +14,12 @@ Distributed under the terms of the GNU General Public License (GPL version 3 or
 import os,sys
 import time
 import subprocess
-from collections import deque
+from collections import deque, namedtuple
 import json
 import signal
+import threading
+import tempfile
+import numpy as N
 
 try:
     from yaml import load, dump
@@ -33,11 +36,12 @@ if sys.platform != 'darwin':
     _psutil_available=True
 
 from . import IO_HUB_DIRECTORY,isIterable
-from .devices import Computer, DeviceEvent,import_device
+from .devices import Computer, DeviceEvent,import_device, filterEvents, projectEvents, eventsToArrays
 from .devices.experiment import MessageEvent,LogEvent
 from .constants import DeviceConstants,EventConstants
-from .util import updateDict,MessageDialog, print2err,printExceptionDetailsToStdErr,ioHubError,win32MessagePump, ioHubConnectionException, ioHubServerError
-from .net import UDPClientConnection
+from .util import updateDict,MessageDialog, print2err,printExceptionDetailsToStdErr,ioHubError,win32MessagePump, ioHubConnectionException, ioHubServerError, Histogram
+from .net import UDPClientConnection, UnixDatagramClientConnection, SharedMemoryEventRing, getEventRingFilePath
+from .net import getTransportType, getUnixSocketPath, EventSubscriptionConnection
 
 currentSec= Computer.currentSec
 
@@ -57,13 +61,35 @@ class DeviceRPC(object):
     _log_text_index=LogEvent.CLASS_ATTRIBUTE_NAMES.index('text')
     _log_level_index=LogEvent.CLASS_ATTRIBUTE_NAMES.index('log_level')
     
-    def __init__(self,sendToHub,device_class,method_name):
+    def __init__(self,hubClient,device_class,method_name):
         self.device_class=device_class
         self.method_name=method_name
-        self.sendToHub=sendToHub
+        self.hubClient=hubClient
 
     def __call__(self, *args,**kwargs):
-        r = self.sendToHub(('EXP_DEVICE','DEV_RPC',self.device_class,self.method_name,args,kwargs))
+        if self.hubClient._active_batch is not None:
+            return self.callAsync(*args,**kwargs)
+        r = self.hubClient._sendToHubServer(('EXP_DEVICE','DEV_RPC',self.device_class,self.method_name,args,kwargs))
+        return self._processReply(r,kwargs)
+
+    def callAsync(self, *args,**kwargs):
+        """
+        Sends the device method call to the ioHub Process, returning 
+        without waiting for the result. 
+        
+        Args:
+            args, kwargs: The arguments for the device method, the same as when calling the method directly.
+
+        Returns:
+            ioHubRequestTicket: ticket.getResult() returns the same value that calling the device method directly would have.
+        """
+        request=('EXP_DEVICE','DEV_RPC',self.device_class,self.method_name,args,kwargs)
+        reply_handler=lambda r: self._processReply(r,kwargs)
+        if self.hubClient._active_batch is not None:
+            return self.hubClient._active_batch._addRequest(request,reply_handler)
+        return self.hubClient._sendToHubServerAsync(request,reply_handler)
+
+    def _processReply(self,r,kwargs):
         r=r[1:]
         if len(r)==1:
             r=r[0]
@@ -75,6 +101,11 @@ class DeviceRPC(object):
 
             if asType == 'list':
                 return r
+            elif kwargs.get('fields'):
+                conversionMethod=ioHubConnection._getProjectedEventConversionMethod(asType,kwargs['fields'])
+                if conversionMethod:
+                    return [conversionMethod(el) for el in r]
+                return r
             else:
                 conversionMethod=None
                 if asType == 'dict':
@@ -86,21 +117,379 @@ class DeviceRPC(object):
 
                 if conversionMethod:
                     #print 'DeviceViewCall Device: ',self.device_class
-                    if self.device_class != 'Experiment':                    
-                        return [conversionMethod(el) for el in r]
-                    
-                    toBeLogged=[el for el in r if el[DeviceEvent.EVENT_TYPE_ID_INDEX]==LogEvent.EVENT_TYPE_ID]                    
-                    for l in toBeLogged:
-                        r.remove(l)
-                        ltime=l[self._log_time_index]
-                        ltext=l[self._log_text_index]
-                        llevel=l[self._log_level_index]
-                        psycho_logging.log(ltext,llevel,ltime)    
-                        
+                    if self.device_class == 'Experiment':                    
+                        r=self._logLogEvents(r)
                     return [conversionMethod(el) for el in r]
 
         return r
 
+    @classmethod
+    def _logLogEvents(cls,events):
+        """
+        Sends the LogEvents in the Experiment device event list events to 
+        psychopy logging, and returns the list of the other events.
+        """
+        other_events=[]
+        for e in events:
+            if e[DeviceEvent.EVENT_TYPE_ID_INDEX]==LogEvent.EVENT_TYPE_ID:
+                psycho_logging.log(e[cls._log_text_index],e[cls._log_level_index],e[cls._log_time_index])
+            else:
+                other_events.append(e)
+        return other_events
+
+class ioHubRequestTicket(object):
+    """
+    An ioHubRequestTicket is returned when a request is sent to the ioHub 
+    Process without waiting for the reply; for example by using the callAsync() 
+    method of any ioHubDeviceView method::
+        
+        pos_ticket = hub.devices.mouse.getPosition.callAsync()
+        kb_ticket = hub.devices.kb.getEvents.callAsync()
+
+        # ... do other work while the requests are processed ...
+
+        mouse_position = pos_ticket.getResult()
+        kb_events = kb_ticket.getResult()
+        
+    Any number of requests can be outstanding at the same time. Each request 
+    is sent with a request id which the ioHub Process includes in the reply, 
+    so replies are matched to the correct ticket regardless of the order 
+    results are collected in.
+
+    The state attribute of the ticket is one of BATCHED (the request is part 
+    of a request batch that has not been sent yet), SENT (the request has 
+    been sent and is waiting for its reply), REPLIED (the reply has been 
+    received) or FAILED (the request could not be sent, in which case 
+    getResult() raises the error).
+    """
+    BATCHED='BATCHED'
+    SENT='SENT'
+    REPLIED='REPLIED'
+    FAILED='FAILED'
+    
+    def __init__(self,hubClient,request_id,reply_handler=None,state=SENT):
+        self._hubClient=hubClient
+        self.request_id=request_id
+        self.state=state
+        self._reply_handler=reply_handler
+        self._error=None
+        self._reply=None
+        self._has_reply=False
+        self._has_result=False
+        self._result=None
+        self._bytes_sent=0
+        self._send_time=None
+        self._stats_type=None
+
+    def isReady(self):
+        """
+        Returns True if the reply to the request has been received from the 
+        ioHub Process, so getResult() will not block. 
+        
+        Args:
+            None
+            
+        Returns:
+            bool: True if the result of the request is available.
+        """
+        if self.state == self.SENT:
+            self._hubClient._receiveAvailableReplies()
+        return self._has_reply
+
+    def getResult(self,timeout=None):
+        """
+        Returns the result of the request, waiting for the reply from the ioHub 
+        Process if it has not been received yet.
+        
+        Args:
+            timeout (float): The maximum sec.msec to wait for the reply. None (the default) waits until the reply is received.
+            
+        Returns:
+            object: The result of the request. If the request resulted in an error on the ioHub Process, an ioHubServerError is raised.
+        """
+        if self._has_result is False:
+            if self.state == self.BATCHED:
+                raise ioHubConnectionException("The request is part of a request batch that has not been sent yet.")
+            if self.state == self.FAILED:
+                raise self._error
+            if self._has_reply is False:
+                self._hubClient._waitForReply(self,timeout)
+            errorReply=self._hubClient._isErrorReply(self._reply)
+            if errorReply:
+                raise errorReply
+            self._result=self._reply
+            if self._reply_handler:
+                self._result=self._reply_handler(self._reply)
+            self._has_result=True
+        return self._result
+
+    def _setReply(self,reply):
+        self._reply=reply
+        self._has_reply=True
+        self.state=self.REPLIED
+
+    def _setError(self,error):
+        self._error=error
+        self._has_reply=True
+        self.state=self.FAILED
+
+class ioHubRequestBatch(object):
+    """
+    ioHubRequestBatch is the context manager returned by 
+    ioHubConnection.batchRequests(). Any device method calls, and any calls 
+    to ioHubConnection.sendMessageEvent(), made within the with block are 
+    collected instead of being sent right away. When the with block ends, 
+    the collected calls are sent to the ioHub Process as a single request,
+    and the ioHub Process replies with all the results at once.
+    
+    Within the with block, each device method call returns an 
+    ioHubRequestTicket, the result of which is available once the block
+    has ended::
+        
+        with hub.batchRequests():
+            pos_ticket = mouse.getPosition()
+            kb_ticket = keyboard.getEvents()
+            hub.sendMessageEvent('FRAME_START')
+        
+        mouse_position = pos_ticket.getResult()
+        kb_events = kb_ticket.getResult()
+    """
+    def __init__(self,hubClient):
+        self._hubClient=hubClient
+        self._requests=[]
+        self._tickets=[]
+
+    def __enter__(self):
+        self._hubClient._active_batch=self
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self._hubClient._active_batch=None
+        if exc_type is None:
+            self.flush()
+        else:
+            # the requests are not sent, so their tickets fail with the error
+            # that ended the with block.
+            self._failTickets(self._tickets,ioHubConnectionException("The request batch was not sent: %s"%(exc_value,)))
+            self._requests=[]
+            self._tickets=[]
+        return False
+
+    def flush(self):
+        """
+        Sends any requests collected so far to the ioHub Process and waits 
+        for the reply, giving each request's ticket its result. The batch can
+        continue to be used after it has been flushed.
+        
+        Args:
+            None
+            
+        Returns:
+            int: The number of requests that were sent.
+        """
+        requests=self._requests
+        tickets=self._tickets
+        if len(requests)==0:
+            return 0
+        self._requests=[]
+        self._tickets=[]
+        
+        error=None
+        try:
+            r=self._hubClient._sendToHubServerAsync(('BATCH',requests)).getResult()
+            for ticket,reply in zip(tickets,r[1]):
+                ticket._setReply(reply)
+        except Exception, e:
+            error=e
+            raise
+        finally:
+            # every ticket is resolved, even if the batch request failed.
+            if error is None:
+                error=ioHubConnectionException("No reply was received for the request in the request batch.")
+            self._failTickets([t for t in tickets if t.state == ioHubRequestTicket.BATCHED],error)
+        return len(requests)
+
+    @staticmethod
+    def _failTickets(tickets,error):
+        for ticket in tickets:
+            ticket._setError(error)
+
+    def _addRequest(self,ioHubMessage,reply_handler=None):
+        ticket=ioHubRequestTicket(self._hubClient,None,reply_handler,ioHubRequestTicket.BATCHED)
+        self._requests.append(ioHubMessage)
+        self._tickets.append(ticket)
+        return ticket
+
+class ioHubTransportStats(object):
+    """
+    The transport statistics of one type of request sent to the ioHub 
+    Process: the number of requests, bytes sent and received, number of 
+    replies that needed more than one packet, and histograms of the round 
+    trip time and of the time the ioHub Server spent handling the request.
+    Times are in sec.msec.
+    """
+    # upper edges of the histogram bins used for round trip and handling times.
+    TIME_BIN_EDGES=(0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,1.0)
+    
+    def __init__(self):
+        self.count=0
+        self.bytes_sent=0
+        self.bytes_received=0
+        self.multipacket_count=0
+        self.round_trip_time=Histogram(self.TIME_BIN_EDGES)
+        self.server_time=Histogram(self.TIME_BIN_EDGES)
+
+    def addRequest(self,bytes_sent,bytes_received,chunk_count,round_trip_time,server_time):
+        self.count+=1
+        self.bytes_sent+=bytes_sent
+        self.bytes_received+=bytes_received
+        if chunk_count:
+            self.multipacket_count+=1
+        self.round_trip_time.add(round_trip_time)
+        if server_time is not None:
+            self.server_time.add(server_time)
+
+    def toDict(self):
+        return dict(count=self.count,bytes_sent=self.bytes_sent,bytes_received=self.bytes_received,
+                    multipacket_count=self.multipacket_count,round_trip_time=self.round_trip_time.toDict(),
+                    server_time=self.server_time.toDict())
+
+class ioHubEventSubscription(object):
+    """
+    An ioHubEventSubscription is returned by ioHubConnection.subscribeToEvents().
+    Once created, the ioHub Process pushes any events matching the subscription
+    to the Experiment Process as soon as they have been processed, so they 
+    do not need to be polled for using getEvents(). 
+    
+    Events are received by a background thread. If a callback was given when
+    the subscription was created, it is called by the receiver thread with 
+    the list of new events each time events arrive. Otherwise events are 
+    buffered and can be retrieved by calling the subscription's getEvents() 
+    method::
+        
+        kb_sub = hub.subscribeToEvents(event_types=[EventConstants.KEYBOARD_PRESS])
+        
+        # ...
+        
+        if kb_sub.waitForEvents(timeout=1.0):
+            for kb_event in kb_sub.getEvents():
+                print kb_event.key
+        
+        kb_sub.cancel()
+    """
+    def __init__(self,hubClient,event_types=None,device_labels=None,callback=None,as_type='namedtuple',buffer_length=1024):
+        self._hubClient=hubClient
+        self._callback=callback
+        self._conversionMethod=ioHubConnection._getEventConversionMethod(as_type)
+        self._events=deque(maxlen=buffer_length)
+        self._events_lock=threading.Lock()
+        self._events_available=threading.Event()
+
+        local_path=None
+        if hubClient._transport == 'unix':
+            local_path=os.path.join(tempfile.gettempdir(),'iohub_sub_%d_%d.sock'%(os.getpid(),id(self)))
+        self._connection=EventSubscriptionConnection(hubClient._transport,local_path)
+
+        device_class_names=None
+        if device_labels:
+            device_class_names=[hubClient.deviceByLabel[label].device_class for label in device_labels]
+
+        r=hubClient._sendToHubServer(('RPC','addEventSubscription',(self._connection.getAddress(),event_types,device_class_names)))
+        self.subscription_id=r[2]
+
+        self._running=True
+        self._receiver_thread=threading.Thread(target=self._receiveEvents)
+        self._receiver_thread.daemon=True
+        self._receiver_thread.start()
+
+    def getEvents(self):
+        """
+        Returns any events that have been received for the subscription since
+        the last call to getEvents(), removing them from the subscription's 
+        event buffer. Always returns an empty list if the subscription was 
+        created with a callback.
+        
+        Args:
+            None
+            
+        Returns:
+            list: The events received, oldest first, in the as_type format given when the subscription was created.
+        """
+        with self._events_lock:
+            events=list(self._events)
+            self._events.clear()
+            self._events_available.clear()
+        return events
+
+    def waitForEvents(self,timeout=None):
+        """
+        Blocks until the subscription has events available from getEvents(),
+        or until timeout sec.msec have passed.
+        
+        Args:
+            timeout (float): The maximum time to wait. None (the default) waits until events arrive.
+            
+        Returns:
+            bool: True if events are available.
+        """
+        self._events_available.wait(timeout)
+        return self._events_available.isSet()
+
+    def isActive(self):
+        return self._running
+
+    def cancel(self):
+        """
+        Cancels the subscription. The ioHub Process stops sending events for
+        it, and the receiver thread exits.
+        
+        Args:
+            None
+            
+        Returns:
+            None
+        """
+        if self._running is False:
+            return
+        self._running=False
+        try:
+            if self._hubClient.udp_client:
+                self._hubClient._sendToHubServer(('RPC','removeEventSubscription',(self.subscription_id,)))
+        finally:
+            self._receiver_thread.join(1.0)
+            self._connection.close()
+            if self in self._hubClient._event_subscriptions:
+                self._hubClient._event_subscriptions.remove(self)
+
+    def _receiveEvents(self):
+        while self._running:
+            try:
+                if not self._connection.isDataAvailable(0.25):
+                    continue
+                result,address=self._connection.receive()
+            except:
+                if self._running:
+                    printExceptionDetailsToStdErr()
+                    continue
+                break
+
+            if result[0] != 'SUBSCRIBED_EVENTS':
+                continue
+
+            events=result[2]
+            if self._conversionMethod:
+                events=[self._conversionMethod(el) for el in events]
+
+            if self._callback:
+                try:
+                    self._callback(events)
+                except:
+                    printExceptionDetailsToStdErr()
+            else:
+                with self._events_lock:
+                    self._events.extend(events)
+                    self._events_available.set()
+
 class ioHubDeviceView(object):
     """
     ioHubDeviceView is used by the ioHubConnection class to create a PsychoPy 
@@ -123,23 +512,46 @@ class ioHubDeviceView(object):
     Device instance. This allows a PsychoPy experiment to call device methods 
     that are actually interpreted on the ioHub Process as if the device method 
     calls were being made locally.
+
+    Each device method also has a callAsync() method, which sends the method 
+    call to the ioHub Process and returns an ioHubRequestTicket right away, 
+    so several device method calls can be in progress at the same time::
+        
+        ticket = my_device.getEvents.callAsync()
+        # ...
+        events = ticket.getResult()
     """
-    def __init__(self,hubClient,name,dclass):
+    def __init__(self,hubClient,name,dclass,methods=None,configuration=None):
         self.hubClient=hubClient
         self.name=name
         self.device_class=dclass
         self._preRemoteMethodCallFunctions=dict()
         self._postRemoteMethodCallFunctions=dict()
 
-        r=self.hubClient._sendToHubServer(('EXP_DEVICE','GET_DEV_INTERFACE',dclass))
-        self._methods=r[1]
+        if methods is None:
+            r=self.hubClient._sendToHubServer(('EXP_DEVICE','GET_DEV_INTERFACE',dclass))
+            methods=r[1]
+        self._methods=methods
+
+        # Each device method gets a persistent DeviceRPC instance attribute,
+        # so method access does not go through __getattr__. Methods with a 
+        # pre or post call function are removed again so __getattr__ is used.
+        for method_name in self._methods:
+            if not hasattr(ioHubDeviceView,method_name):
+                setattr(self,method_name,DeviceRPC(self.hubClient,self.device_class,method_name))
+
+        # The device configuration does not change, so if it is known it is 
+        # returned locally instead of by an RPC.
+        self._configuration=configuration
+        if configuration is not None:
+            self.getConfiguration=self._getCachedConfiguration
 
     def __getattr__(self,name):
         if name in self._methods:
             if name in self._preRemoteMethodCallFunctions:
                 f,ka=self._preRemoteMethodCallFunctions[name]
                 f(ka)
-            r = DeviceRPC(self.hubClient._sendToHubServer,self.device_class,name)
+            r = DeviceRPC(self.hubClient,self.device_class,name)
             if name in self._postRemoteMethodCallFunctions:
                 f,ka=self._postRemoteMethodCallFunctions[name]
                 f(ka)
@@ -147,11 +559,16 @@ class ioHubDeviceView(object):
         raise AttributeError(self,name)
 
     def setPreRemoteMethodCallFunction(self,methodName,functionCall,**kwargs):
+        self.__dict__.pop(methodName,None)
         self._preRemoteMethodCallFunctions[methodName]=(functionCall,kwargs)
 
     def setPostRemoteMethodCallFunction(self,methodName,functionCall,**kwargs):
+        self.__dict__.pop(methodName,None)
         self._postRemoteMethodCallFunctions[methodName]=(functionCall,kwargs)
 
+    def _getCachedConfiguration(self):
+        return self._configuration
+
     def getName(self):
         """
         Gets the name given to the device in the ioHub configuration file.
@@ -325,7 +742,6 @@ class ioHubConnection(object):
         # >> current mouse position:  [-211.0, 371.0]
         
     """
-    _replyDictionary=dict()
     def __init__(self,ioHubConfig=None,ioHubConfigAbsPath=None):        
         if ioHubConfig:
             if not isinstance(ioHubConfig,dict):
@@ -334,6 +750,32 @@ class ioHubConnection(object):
         # udp port setup
         self.udp_client = None
 
+        # shared memory event ring, if enabled in the ioHub config.
+        self._event_ring = None
+
+        # id to send with the next request to the ioHub Process, and the 
+        # tickets of requests that have not received their reply yet.
+        self._next_request_id=0
+        self._pending_requests=dict()
+
+        # the ioHubRequestBatch collecting requests, while a 
+        # batchRequests() with block is active.
+        self._active_batch=None
+
+        # the cursor of this connection in the ioHub Process global event 
+        # buffer, as returned by the last read.
+        self._event_cursor=0
+
+        # the transport type being used to talk to the ioHub Process, and any
+        # active event subscriptions.
+        self._transport='udp'
+        self._event_subscriptions=[]
+
+        # ioHubTransportStats for each type of request sent to the ioHub 
+        # Process, and if they should be printed when the ioHub Process is shut down.
+        self._transport_stats=dict()
+        self._dump_transport_stats=False
+
         # the dynamically generated object that contains an attribute for
         # each device registed for monitoring with the ioHub server so
         # that devices can be accessed experiment process side by device name.
@@ -425,7 +867,7 @@ class ioHubConnection(object):
         """
         return self._experimentMetaData
         
-    def getEvents(self,device_label=None,as_type ='namedtuple'):
+    def getEvents(self,device_label=None,as_type ='namedtuple',event_types=None,since_time=None,until_time=None,max_count=None,fields=None):
         """
         Retrieve any events that have been collected by the ioHub Process from 
         monitored devices since the last call to getEvents() or clearEvents().
@@ -433,8 +875,10 @@ class ioHubConnection(object):
         By default all events for all monitored devices are returned, 
         with each event being represented as a namedtuple of all event attributes.
         
-        When events are retrieved from an event buffer, they are removed from 
-        that buffer as well.
+        When events are retrieved from a Device Event Buffer, they are removed 
+        from that buffer as well. Events in the Global Event Buffer are not 
+        removed, since other readers may also be reading them, but are never
+        returned to the same ioHubConnection twice.
 
         If events are only needed from one device instead of all devices, 
         providing a valid device name as the device_label argument will
@@ -454,41 +898,181 @@ class ioHubConnection(object):
             
 			as_type (str): Indicates how events should be represented when they are returned to the user. Default: 'namedtuple'.
 
+            event_types (list): Only return events with one of the given event type ids. Default: None (all event types).
+
+            since_time (float): Only return events with a time >= since_time. Default: None.
+
+            until_time (float): Only return events with a time <= until_time. Default: None.
+
+            max_count (int): Return at most max_count events, oldest first. Default: None (no limit).
+
+            fields (list): Attribute names to return for each event. Each event then only holds the values of those attributes, which greatly reduces the amount of data sent by the ioHub Process. Events are returned as a namedtuple, or a dict if as_type is 'dict', with the given field names. Default: None (all attributes).
+
+        Filtering and field selection are done by the ioHub Process, before the 
+        events are sent. For device level requests, events that do not match 
+        the criteria are left in the Device Event Buffer. For the Global Event 
+        Buffer, events that do not match, and matching events beyond max_count,
+        are returned by later calls from this connection.
+
         Returns:
             tuple: A tuple of event objects, where the event object type is defined by the 'as_type' parameter.
         """
+        filtered=event_types is not None or since_time is not None or until_time is not None or max_count is not None
 
         r=None
         if device_label is None:
-            events=self._getEvents()
-            if events is None:
-                r=self.allEvents    
+            if filtered or fields:
+                # Events already received from the ioHub Process (during wait())
+                # are older than any still on the server, so are considered first.
+                r,self.allEvents=filterEvents(list(self.allEvents),event_types,since_time,until_time,max_count)
+                if fields and r:
+                    r=projectEvents(r,fields)
+                if max_count is None or max_count > len(r):
+                    if max_count is not None:
+                        max_count=max_count-len(r)
+                    events=self._getEvents(dict(event_type_ids=event_types,since_time=since_time,until_time=until_time,max_count=max_count,fields=fields))
+                    if events:
+                        r.extend(events)
             else:
-                self.allEvents.extend(events)
-                r=self.allEvents
-            self.allEvents=[]
+                events=self._getEvents()
+                if events is None:
+                    r=self.allEvents    
+                else:
+                    self.allEvents.extend(events)
+                    r=self.allEvents
+                self.allEvents=[]
         else:
             d=self.deviceByLabel[device_label]
-            r=d.getEvents()
+            filter_kwargs=dict(event_type_ids=event_types,since_time=since_time,until_time=until_time,max_count=max_count,fields=fields)
+            r=d.getEvents(asType='list',**dict([(k,v) for k,v in filter_kwargs.iteritems() if v is not None]))
+            if r and not fields and d.device_class == 'Experiment':
+                # LogEvents are sent to psychopy logging, not returned.
+                r=DeviceRPC._logLogEvents(r)
   
         if r:
-            if as_type == 'list':
-                return r
-
-            conversionMethod=None
-            if as_type =='namedtuple':
-                conversionMethod=self._eventListToNamedTuple
-            elif as_type == 'dict':
-                conversionMethod=self._eventListToDict
-            elif as_type == 'object':
-                conversionMethod=self._eventListToObject
-            
+            if fields:
+                conversionMethod=self._getProjectedEventConversionMethod(as_type,fields)
+            else:
+                conversionMethod=self._getEventConversionMethod(as_type)
             if conversionMethod:
                 return [conversionMethod(el) for el in r]
             return r
 
         return []
         
+    def getEventArrays(self,event_types=None,since_time=None,until_time=None,max_count=None):
+        """
+        Retrieve the events collected by the ioHub Process from monitored 
+        devices that this connection has not yet read, as one numpy 
+        structured array per event type. 
+        
+        The ioHub Process sends each event type's events as the raw data of a 
+        structured array using the event class's EVENT_ARRAY_DTYPE, which is
+        its NUMPY_DTYPE with the time fields as float64, so no per event 
+        conversion is done in either process. This is much faster than 
+        getEvents() when many events, like eye tracker samples, are being 
+        retrieved.
+
+        As with getEvents(), reading does not remove events from the Global
+        Event Buffer. Each connection keeps a cursor, the position in the 
+        buffer after the events it has read, which each read moves past the
+        events returned; events that do not match the criteria are returned
+        by a later read. clearEvents() moves the cursor past all events in 
+        the buffer. Other readers of the Global Event Buffer, such as 
+        another ioHubConnection, are not affected by this connection's reads.
+        
+        Args:
+            event_types (list): Only return events with one of the given event type ids. Default: None (all event types).
+
+            since_time (float): Only return events with a time >= since_time. Default: None.
+
+            until_time (float): Only return events with a time <= until_time. Default: None.
+
+            max_count (int): Return at most max_count events in total, oldest first. Default: None (no limit).
+
+        Returns:
+            dict: event type id -> numpy structured array of the events of that type. Arrays created from data sent by the ioHub Process are read only.
+        """
+        filters=dict(event_type_ids=event_types,since_time=since_time,until_time=until_time,max_count=max_count)
+
+        # Events already received from the ioHub Process (during wait())
+        # are older than any still on the server, so are considered first.
+        local_events,self.allEvents=filterEvents(list(self.allEvents),event_types,since_time,until_time,max_count)
+        arrays=eventsToArrays(local_events)
+        if max_count is not None:
+            filters['max_count']=max_count-len(local_events)
+            if filters['max_count'] <= 0:
+                return arrays
+
+        if self._event_ring is not None:
+            remote_arrays=eventsToArrays(self._getEvents(filters)).items()
+        else:
+            r=self._sendToHubServer(('GET_EVENT_ARRAYS',self._getEventReadFilters(filters)))
+            self._event_cursor=r[2]
+            remote_arrays=[(etype,N.frombuffer(data,dtype=EventConstants.getClass(etype).EVENT_ARRAY_DTYPE)) for etype,data in r[1]]
+
+        for etype,earray in remote_arrays:
+            if etype in arrays:
+                arrays[etype]=N.concatenate((arrays[etype],earray))
+            else:
+                arrays[etype]=earray
+        return arrays
+
+    def getEventsAsArray(self,device_label=None,event_type=None,since_time=None,until_time=None,max_count=None,peek=False):
+        """
+        Retrieve events as numpy structured arrays, one per event type, using
+        the event class's
+        EVENT_ARRAY_DTYPE, which is its NUMPY_DTYPE with the time fields as 
+        float64. Each array is created from the data sent by the ioHub 
+        Process in a single numpy call, so, unlike getEvents(), no per event
+        object is created. This makes it well suited to analysing many events
+        at once, for example detecting saccades in the eye samples of a trial.
+
+        If device_label is the name of a device, the events are read from 
+        that device's Device Event Buffer, and are removed from it unless 
+        peek is True. If device_label is None (the default), the events of 
+        all devices are read from the Global Event Buffer, the same way as
+        by getEventArrays(): the events returned are those this connection 
+        has not yet read, and reading them does not affect other readers of
+        the buffer.
+
+        Args:
+            device_label (str): The name of the device to get events for, or None to get events from the Global Event Buffer. Default: None.
+
+            event_type (int): If given, only events with this event type id are returned. Default: None (all event types).
+
+            since_time (float): Only return events with a hub time >= since_time. Default: None.
+
+            until_time (float): Only return events with a hub time <= until_time. Default: None.
+
+            max_count (int): Return at most max_count events in total, oldest first. Events that are not returned stay in the buffer, and are returned by a later call. Default: None (no limit).
+
+            peek (bool): If True, the returned events are left in the Device Event Buffer. Only supported when device_label is given; an ioHubError is raised if peek is True and device_label is None. Default: False.
+
+        Returns:
+            numpy.ndarray or dict: If event_type is given, the structured array of events of that type, which is empty if there are none. Otherwise a dict of event type id -> structured array of the events of that type. Arrays created from data sent by the ioHub Process are read only.
+        """
+        if device_label is None:
+            if peek is True:
+                raise ioHubError("getEventsAsArray(): peek is only supported for Device Event Buffers.")
+            event_types=None
+            if event_type is not None:
+                event_types=[event_type,]
+            arrays=self.getEventArrays(event_types,since_time,until_time,max_count)
+        else:
+            arrays=dict()
+            device_arrays=self.deviceByLabel[device_label].getEventArrays(event_type,since_time=since_time,
+                                                            until_time=until_time,max_count=max_count,peek=peek)
+            for etype,data in device_arrays:
+                arrays[etype]=N.frombuffer(data,dtype=EventConstants.getClass(etype).EVENT_ARRAY_DTYPE)
+
+        if event_type is not None:
+            earray=arrays.get(event_type)
+            if earray is None:
+                earray=N.zeros(0,dtype=EventConstants.getClass(event_type).EVENT_ARRAY_DTYPE)
+            return earray
+        return arrays
+
     def clearEvents(self,device_label=None):
         """
         Clears events from the ioHub Process's Global Event Buffer (by default) so 
@@ -497,7 +1081,8 @@ class ioHubConnection(object):
         
         If device_label is None ( the default ), then all events in the ioHub
         *Global Event Buffer* are cleared, which leaves the *Device Event Buffers*
-        unaffected.
+        unaffected. Events in the *Global Event Buffer* are only cleared for this
+        connection; other readers of the buffer still receive them.
         
         If device_label is a str giving a valid device name, then events 
         that were received from that device are returned and the
@@ -515,7 +1100,14 @@ class ioHubConnection(object):
             int: The number of events cleared by the request on the ioHub Server.
         """
         if device_label is None or device_label.lower() == 'all':
-            self._sendToHubServer(('RPC','clearEventBuffer'))
+            if self._event_ring is not None:
+                self._event_ring.clear()
+            else:
+                # Events in the global event buffer are not removed by reads,
+                # so clearing them is done by moving this connection's cursor
+                # past the last event in the buffer.
+                r=self._sendToHubServer(('RPC','getEventBufferPosition'))
+                self._event_cursor=r[2]
             self.allEvents=[]
             if device_label and device_label.lower() == 'all':
                 [self.deviceByLabel[label].clearEvents() for label in self.deviceByLabel]
@@ -527,6 +1119,38 @@ class ioHubConnection(object):
                 return True
             return False
 
+    def subscribeToEvents(self,event_types=None,device_labels=None,callback=None,as_type='namedtuple'):
+        """
+        Subscribe to events from the ioHub Process. Rather than the Experiment 
+        Process polling for new events using getEvents(), the ioHub Process 
+        pushes events that match the subscription to the Experiment Process
+        as soon as they have been processed. 
+        
+        Events are received by a background thread of the returned 
+        ioHubEventSubscription. If callback is given, it is called by that 
+        thread with a list of the new events each time events are received; 
+        otherwise events are buffered until retrieved with the subscription's 
+        getEvents() method.
+        
+        Subscriptions do not change the contents of the Global or Device Event 
+        Buffers; events are still available from getEvents() as well.
+        
+        Args:
+            event_types (list): The event type ids to subscribe to, from iohub.constants.EventConstants. None (the default) subscribes to all event types.
+
+            device_labels (list): The names of the devices to subscribe to events from. None (the default) subscribes to events from all devices.
+
+            callback (callable): Optional function to call with each list of events received.
+
+            as_type (str): How events should be represented; the same values as accepted by getEvents(). Default: 'namedtuple'.
+
+        Returns:
+            ioHubEventSubscription: The subscription, which can be cancelled by calling its cancel() method.
+        """
+        subscription=ioHubEventSubscription(self,event_types,device_labels,callback,as_type)
+        self._event_subscriptions.append(subscription)
+        return subscription
+
     def wait(self,delay,check_hub_interval=0.02):
         """
         Pause the experiment script execution for a duration equal to the
@@ -553,7 +1177,7 @@ class ioHubConnection(object):
         Args:
             delay (float/double): The sec.msec period that the PsychoPy Process should wait before returning from the function call.
 			
-			check_hub_interval (float/double): The sec.msec interval after which a call to getEvents() will be made by the wait() function. Any returned events are stored in a local buffer. This is repeated every check_hub_interval sec.msec until the delay time has passed. Default is every 0.02 sec ( 20.0 msec ).
+			check_hub_interval (float/double): The sec.msec interval after which a call to getEvents() will be made by the wait() function. Any returned events are stored in a local buffer. This is repeated every check_hub_interval sec.msec until the delay time has passed. Default is every 0.02 sec ( 20.0 msec ). If any event subscriptions are active, events are pushed to them by the ioHub Process and no polling is done.
 
         Returns:
             float/double: The actual duration of the delay in sec.msec format.
@@ -561,7 +1185,7 @@ class ioHubConnection(object):
         stime=Computer.currentTime()
         targetEndTime=stime+delay
 
-        if check_hub_interval < 0:
+        if check_hub_interval < 0 or self._event_subscriptions:
             check_hub_interval=0
         
         if check_hub_interval > 0:
@@ -608,8 +1232,73 @@ class ioHubConnection(object):
         Returns:
             bool: True
         """
-        self._sendToHubServer(('EXP_DEVICE','EVENT_TX',[MessageEvent._createAsList(text,prefix=prefix,msg_offset=offset,sec_time=sec_time),]))
+        request=('EXP_DEVICE','EVENT_TX',[MessageEvent._createAsList(text,prefix=prefix,msg_offset=offset,sec_time=sec_time),])
+        if self._active_batch is not None:
+            self._active_batch._addRequest(request)
+        else:
+            self._sendToHubServer(request)
         return True
+
+    def batchRequests(self):
+        """
+        Returns a context manager that collects the device method calls and 
+        sendMessageEvent() calls made within a with block, sending them to 
+        the ioHub Process together as one request when the block ends. 
+        This lets several calls made each frame cost a single round trip::
+            
+            with hub.batchRequests():
+                pos_ticket = hub.devices.mouse.getPosition()
+                kb_ticket = hub.devices.kb.getEvents()
+                hub.sendMessageEvent('FRAME_START')
+            
+            mouse_position = pos_ticket.getResult()
+            kb_events = kb_ticket.getResult()
+
+        Within the with block, device method calls return an ioHubRequestTicket 
+        instead of the method result. Other ioHubConnection methods, like 
+        getEvents(), are still sent to the ioHub Process right away.
+        
+        Args:
+            None
+        
+        Returns:
+            ioHubRequestBatch: the request batch context manager.
+        """
+        return ioHubRequestBatch(self)
+
+    def getTransportStats(self,request_type=None,reset=False):
+        """
+        Returns the statistics kept for each type of request sent to the ioHub 
+        Process: the number of requests sent, the bytes sent and received, the 
+        number of replies that were sent as more than one packet, and 
+        histograms of the round trip time and of the time the ioHub Server 
+        spent handling each request. Use these to decide which calls are worth 
+        batching, and to tune the check_hub_interval and socket buffer sizes.
+        
+        Request types are the ioHub message type, with the method name added 
+        for RPC requests and the device class and method name added for 
+        device method calls; for example 'GET_EVENTS', 'RPC.enableHighPriority'
+        or 'DEV_RPC.Mouse.getPosition'.
+        
+        Args:
+            request_type (str): The request type to return the statistics of. If None (the default), the statistics of all request types are returned.
+            
+            reset (bool): True = clear the statistics after they are returned.
+            
+        Returns:
+            dict: request type : statistics dict, with count, bytes_sent, bytes_received, multipacket_count, round_trip_time and server_time keys. The time keys hold a dict with the bin_edges, counts, count, mean, min and max of the times, in sec.msec. If request_type is given, only its statistics dict is returned, or None if no requests of that type have been sent.
+        """
+        if request_type is not None:
+            stats=self._transport_stats.get(request_type)
+            if stats is None:
+                return None
+            if reset:
+                del self._transport_stats[request_type]
+            return stats.toDict()
+        all_stats=dict([(rtype,stats.toDict()) for rtype,stats in self._transport_stats.iteritems()])
+        if reset:
+            self._transport_stats.clear()
+        return all_stats
                 
     def initializeConditionVariableTable(self, condition_variable_provider):
         """
@@ -689,7 +1378,69 @@ class ioHubConnection(object):
             None
         """
         self._sendToHubServer(('RPC','disableHighPriority'))
+
+    def enableRealTimePriority(self,disable_gc=False):
+        """
+        Sets the priority of the **ioHub Process** to real-time priority
+        and optionally (default is False) disables the python GC if the
+        disable_gc parameter is set to True. 
+        
+        On Linux, the ioHub Process is given a real-time scheduling policy,
+        and its memory is locked, as set in the realtime_mode section of the
+        ioHub config. This needs the CAP_SYS_NICE capability, or an rtprio
+        limit, for the user running the experiment; without it, a warning is
+        printed by the ioHub Process and a higher nice level is used if
+        allowed.
         
+        This method is not supported on OS X at this time.
+
+        Args:
+            disable_gc(bool): True = Turn off the Python Garbage Collector. False (Default) = Leave the Garbage Collector running.
+
+        Returns:
+            bool: True if the ioHub Process priority was increased.
+        """
+        r=self._sendToHubServer(('RPC','enableRealTimePriority',(disable_gc,)))
+        return r[2]
+
+    def disableRealTimePriority(self):
+        """
+        Sets the priority of the **ioHub Process** back to normal priority,
+        undoing enableRealTimePriority().
+
+        Args:
+            None
+            
+        Returns: 
+            None
+        """
+        self._sendToHubServer(('RPC','disableRealTimePriority'))
+        
+    def getServerStats(self):
+        """
+        Returns performance statistics kept by the ioHub Process for each 
+        device, which can be used to check that the ioHub Process keeps up 
+        with the devices being monitored.
+        
+        For each device, the 'native_event_buffer' statistics hold the overflow
+        counts of the device's native event buffer, and the 'event_processing' statistics hold the number of 
+        events processed, the largest number of native events that were 
+        waiting to be processed, and a histogram of the delay between the 
+        time each event was logged by the device and the time it was 
+        processed. For devices that are polled, the 'polling' statistics hold 
+        the configured and achieved poll rate, the number of polls and missed 
+        poll periods, the average events produced per poll, and histograms 
+        of the poll lateness and poll duration. Times are in sec.msec.
+
+        Args:
+            None
+            
+        Returns:
+            dict: A dict with a 'devices' key, holding a dict of device name : device stats dict, and a 'global_event_buffer' key, holding the length, high-water mark, overflow policy and overflow, dropped and spilled event counts of the global event buffer. The same buffer stats are given for each device's native event buffer.
+        """
+        r=self._sendToHubServer(('RPC','getServerStats'))
+        return r[2]
+
     def getProcessAffinity(self):
         """
         Returns the current **ioHub Process** Affinity setting, 
@@ -757,7 +1508,7 @@ class ioHubConnection(object):
         try:
             r=self._sendToHubServer(('EXP_DEVICE','ADD_DEVICE',device_class,device_config))
             device_class_name, dev_name, device_rpc_interface=r[2]      
-            return self._addDeviceView(dev_name,device_class_name)
+            return self._addDeviceView(dev_name,device_class_name,device_rpc_interface)
         except:
             printExceptionDetailsToStdErr()
             raise ioHubError("Error in _addDeviceToMonitor: device_class: ",device_class," . device_config: ",device_config)    
@@ -852,7 +1603,12 @@ class ioHubConnection(object):
                 tfile.close()
 
             
-        self.udp_client=UDPClientConnection(remote_port=ioHubConfig.get('udp_port',9000))
+        self._dump_transport_stats=ioHubConfig.get('dump_transport_stats',False)
+        self._transport=getTransportType(ioHubConfig)
+        if self._transport == 'unix':
+            self.udp_client=UnixDatagramClientConnection(getUnixSocketPath(ioHubConfig))
+        else:
+            self.udp_client=UDPClientConnection(remote_port=ioHubConfig.get('udp_port',9000))
 
         run_script=os.path.join(IO_HUB_DIRECTORY,'server.py')
         subprocessArgList=[sys.executable,run_script,"%.6f"%Computer.globalClock.getLastResetTime(),rootScriptPath,ioHubConfigAbsPath]
@@ -943,6 +1699,10 @@ class ioHubConnection(object):
 
         #print '* IOHUB SERVER ONLINE *'        
 
+        # open the shared memory event ring created by the ioHub Process
+        if ioHubConfig.get('event_ring',{}).get('enable',False) is True:
+            self._event_ring=SharedMemoryEventRing(getEventRingFilePath(ioHubConfig.get('udp_port',9000)))
+
         # save ioHub ProcessID to file so next time it is started, it can be checked and killed if necessary
 
         try:
@@ -1035,16 +1795,25 @@ class ioHubConnection(object):
             if device_config.get('enable',True) is True:
                 deviceList.append((device_config.get('name',device_class_name.lower()),device_class_name))
 
+        # get the name, interface and configuration of every device created by
+        # the ioHub Process in one request.
+        r=self._sendToHubServer(('EXP_DEVICE','GET_DEVICE_BOOTSTRAP'))
+        bootstrap=dict([(dname,(dinterface,dconfig)) for dname,dclass,dinterface,dconfig in r[1]])
+        
         # create an experiment process side device object to allow access to the public interface of the
         # ioHub device via transparent IPC.
         for name,device_class_name in deviceList:
             try:
-                self._addDeviceView(name,device_class_name)
+                if name not in bootstrap:
+                    print2err("_createDeviceList: Device was not created by the ioHub Process: ",name)
+                    continue
+                methods,configuration=bootstrap[name]
+                self._addDeviceView(name,device_class_name,methods,configuration)
             except:
                 print2err("_createDeviceList: Error adding class. ")
                 printExceptionDetailsToStdErr()
 
-    def _addDeviceView(self,name,device_class_name):
+    def _addDeviceView(self,name,device_class_name,methods=None,configuration=None):
         try:
             device_class_name=str(device_class_name)
             class_name_start=device_class_name.rfind('.')
@@ -1074,7 +1843,7 @@ class ioHubConnection(object):
                 
             #ioHub.print2err("Creating ioHubDeviceView for device name {0}, path {1}, class {1}".format(name,device_module_path,device_class_name))
     
-            d=ioHubDeviceView(self,name,device_class_name)
+            d=ioHubDeviceView(self,name,device_class_name,methods,configuration)
             #ioHub.print2err("Created ioHubDeviceView: {0}".format(d))
             setattr(self.devices,name,d)
             self.deviceByLabel[name]=d
@@ -1090,60 +1859,130 @@ class ioHubConnection(object):
         the PsychoPy Process to the ioHub Process, and then wait for the reply
         from the ioHub Process before returning.
 
-        The ioHubConnection currently blocks until the request is fulfilled and
-        and a response is received from the ioHub server.
+        The ioHubConnection blocks until the request is fulfilled and
+        and a response is received from the ioHub server. Use 
+        _sendToHubServerAsync to send a request without waiting for the reply.
 
-        TODO: An aysnc. version could be added if desired. 
+        Args:
+            messageList (tuple): ioHub Server Message to send.
 
-        Instead of using callbacks, I prefer the idea of the client sending a
-        request and getting a request ticket # back from the ioHub server
-        right away, indicating that the job has been submitted for processing.
-        The ioHubConnection can then ask the ioHub Server for the status of the
-        job ticket based on ticket number.
-        
-        When the ticket number result is ready, it is sent back as the reply to
-        the status request. This **aysnc. mode will be necessary** when the 
-        worker process is added to the ioHub framework to handle long running 
-        job requests from the PsychoPy process; for example to load an image
-        into a shared memory space, perform long running computations, etc.
+        Return (object): the message response from the ioHub Server process.
+        """
+        return self._sendToHubServerAsync(ioHubMessage).getResult()
+
+    def _sendToHubServerAsync(self,ioHubMessage,reply_handler=None):
+        """
+        Sends a message to the ioHub Process and returns without waiting for
+        the reply. The message is sent with a request id, which the ioHub Server 
+        includes in its reply, so any number of requests can be outstanding 
+        and their replies collected in any order.
 
         Args:
             messageList (tuple): ioHub Server Message to send.
+            
+            reply_handler (callable): Optional function that is given the reply from the ioHub Server, the return value of which becomes the result of the request.
 
-        Return (object): the message response from the ioHub Server process.
+        Return (ioHubRequestTicket): the ticket used to get the result of the request.
         """
+        request_id=self._next_request_id
+        self._next_request_id=(request_id+1)%0x7FFFFFFF
+
+        ticket=ioHubRequestTicket(self,request_id,reply_handler)
+        self._pending_requests[request_id]=ticket
+        ticket._stats_type=self._getRequestStatsType(ioHubMessage)
+        ticket._send_time=currentSec()
 
         # send request to host, return is # bytes sent.
-        bytes_sent=self.udp_client.sendTo(ioHubMessage)
+        ticket._bytes_sent=self.udp_client.sendTo((request_id,)+tuple(ioHubMessage))
+        return ticket
+
+    @staticmethod
+    def _getRequestStatsType(ioHubMessage):
+        """
+        Returns the request type that the transport stats of ioHubMessage are
+        kept under.
+        """
+        request_type=ioHubMessage[0]
+        if request_type == 'RPC':
+            return 'RPC.%s'%(ioHubMessage[1])
+        if request_type == 'EXP_DEVICE':
+            if ioHubMessage[1] == 'DEV_RPC':
+                return 'DEV_RPC.%s.%s'%(ioHubMessage[2],ioHubMessage[3])
+            return 'EXP_DEVICE.%s'%(ioHubMessage[1])
+        return request_type
+
+    def _addTransportStats(self,ticket,server_time):
+        stats=self._transport_stats.get(ticket._stats_type)
+        if stats is None:
+            stats=self._transport_stats[ticket._stats_type]=ioHubTransportStats()
+        stats.addRequest(ticket._bytes_sent,self.udp_client.lastReceiveByteCount,
+                         self.udp_client.lastReceiveChunkCount,currentSec()-ticket._send_time,server_time)
+
+    def _printTransportStats(self):
+        """
+        Prints the transport stats of each request type to stdout.
+        """
+        print 'ioHub Transport Stats (times in msec):'
+        print '%-48s %8s %10s %10s %10s %12s %12s %8s'%('request type','count','rtt mean','rtt max','srv mean','bytes sent','bytes recv','multi')
+        for rtype,stats in sorted(self._transport_stats.iteritems()):
+            srv_mean=stats.server_time.getMean() or 0.0
+            print '%-48s %8d %10.3f %10.3f %10.3f %12d %12d %8d'%(rtype,stats.count,stats.round_trip_time.getMean()*1000.0,
+                                                              stats.round_trip_time.max*1000.0,srv_mean*1000.0,
+                                                              stats.bytes_sent,stats.bytes_received,stats.multipacket_count)
+
+    def _receiveReply(self,timeout=None):
+        """
+        Receives one reply from the ioHub Process and gives it to the ticket 
+        of the request it is for. If timeout is not None, False is returned 
+        if no reply was received within timeout sec.msec.
+        """
+        if timeout is not None and not self.udp_client.isDataAvailable(timeout):
+            return False
 
         # wait for response from ioHub server, return is result ( decoded already ), and Hub address (ip4,port).
         result,address=self.udp_client.receive()
 
-        # store result received in an address based dictionary (incase we ever support multiple ioHub Servers)
-        ioHubConnection._addResponseToHistory(result,bytes_sent,address)
+        if isinstance(result[0],(int,long)):
+            request_id,reply=result[0],result[1]
+            ticket=self._pending_requests.pop(request_id,None)
+            if ticket:
+                ticket._setReply(reply)
+                server_time=None
+                if len(result) > 2:
+                    server_time=result[2]
+                self._addTransportStats(ticket,server_time)
+            return True
 
-        # check if the reply is an error or not. If it is, raise the error.
+        # A reply without a request id is an error that the ioHub Server could
+        # not associate with a request, for example a failure to send a reply.
         errorReply=self._isErrorReply(result)
         if errorReply:
             raise errorReply
+        return True
 
-        #Otherwise return the result
-        return result
+    def _receiveAvailableReplies(self):
+        """
+        Receives any replies that have already arrived from the ioHub Process,
+        without blocking.
+        """
+        while self.udp_client.isDataAvailable():
+            self._receiveReply()
 
-    @classmethod
-    def _addResponseToHistory(cls,result,bytes_sent,address):
+    def _waitForReply(self,ticket,timeout=None):
         """
-        Adds a response from the ioHub to an ip:port based dictionary. 
-        Not used right now, but may be useful if we ever support
-        a client connecting to > 1 ioHub.
+        Receives replies from the ioHub Process until the reply for ticket 
+        has arrived. Replies for other outstanding requests received while
+        waiting are given to their own tickets.
         """
-        address=str(address)
-        if address in cls._replyDictionary:
-            cls._replyDictionary[address].append((result,bytes_sent))
+        if timeout is None:
+            while ticket._has_reply is False:
+                self._receiveReply()
         else:
-            cls._replyDictionary[address]=deque(maxlen=128)
-            cls._replyDictionary[address].append((result,bytes_sent))
-
+            end_time=currentSec()+timeout
+            while ticket._has_reply is False:
+                remaining=end_time-currentSec()
+                if remaining <= 0.0 or self._receiveReply(remaining) is False:
+                    raise ioHubConnectionException("Timeout waiting for reply to ioHub request %d"%(ticket.request_id))
 
 
     def _sendExperimentInfo(self,experimentInfoDict):
@@ -1199,19 +2038,77 @@ class ioHubConnection(object):
         self._sessionMetaData=sessionInfoDict
         return sessionInfoDict['session_id']
         
-    def _getEvents(self):
+    def _getEvents(self,filters=None):
         """
         Sends a request to the ioHub Server for any new device events from the global server event buffer.
         The events are returned and the global ioHub server event buffer is cleared.
+        If the shared memory event ring is enabled, events are read directly from
+        the ring instead, and no request is sent to the ioHub Server.
+
+        If filters is given, it is a dict with the event_type_ids, since_time, 
+        until_time, max_count and fields criteria passed to getEvents(). Only
+        matching events are returned, reduced to fields if given.
 
         Args: None
         Return(tuple): list of events, or empty list if no events have occurred since last call
               to getEvents() or clearEvents(). Each event in the list is a tuple containing the ordered
               attributes of the event constructor.
         """
-        r = self._sendToHubServer(('GET_EVENTS',))
+        if self._event_ring is not None:
+            events=self._event_ring.readEvents()
+            if filters:
+                events,not_matched=filterEvents(events,filters.get('event_type_ids'),filters.get('since_time'),
+                                                filters.get('until_time'),filters.get('max_count'))
+                self.allEvents.extend(not_matched)
+                if filters.get('fields') and events:
+                    events=projectEvents(events,filters['fields'])
+            return events
+        r = self._sendToHubServer(('GET_EVENTS',self._getEventReadFilters(filters)))
+        self._event_cursor=r[2]
         return r[1]
 
+    def _getEventReadFilters(self,filters=None):
+        """
+        Returns the filters dict for a GET_EVENTS or GET_EVENT_ARRAYS request,
+        adding this connection's global event buffer cursor.
+        """
+        filters=dict(filters or {})
+        filters['cursor']=self._event_cursor
+        return filters
+
+
+    @staticmethod
+    def _getEventConversionMethod(as_type):
+        """
+        Returns the function used to convert events in list form to the 
+        as_type representation, or None if events should be left as lists.
+        """
+        if as_type == 'namedtuple':
+            return ioHubConnection._eventListToNamedTuple
+        elif as_type == 'dict':
+            return ioHubConnection._eventListToDict
+        elif as_type == 'object':
+            return ioHubConnection._eventListToObject
+        return None
+
+    _projectedEventClasses=dict()
+    @staticmethod
+    def _getProjectedEventConversionMethod(as_type,fields):
+        """
+        Returns the function used to convert events that have been reduced 
+        to the given fields to the as_type representation. 'object' is not
+        supported for such events, so a namedtuple is used instead.
+        """
+        fields=tuple(fields)
+        if as_type == 'dict':
+            return lambda valueList: dict(zip(fields,valueList))
+        elif as_type in ('namedtuple','object'):
+            ntclass=ioHubConnection._projectedEventClasses.get(fields)
+            if ntclass is None:
+                ntclass=namedtuple('ProjectedEventNT',fields)
+                ioHubConnection._projectedEventClasses[fields]=ntclass
+            return lambda valueList: ntclass(*valueList)
+        return None
 
     @staticmethod
     def _eventListToObject(eventValueList):
@@ -1267,8 +2164,15 @@ class ioHubConnection(object):
                 TimeoutError=psutil.TimeoutExpired
                 
             try:
+                for subscription in list(self._event_subscriptions):
+                    subscription.cancel()
+                if self._dump_transport_stats is True:
+                    self._printTransportStats()
                 self.udp_client.sendTo(('STOP_IOHUB_SERVER',))
                 self.udp_client.close()
+                if self._event_ring:
+                    self._event_ring.close()
+                    self._event_ring=None
                 if Computer.ioHubServerProcess:
                     if sys.platform != 'darwin': 
                         r=Computer.ioHubServerProcess.wait(timeout=5)
@@ -21,7 +21,7 @@ import numpy as N
 
 from iohub import printExceptionDetailsToStdErr, print2err, ioHubError
 import iohub.devices as D
-from iohub.devices import  DeviceEvent, Computer
+from iohub.devices import  DeviceEvent, Computer, getDeviceClass
 from iohub.constants import EventConstants
 
 parameters.MAX_NUMEXPR_THREADS=None
@@ -84,7 +84,7 @@ class ioHubpyTablesFile():
             if event_cls.IOHUB_DATA_TABLE:
                 event_table_label=event_cls.IOHUB_DATA_TABLE
                 if event_table_label not in self.TABLES:
-                    self.TABLES[event_table_label]=self.emrtFile.createTable(self._eventGroupMappings[event_table_label],eventTableLabel2ClassName(event_table_label),event_cls.NUMPY_DTYPE, title="%s %s Data"%(device_instance.__class__.__name__,eventTableLabel2ClassName(event_table_label)),filters=dfilter.copy())
+                    self.TABLES[event_table_label]=self.emrtFile.createTable(self._eventGroupMappings[event_table_label],eventTableLabel2ClassName(event_table_label),event_cls.NUMPY_DTYPE, title="%s %s Data"%(getDeviceClass(device_instance).__name__,eventTableLabel2ClassName(event_table_label)),filters=dfilter.copy())
                     self.flush()
     
                 self.addClassMapping(event_cls,self.TABLES[event_table_label])
@@ -410,17 +410,54 @@ class ioHubpyTablesFile():
                 event[DeviceEvent.EVENT_SESSION_ID_INDEX]=self.active_session_id
                 np_events.append(tuple(event))
 
-            np_array= N.array(np_events,dtype=eventClass.NUMPY_DTYPE)
+            try:
+                np_array= N.array(np_events,dtype=eventClass.NUMPY_DTYPE)
+            except (ValueError,TypeError,OverflowError,UnicodeError):
+                # At least one event can not be converted, so the events are
+                # converted one at a time; only the bad events are lost, and logged.
+                np_array=self._convertEvents(events,eventClass.NUMPY_DTYPE)
             #ioHub.print2err('np_array:',np_array)
-            etable.append(np_array)
+            if len(np_array) == 0:
+                return True
+
+            row_count=etable.nrows
+            try:
+                etable.append(np_array)
+            except tables.HDF5ExtError:
+                # rows that were written before the error are not written 
+                # again; the rest are written one at a time, so only the rows
+                # that can not be written are lost.
+                written_count=etable.nrows-row_count
+                print2err("Error saving %d events to %s, %d were saved. Saving the rest one at a time."%(len(np_array),eventClass.IOHUB_DATA_TABLE,written_count))
+                printExceptionDetailsToStdErr()
+                for i in xrange(written_count,len(np_array)):
+                    try:
+                        etable.append(np_array[i:i+1])
+                    except tables.HDF5ExtError:
+                        print2err("Error saving event: ",np_array[i])
+                        printExceptionDetailsToStdErr()
 
-            self.bufferedFlush(len(np_events))
+            self.bufferedFlush(len(np_array))
 
         except ioHubError, e:
             print2err(e)
         except:
             printExceptionDetailsToStdErr()
 
+    def _convertEvents(self,events,dtype):
+        # converts events to an array of dtype one at a time, leaving out,
+        # and logging, the events that can not be converted.
+        rows=[]
+        for event in events:
+            try:
+                rows.append(N.array([tuple(event),],dtype=dtype))
+            except (ValueError,TypeError,OverflowError,UnicodeError):
+                print2err("Error saving event: ",event)
+                printExceptionDetailsToStdErr()
+        if rows:
+            return N.concatenate(rows)
+        return N.zeros(0,dtype=dtype)
+
     def bufferedFlush(self,eventCount=1):
         # if flushCounter threshold is >=0 then do some checks. If it is < 0, then
         # flush only occurs when command is sent to ioHub, so do nothing here.
@@ -16,6 +16,7 @@ import gc, os, sys
 import collections
 from collections import deque
 from operator import itemgetter
+from heapq import heapify, heappop, heapreplace
 import numpy as N
 
 global _psutil_available
@@ -25,8 +26,29 @@ if sys.platform != 'darwin':
     import psutil
     _psutil_available=True
 
-from ..util import convertCamelToSnake, print2err,printExceptionDetailsToStdErr
+# libc access for the Linux real-time scheduling and memory locking calls
+# used by Computer.enableRealTimePriority().
+_libc=None
+if sys.platform.startswith('linux'):
+    import ctypes, ctypes.util
+    
+    SCHED_OTHER=0
+    SCHED_FIFO=1
+    SCHED_RR=2
+    MCL_CURRENT=1
+    MCL_FUTURE=2
+    
+    class _SchedParam(ctypes.Structure):
+        _fields_=[('sched_priority',ctypes.c_int)]
+
+    try:
+        _libc=ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+    except:
+        _libc=None
+
+from ..util import convertCamelToSnake, print2err,printExceptionDetailsToStdErr, BoundedEventDeque, EventArrayRingBuffer
 from ..timebase import monotonicClock
+from ..constants import EventConstants
 
 class ioDeviceError(Exception):
     def __init__(self, device, msg):
@@ -41,6 +63,8 @@ class ioDeviceError(Exception):
         return "ioDeviceError:\n\tMsg: {0:>s}\n\tDevice: {1}\n".format(self.msg,repr(self.device))
 
 class ioObjectMetaClass(type):
+    EVENT_TIME_FIELDS=('device_time','logged_time','time','delay')
+
     def __new__(meta, name, bases, dct):
         return type.__new__(meta, name, bases, dct)
     def __init__(cls, name, bases, dct):
@@ -59,6 +83,9 @@ class ioObjectMetaClass(type):
         cls._dataType=cls._baseDataTypes+cls._newDataTypes
         cls.CLASS_ATTRIBUTE_NAMES=[e[0] for e in cls._dataType]
         cls.NUMPY_DTYPE=N.dtype(cls._dataType)
+        # NUMPY_DTYPE with the event time fields as float64, used for events
+        # held in numpy arrays in memory, so times keep their precision.
+        cls.EVENT_ARRAY_DTYPE=N.dtype([(e[0],N.float64) if e[0] in ioObjectMetaClass.EVENT_TIME_FIELDS else e for e in cls._dataType])
 
         if len(cls.__subclasses__())==0 and 'DeviceEvent' in [c.__name__ for c in cls.mro()]:
             cls.namedTupleClass=collections.namedtuple(name+'NT',cls.CLASS_ATTRIBUTE_NAMES)
@@ -129,13 +156,18 @@ class ioObject(object):
         """
         return N.array([tuple(self._attribute_values),],self.NUMPY_DTYPE)
 
+    # The RPC interface of each class, built the first time it is requested.
+    _rpc_interfaces=dict()
     def _getRPCInterface(self):
-        rpcList=[]
-        dlist = dir(self)
-        for d in dlist:
-            if d[0] is not '_' and d not in ['asNumpyArray',]:
-                if callable(getattr(self,d)):
-                    rpcList.append(d)
+        rpcList=ioObject._rpc_interfaces.get(self.__class__,None)
+        if rpcList is None:
+            rpcList=[]
+            dlist = dir(self)
+            for d in dlist:
+                if d[0] is not '_' and d not in ['asNumpyArray',]:
+                    if callable(getattr(self,d)):
+                        rpcList.append(d)
+            ioObject._rpc_interfaces[self.__class__]=rpcList
         return rpcList
 
 class Computer(object):
@@ -223,7 +255,19 @@ class Computer(object):
     #: On OS X, None.
     ioHubServerProcess=None
     
-    _process_original_nice_value=-1 # used on linux.
+    #: Settings used while the process is in high or real-time priority mode.
+    #: In the ioHub Process, they are set from the realtime_mode section of
+    #: the ioHub config. The settings are:
+    #:      * policy: 'fifo' or 'rr', the Linux real-time scheduling policy used by enableRealTimePriority().
+    #:      * priority: the Linux real-time priority, from 1 to 99.
+    #:      * lock_memory: if True, enableRealTimePriority() locks the process memory with mlockall on Linux, so it can not be paged out.
+    #:      * processor_list: processor ids the process is pinned to by enableRealTimePriority() on Linux, for example CPUs isolated with the isolcpus kernel option. An empty list leaves the affinity unchanged.
+    #:      * gc_threshold: when the GC is not disabled, the gc.set_threshold() values to use; an empty list leaves the thresholds unchanged.
+    realTimeSettings=dict(policy='fifo',priority=50,lock_memory=True,processor_list=[],gc_threshold=[])
+    
+    _process_original_nice_value=None # used on linux.
+    _linux_realtime_state=None
+    _saved_gc_state=None # (gc enabled, gc thresholds) before the GC was tuned.
     
     def __init__(self):
         print2err("WARNING: Computer is a static class, no need to create an instance. just use Computer.xxxxxx")
@@ -237,7 +281,10 @@ class Computer(object):
         useful for the duration of a trial, for example, where you enable at
         start of trial and disable at end of trial. 
         
-        On Linux, the process is set to a nice level of 10.
+        On Linux, the process is set to a nice level of -10. Setting a negative
+        nice level needs the CAP_SYS_NICE capability, or a high enough nice
+        limit; if it can not be set, a warning is printed and the priority is
+        left unchanged.
 
         This method is not supported on OS X.
         
@@ -249,18 +296,113 @@ class Computer(object):
             return False
         
         if Computer.inHighPriorityMode is False:
-            if disable_gc:
-                gc.disable()
+            Computer._tuneGC(disable_gc)
             if Computer.system=='win32':
                 Computer.currentProcess.set_nice(psutil.HIGH_PRIORITY_CLASS)
                 Computer.inHighPriorityMode=True
             elif Computer.system=='linux2':
-                current_nice=Computer.currentProcess.get_nice()
+                Computer.inHighPriorityMode=Computer._setLinuxNice(-10)
+
+    @staticmethod
+    def _setLinuxNice(nice):
+        # lower nice levels are higher priority; the level is only ever raised.
+        try:
+            current_nice=Computer.currentProcess.get_nice()
+            if current_nice > nice:
+                Computer.currentProcess.set_nice(nice)
                 Computer._process_original_nice_value=current_nice
-                if current_nice <10:
-                    Computer.currentProcess.set_nice(10)
-                    Computer.currentProcess.get_nice()
-                    Computer.inHighPriorityMode = True
+            return True
+        except psutil.AccessDenied:
+            print2err("WARNING: Could not set the nice level of process {0} to {1}. CAP_SYS_NICE, or a higher nice limit, is needed.".format(Computer.currentProcessID,nice))
+            return False
+
+    @staticmethod
+    def _tuneGC(disable_gc):
+        if Computer._saved_gc_state is None:
+            Computer._saved_gc_state=(gc.isenabled(),gc.get_threshold())
+        if disable_gc:
+            gc.disable()
+        elif Computer.realTimeSettings.get('gc_threshold'):
+            gc.set_threshold(*Computer.realTimeSettings['gc_threshold'])
+        # objects created before the time critical period are moved out of
+        # the collected generations, where gc.freeze is available.
+        freeze=getattr(gc,'freeze',None)
+        if freeze is not None:
+            gc.collect()
+            freeze()
+
+    @staticmethod
+    def _restoreGC():
+        # the GC is left as it was before _tuneGC() was called, which may be
+        # disabled.
+        if Computer._saved_gc_state is None:
+            return
+        enabled,threshold=Computer._saved_gc_state
+        Computer._saved_gc_state=None
+        if enabled:
+            gc.enable()
+        else:
+            gc.disable()
+        gc.set_threshold(*threshold)
+        unfreeze=getattr(gc,'unfreeze',None)
+        if unfreeze is not None:
+            unfreeze()
+
+    @staticmethod
+    def _enableLinuxRealTime(settings):
+        """
+        Sets the SCHED_FIFO or SCHED_RR scheduling policy for the current
+        process, and, depending on settings, locks its memory and pins it to
+        the given processors. Returns False, after printing a warning, if the
+        scheduling policy can not be set, which needs the CAP_SYS_NICE 
+        capability or a high enough rtprio limit.
+        """
+        if _libc is None:
+            print2err("WARNING: libc could not be loaded; Linux real-time scheduling is not available.")
+            return False
+
+        policy_name=settings.get('policy','fifo')
+        policy=dict(fifo=SCHED_FIFO,rr=SCHED_RR).get(policy_name)
+        if policy is None:
+            print2err("WARNING: Unknown real-time scheduling policy: {0}. Use 'fifo' or 'rr'.".format(policy_name))
+            return False
+
+        original_param=_SchedParam()
+        original_policy=_libc.sched_getscheduler(0)
+        _libc.sched_getparam(0,ctypes.byref(original_param))
+        if _libc.sched_setscheduler(0,policy,ctypes.byref(_SchedParam(settings.get('priority',50)))) != 0:
+            print2err("WARNING: Could not set the {0} real-time scheduling policy: {1}. CAP_SYS_NICE, or an rtprio limit, is needed.".format(policy_name,os.strerror(ctypes.get_errno())))
+            return False
+        state=dict(policy=original_policy,priority=original_param.sched_priority,memory_locked=False,affinity=None)
+
+        if settings.get('lock_memory',True):
+            if _libc.mlockall(MCL_CURRENT|MCL_FUTURE) == 0:
+                state['memory_locked']=True
+            else:
+                print2err("WARNING: Could not lock the process memory: {0}. A higher memlock limit is needed.".format(os.strerror(ctypes.get_errno())))
+
+        processor_list=settings.get('processor_list')
+        if processor_list:
+            try:
+                state['affinity']=Computer.currentProcess.get_cpu_affinity()
+                Computer.currentProcess.set_cpu_affinity(processor_list)
+            except Exception, e:
+                state['affinity']=None
+                print2err("WARNING: Could not pin the process to processors {0}: {1}".format(processor_list,e))
+
+        Computer._linux_realtime_state=state
+        return True
+
+    @staticmethod
+    def _disableLinuxRealTime():
+        state=Computer._linux_realtime_state
+        Computer._linux_realtime_state=None
+        if _libc.sched_setscheduler(0,state['policy'],ctypes.byref(_SchedParam(state['priority']))) != 0:
+            print2err("WARNING: Could not restore the scheduling policy: {0}".format(os.strerror(ctypes.get_errno())))
+        if state['memory_locked']:
+            _libc.munlockall()
+        if state['affinity'] is not None:
+            Computer.currentProcess.set_cpu_affinity(state['affinity'])
                     
 
     @staticmethod
@@ -273,7 +415,14 @@ class Computer(object):
         it is not possible to set a process to real-time priority, so high-priority
         is used instead.
         
-        On Linux, the process is set to a nice level of 16.
+        On Linux, the process is given the SCHED_FIFO (or SCHED_RR) real-time
+        scheduling policy at the priority given in Computer.realTimeSettings,
+        its memory is locked so it can not be paged out, and it is pinned to
+        the processors in Computer.realTimeSettings['processor_list'], if any.
+        If the real-time policy can not be set, because the process does not
+        have the CAP_SYS_NICE capability or a high enough rtprio limit, a 
+        warning is printed and the nice level is set to -16 instead, if
+        allowed.
         
         This method is not supported on OS X.
 
@@ -285,24 +434,19 @@ class Computer(object):
             return False
 
         if Computer.inHighPriorityMode is False:
-            if disable_gc:
-                gc.disable()
+            Computer._tuneGC(disable_gc)
             if Computer.system=='win32':
                 Computer.currentProcess.set_nice(psutil.REALTIME_PRIORITY_CLASS)
                 Computer.inHighPriorityMode = True
             elif Computer.system=='linux2':
-                current_nice=Computer.currentProcess.get_nice()
-                Computer._process_original_nice_value=current_nice
-                if current_nice <16:
-                    Computer.currentProcess.set_nice(16)
-                    Computer.currentProcess.get_nice()
-                    Computer.inHighPriorityMode = True
+                Computer.inHighPriorityMode=Computer._enableLinuxRealTime(Computer.realTimeSettings) or Computer._setLinuxNice(-16)
 
     @staticmethod
     def disableRealTimePriority():
         """
         Sets the priority of the Current Process back to normal priority
-        and enables the python GC. In general you would call 
+        and restores the python GC to the state it was in before priority was
+        increased, which re-enables it if it was disabled. In general you would call 
         enableRealTimePriority() at start of trial and call 
         disableHighPriority() at end of trial.
 
@@ -324,7 +468,8 @@ class Computer(object):
     def disableHighPriority():
         """
         Sets the priority of the Current Process back to normal priority
-        and enables the python GC. In general you would call 
+        and restores the python GC to the state it was in before priority was
+        increased, which re-enables it if it was disabled. In general you would call 
         enableHighPriority() at start of trial and call 
         disableHighPriority() at end of trial.
 
@@ -341,14 +486,19 @@ class Computer(object):
             print2err("Computer.disableHighPriority is not supported on OS X")
             return False
         try:
+            Computer._restoreGC()
             if Computer.inHighPriorityMode is True:
-                gc.enable()
                 if Computer.system=='win32':
                     Computer.currentProcess.set_nice(psutil.NORMAL_PRIORITY_CLASS)
                     Computer.inHighPriorityMode=False
-                elif Computer.system=='linux2' and Computer._process_original_nice_value > 0:
-                    Computer.currentProcess.set_nice(Computer._process_original_nice_value)
+                elif Computer.system=='linux2':
                     Computer.inHighPriorityMode=False
+                    if Computer._linux_realtime_state is not None:
+                        Computer._disableLinuxRealTime()
+                    if Computer._process_original_nice_value is not None:
+                        nice=Computer._process_original_nice_value
+                        Computer._process_original_nice_value=None
+                        Computer.currentProcess.set_nice(nice)
         except psutil.AccessDenied:
             print2err("WARNING: Could not disable increased priority for process {0}".format(Computer.currentProcessID))
 
@@ -864,7 +1014,7 @@ class Device(ioObject):
         self._configuration=kwargs
         self._last_poll_time=0
         self._last_callback_time=0
-        self._native_event_buffer=deque(maxlen=self.event_buffer_length)
+        self._native_event_buffer=BoundedEventDeque(self.event_buffer_length,self.name)
 
         
     def getConfiguration(self):
@@ -902,6 +1052,20 @@ class Device(ioObject):
         
             asType (str): Optional kwarg giving the object type to return events as. Valid values are 'namedtuple' (the default), 'dict', 'list', or 'object'.
 
+            event_type_ids (list): Optional kwarg giving a list of event type ids to return events for.
+
+            since_time (float): Optional kwarg; only events with a hub time >= since_time are returned.
+
+            until_time (float): Optional kwarg; only events with a hub time <= until_time are returned.
+
+            max_count (int): Optional kwarg; at most max_count events are returned; the oldest matching events, or the newest if newest_first is True. Matching events that are not returned stay in the device event buffer.
+
+            newest_first (bool): Optional kwarg; if True, events are returned newest first.
+
+            peek (bool): Optional kwarg; if True, the returned events are left in the device event buffer, regardless of clearEvents. For example, to get the last 50 msec of samples every frame, use getEvents(since_time=Computer.getTime()-0.05, peek=True).
+            
+            fields (list): Optional kwarg giving the event attribute names to return. Each event is returned with only the values of those attributes, in the order given. 
+
         Returns:   
             (list): New events that the ioHub has received since the last getEvents() or clearEvents() call to the device. Events are ordered by the ioHub time of each event, older event at index 0. The event object type is determined by the asType parameter passed to the method. By default a namedtuple object is returned for each event. 
         """
@@ -915,20 +1079,140 @@ class Device(ioObject):
             eventTypeID=kwargs.get('event_type_id',None)
             clearEvents=kwargs.get('clearEvents',True)
 
+        event_type_ids=kwargs.get('event_type_ids',None)
+        since_time=kwargs.get('since_time',None)
+        until_time=kwargs.get('until_time',None)
+        max_count=kwargs.get('max_count',None)
+        fields=kwargs.get('fields',None)
+
+        newest_first=kwargs.get('newest_first',False)
+        if kwargs.get('peek',False) is True:
+            clearEvents=False
+
         currentEvents=[]
-        if eventTypeID:
-            currentEvents=list(self._iohub_event_buffer.get(eventTypeID,[]))
+        if event_type_ids or since_time is not None or until_time is not None or max_count is not None or newest_first:
+            if eventTypeID:
+                event_type_ids=[eventTypeID,]
+            elif not event_type_ids:
+                event_type_ids=self._iohub_event_buffer.keys()
+
+            # The events of each type in the time range are found with a
+            # binary search of the type's time index, and only those (at most
+            # max_count of them) are read, so the cost does not depend on how
+            # many events are buffered.
+            windows=dict()
+            for etype in event_type_ids:
+                ring=self._iohub_event_buffer.get(etype,None)
+                if ring:
+                    start,stop=ring.getIndexRange(since_time,until_time)
+                    if max_count is not None:
+                        if newest_first:
+                            start=max(start,stop-max_count)
+                        else:
+                            stop=min(stop,start+max_count)
+                    if stop > start:
+                        windows[etype]=(start,ring.getEvents(start,stop))
+            currentEvents=mergeEvents([type_events for start,type_events in windows.itervalues()])
+            if max_count is not None and len(currentEvents) > max_count:
+                if newest_first:
+                    currentEvents=currentEvents[len(currentEvents)-max_count:]
+                else:
+                    currentEvents=currentEvents[:max_count]
+
             if clearEvents is True and len(currentEvents)>0:
-                self._iohub_event_buffer[eventTypeID]=[]
+                # the returned events of each type are consecutive in its 
+                # buffer; the oldest, or with newest_first the newest, of 
+                # the type's events in the time range.
+                type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
+                returned_counts=dict()
+                for e in currentEvents:
+                    returned_counts[e[type_index]]=returned_counts.get(e[type_index],0)+1
+                for etype,count in returned_counts.iteritems():
+                    start,type_events=windows[etype]
+                    if newest_first:
+                        start+=len(type_events)-count
+                    self._iohub_event_buffer[etype].remove(start,start+count)
+
+            if newest_first:
+                currentEvents.reverse()
+        elif eventTypeID:
+            ring=self._iohub_event_buffer.get(eventTypeID,None)
+            if ring:
+                currentEvents=ring.getEvents()
+                if clearEvents is True:
+                    ring.clear()
         else:
-            [currentEvents.extend(l) for l in self._iohub_event_buffer.values()]
+            currentEvents=mergeEvents([ring.getEvents() for ring in self._iohub_event_buffer.values()])
             if clearEvents is True and len(currentEvents)>0:
                 self.clearEvents()
 
-        if len(currentEvents)>0:
-            sorted(currentEvents, key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
+        if fields and len(currentEvents)>0:
+            currentEvents=projectEvents(currentEvents,fields)
         return currentEvents
 
+    def getEventArrays(self,event_type_id=None,clearEvents=True,since_time=None,until_time=None,max_count=None,peek=False):
+        """
+        Returns the events in the device event buffer as the raw data of one
+        numpy structured array per event type, using the event class 
+        EVENT_ARRAY_DTYPE. The data is copied straight from the device event 
+        buffer, so no per event conversion is done. Use 
+        ioHubConnection.getEventsAsArray() to get the events as numpy arrays
+        in the Experiment Process.
+        
+        Args:
+            event_type_id (int): If given, only events of this type are returned.
+
+            clearEvents (bool): True (the default) = remove the returned events from the device event buffer.
+
+            since_time (float): Only events with a hub time >= since_time are returned. Default: None.
+
+            until_time (float): Only events with a hub time <= until_time are returned. Default: None.
+
+            max_count (int): At most max_count events are returned in total, the oldest matching events. Matching events that are not returned stay in the device event buffer. Default: None (no limit).
+
+            peek (bool): If True, the returned events are left in the device event buffer, regardless of clearEvents. Default: False.
+
+        Returns:
+            list: (event type id, str of the structured array data) for each event type with events.
+        """
+        if peek is True:
+            clearEvents=False
+
+        # the (start, stop) indexes of the events returned from each type's
+        # buffer, found with a binary search of the type's time index.
+        windows=dict()
+        for etype,ring in self._iohub_event_buffer.items():
+            if event_type_id and etype != event_type_id:
+                continue
+            if ring:
+                start,stop=ring.getIndexRange(since_time,until_time)
+                if max_count is not None:
+                    stop=min(stop,start+max_count)
+                if stop > start:
+                    windows[etype]=(start,stop)
+
+        if max_count is not None and len(windows) > 1:
+            # keep the max_count oldest of the events of all types.
+            etypes=windows.keys()
+            times=N.concatenate([self._iohub_event_buffer[etype].getIndexValues(*windows[etype]) for etype in etypes])
+            if len(times) > max_count:
+                type_positions=N.concatenate([N.repeat(i,windows[etype][1]-windows[etype][0]) for i,etype in enumerate(etypes)])
+                oldest=type_positions[N.argsort(times,kind='mergesort')[:max_count]]
+                counts=N.bincount(oldest,minlength=len(etypes))
+                for i,etype in enumerate(etypes):
+                    start,stop=windows[etype]
+                    if counts[i] > 0:
+                        windows[etype]=(start,start+int(counts[i]))
+                    else:
+                        del windows[etype]
+
+        event_arrays=[]
+        for etype,(start,stop) in windows.iteritems():
+            ring=self._iohub_event_buffer[etype]
+            event_arrays.append((etype,ring.getElements()[start:stop].tostring()))
+            if clearEvents is True:
+                ring.remove(start,stop)
+        return event_arrays
 
     def clearEvents(self):
         """
@@ -944,7 +1228,8 @@ class Device(ioObject):
         Returns:
             None
         """
-        self._iohub_event_buffer.clear()
+        for ring in self._iohub_event_buffer.itervalues():
+            ring.clear()
 
     def enableEventReporting(self,enabled=True):
         """
@@ -974,18 +1259,33 @@ class Device(ioObject):
         return self._is_reporting_events
 
     def _handleEvent(self,e):
-        etypelist=self._iohub_event_buffer.get(e[DeviceEvent.EVENT_TYPE_ID_INDEX],None)
-        if etypelist is None:
-            self._iohub_event_buffer[e[DeviceEvent.EVENT_TYPE_ID_INDEX]]=[e,]
-        else:
-            etypelist.append(e)
-        
+        Device._handleEvents(self,[e,])
+        
+    def _handleEvents(self,events):
+        # events must all be of the same type. Each event type has a ring
+        # buffer of event_buffer_length events, using the event class
+        # EVENT_ARRAY_DTYPE.
+        etype=events[0][DeviceEvent.EVENT_TYPE_ID_INDEX]
+        ring=self._iohub_event_buffer.get(etype,None)
+        if ring is None:
+            event_class=EventConstants.getClass(etype)
+            ring=EventArrayRingBuffer(self.event_buffer_length,event_class.EVENT_ARRAY_DTYPE,
+                                      DeviceEvent.EVENT_HUB_TIME_INDEX)
+            self._iohub_event_buffer[etype]=ring
+        try:
+            ring.extend(events)
+        except:
+            print2err("Error adding events to the device event buffer: ",self.name)
+            printExceptionDetailsToStdErr()
+
     def _getNativeEventBuffer(self):
         return self._native_event_buffer
 
     def _addNativeEventToBuffer(self,e):
         if self.isReportingEvents():
             self._native_event_buffer.append(e)
+            if self._iohub_server:
+                self._iohub_server._event_wakeup.signal()
 
     def _addEventListener(self,l,eventTypeIDs):
         lca=0
@@ -1132,6 +1432,19 @@ class Device(ioObject):
         """
         return False        
 
+    def _getIOHubEventObjects(self,native_events):
+        """
+        Converts a list of native events, in the order they were added to the
+        native event buffer, into a list of ioHub events. Native events that 
+        _getIOHubEventObject returns None for are left out.
+        
+        The default implementation calls _getIOHubEventObject for each native
+        event. Device subclasses that can convert native events faster as a 
+        batch can override this method.
+        """
+        convert=self._getIOHubEventObject
+        return [e for e in [convert(ne) for ne in native_events] if e is not None]
+
     def _getIOHubEventObject(self,native_event_data):
         """
         The _getIOHubEventObject method is called by the ioHub Process to convert 
@@ -1367,6 +1680,153 @@ class DeviceEvent(ioObject):
     @classmethod
     def createEventAsNamedTuple(cls,valueList):
         return cls.namedTupleClass(*valueList)
+
+#
+# Event filtering and field projection, used by event retrieval methods
+# that accept event type, time window, count and field arguments.
+#
+
+# The Device class of each registered device proxy; an object the ioHub Server
+# uses in place of a device, like the WorkerDeviceProxy of a device that is
+# run in a device worker process.
+_device_proxy_classes=dict()
+
+def registerDeviceProxy(proxy,device_class):
+    """
+    Registers proxy as standing in for a device of class device_class.
+    """
+    _device_proxy_classes[proxy]=device_class
+
+def unregisterDeviceProxy(proxy):
+    _device_proxy_classes.pop(proxy,None)
+
+def getDeviceClass(device):
+    """
+    Returns the Device class of device, or the class of the device it stands 
+    in for if device is a registered device proxy.
+    """
+    return _device_proxy_classes.get(device,device.__class__)
+
+def filterEvents(events,event_type_ids=None,since_time=None,until_time=None,max_count=None):
+    """
+    Splits a list of events (in list form) into those that match the given 
+    criteria and those that do not. Criteria that are None are not applied.
+
+    Args:
+        events (list): the events to filter, in the order they should be considered.
+        
+        event_type_ids (list): event type ids that match.
+        
+        since_time (float): events with a hub time >= since_time match.
+        
+        until_time (float): events with a hub time <= until_time match.
+        
+        max_count (int): at most max_count events match; the first max_count events that meet the other criteria. 
+    
+    Returns:
+        tuple: (matching events, non matching events); both lists keep the order of events.
+    """
+    time_index=DeviceEvent.EVENT_HUB_TIME_INDEX
+    type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
+    matched=[]
+    not_matched=[]
+    for e in events:
+        if (max_count is not None and len(matched)>=max_count) or \
+                (event_type_ids and e[type_index] not in event_type_ids) or \
+                (since_time is not None and e[time_index] < since_time) or \
+                (until_time is not None and e[time_index] > until_time):
+            not_matched.append(e)
+        else:
+            matched.append(e)
+    return matched,not_matched
+
+_projection_indexes=dict()
+def mergeEvents(streams):
+    """
+    Merges lists of events that are each in hub time order into a single list
+    in hub time order, using a heap based k-way merge, so the cost is linear
+    in the number of events. Events with the same hub time keep the order of
+    the streams they are in.
+
+    Args:
+        streams (list): lists of events (in list form), each in hub time order.
+
+    Returns:
+        list: the events of all streams, in hub time order.
+    """
+    time_index=DeviceEvent.EVENT_HUB_TIME_INDEX
+    streams=[s for s in streams if s]
+    if len(streams) == 0:
+        return []
+    if len(streams) == 1:
+        return list(streams[0])
+
+    heap=[]
+    for i,s in enumerate(streams):
+        stream=iter(s)
+        e=stream.next()
+        heap.append((e[time_index],i,e,stream))
+    heapify(heap)
+
+    merged=[]
+    append=merged.append
+    while heap:
+        t,i,e,stream=heap[0]
+        append(e)
+        try:
+            e=stream.next()
+            heapreplace(heap,(e[time_index],i,e,stream))
+        except StopIteration:
+            heappop(heap)
+    return merged
+
+def projectEvents(events,fields):
+    """
+    Returns a list with each event (in list form) reduced to the values of 
+    the attribute names in fields, in that order. Events of a type that does 
+    not have a given attribute get None for it. 
+    """
+    fields=tuple(fields)
+    type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
+    projected=[]
+    for e in events:
+        etype=e[type_index]
+        indexes=_projection_indexes.get((etype,fields))
+        if indexes is None:
+            attribute_names=EventConstants.getClass(etype).CLASS_ATTRIBUTE_NAMES
+            indexes=[attribute_names.index(f) if f in attribute_names else None for f in fields]
+            _projection_indexes[(etype,fields)]=indexes
+        projected.append([e[i] if i is not None else None for i in indexes])
+    return projected
+
+def eventsToArrays(events):
+    """
+    Groups a list of events (in list form) by event type, and converts each 
+    group to a numpy structured array using the EVENT_ARRAY_DTYPE of the
+    event type's class. 
+    
+    Returns:
+        dict: event type id -> numpy structured array of the events of that type, in the order given.
+    """
+    type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
+    grouped=dict()
+    for e in events:
+        etypelist=grouped.get(e[type_index],None)
+        if etypelist is None:
+            grouped[e[type_index]]=[tuple(e),]
+        else:
+            etypelist.append(tuple(e))
+
+    arrays=dict()
+    for etype,etypelist in grouped.iteritems():
+        dtype=EventConstants.getClass(etype).EVENT_ARRAY_DTYPE
+        try:
+            arrays[etype]=N.array(etypelist,dtype=dtype)
+        except UnicodeEncodeError:
+            # non ascii text (i.e. keyboard chars) is stored utf-8 encoded in string fields.
+            etypelist=[tuple([v.encode('utf-8') if isinstance(v,unicode) else v for v in e]) for e in etypelist]
+            arrays[etype]=N.array(etypelist,dtype=dtype)
+    return arrays
 #
 # Import Devices and DeviceEvents
 #
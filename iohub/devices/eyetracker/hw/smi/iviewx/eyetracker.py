@@ -555,7 +555,9 @@ class EyeTracker(EyeTrackerDevice):
     def _handleEvent(self,ioe):
         event_type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
         if ioe[event_type_index] == EventConstants.KEYBOARD_PRESS:
-            self._kbEventQueue.append(ioe)
+            # a copy is queued, as the event's record can be reused once
+            # the event has been processed.
+            self._kbEventQueue.append(list(ioe))
             
     def isRecordingEnabled(self,*args,**kwargs):
         """
@@ -27,7 +27,7 @@ import pylink
 
 from ...... import print2err,printExceptionDetailsToStdErr, createErrorResult
 from ......constants import EventConstants, EyeTrackerConstants
-from ......util import ProgressBarDialog
+from ......util import ProgressBarDialog, EventRecordPool, holdEvents, releaseEvents
 from ..... import Computer
 from .... import EyeTrackerDevice
 from ....eye_events import *
@@ -58,6 +58,25 @@ class EyeTracker(EyeTrackerDevice):
     _host_edf_name=None
     _active_edf_file=None
     _file_transfer_progress_dialog=None
+    # The values each eye's sample fields start with; the fields EyeLink
+    # does not report are UNDEFINED.
+    # TO DO: EyeLink pyLink does not expose sample velocity fields. Patch and fix.
+    _EYE_SAMPLE_TEMPLATE=(0.0,0.0,
+                          EyeTrackerConstants.UNDEFINED,EyeTrackerConstants.UNDEFINED,
+                          EyeTrackerConstants.UNDEFINED,EyeTrackerConstants.UNDEFINED,
+                          0.0,0.0,0.0,0.0,0.0,
+                          EyeTrackerConstants.PUPIL_AREA,
+                          EyeTrackerConstants.UNDEFINED,EyeTrackerConstants.UNDEFINED,
+                          0.0,0.0,-1.0,-1.0,-1.0)
+    _BINOCULAR_SAMPLE_TEMPLATE=((0,0,0,0,0,0.0,0.0,0.0,0.0,0.0,0)+
+                                _EYE_SAMPLE_TEMPLATE+_EYE_SAMPLE_TEMPLATE+(0,))
+    _MONOCULAR_SAMPLE_TEMPLATE=((0,0,0,0,0,0.0,0.0,0.0,0.0,0.0,0,0)+
+                                _EYE_SAMPLE_TEMPLATE+(0,))
+    # records the eye samples are created in, reused once each sample event
+    # has been released by the event buffers, and is no longer the latest
+    # sample.
+    _binocular_sample_pool=EventRecordPool(_BINOCULAR_SAMPLE_TEMPLATE)
+    _monocular_sample_pool=EventRecordPool(_MONOCULAR_SAMPLE_TEMPLATE)
     # <<<
 
     # >>> Overwritten class attributes
@@ -466,7 +485,7 @@ class EyeTracker(EyeTrackerDevice):
                 EyeTrackerDevice.enableEventReporting(self,False)
                 sleep(0.05)
 
-                self._latest_sample=None
+                self._setLatestSample(None)
                 self._latest_gaze_position=None
                 return self.isRecordingEnabled()
         except Exception, e:
@@ -474,6 +493,13 @@ class EyeTracker(EyeTrackerDevice):
                     error_message="An unhandled exception occurred on the ioHub Server Process.",
                     method="EyeTracker.setRecordingState", error=e)            
 
+    def _setLatestSample(self,sample):
+        # the latest sample is held, so its record is not reused while
+        # getLastSample() can return it.
+        holdEvents((sample,))
+        releaseEvents((self._latest_sample,))
+        self._latest_sample=sample
+
     def getLastSample(self):
         """
         getLastSample returns the most recent EyeSampleEvent received
@@ -597,65 +623,36 @@ class EyeTracker(EyeTrackerDevice):
                         rightHref=rightData.getHREF()
                         rightGaze=self._eyeTrackerToDisplayCoords(rightData.getGaze())
 
-                        # TO DO: EyeLink pyLink does not expose sample velocity fields. Patch and fix.
-                        vel_x=-1.0
-                        vel_y=-1.0
-                        vel_xy=-1.0
-
-                        binocSample=[
-                                     0,
-                                     0,
-                                     0, #device id (not currently used)
-                                     Computer._getNextEventID(),
-                                     event_type,
-                                     ne.event_timestamp,
-                                     ne.logged_time,
-                                     ne.timestamp,
-                                     confidenceInterval,
-                                     ne.event_delay,
-                                     0,
-                                     leftGaze[0],
-                                     leftGaze[1],
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     leftHref[0],
-                                     leftHref[1],
-                                     leftRawPupil[0],
-                                     leftRawPupil[1],
-                                     leftPupilSize,
-                                     EyeTrackerConstants.PUPIL_AREA,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     ppd[0],
-                                     ppd[1],
-                                     vel_x,
-                                     vel_y,
-                                     vel_xy,
-                                     rightGaze[0],
-                                     rightGaze[1],
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     rightHref[0],
-                                     rightHref[1],
-                                     rightRawPupil[0],
-                                     rightRawPupil[1],
-                                     rightPupilSize,
-                                     EyeTrackerConstants.PUPIL_AREA,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     EyeTrackerConstants.UNDEFINED,
-                                     ppd[0],
-                                     ppd[1],
-                                     vel_x,
-                                     vel_y,
-                                     vel_xy,
-                                     0
-                                     ]
-
-                        self._latest_sample=binocSample
+                        # the fields not set here always hold their _BINOCULAR_SAMPLE_TEMPLATE values.
+                        binocSample=self._binocular_sample_pool.acquire()
+                        binocSample[3]=Computer._getNextEventID()
+                        binocSample[4]=event_type
+                        binocSample[5]=ne.event_timestamp
+                        binocSample[6]=ne.logged_time
+                        binocSample[7]=ne.timestamp
+                        binocSample[8]=confidenceInterval
+                        binocSample[9]=ne.event_delay
+                        binocSample[10]=0 # filter_id
+                        binocSample[11]=leftGaze[0]
+                        binocSample[12]=leftGaze[1]
+                        binocSample[17]=leftHref[0]
+                        binocSample[18]=leftHref[1]
+                        binocSample[19]=leftRawPupil[0]
+                        binocSample[20]=leftRawPupil[1]
+                        binocSample[21]=leftPupilSize
+                        binocSample[25]=ppd[0]
+                        binocSample[26]=ppd[1]
+                        binocSample[30]=rightGaze[0]
+                        binocSample[31]=rightGaze[1]
+                        binocSample[36]=rightHref[0]
+                        binocSample[37]=rightHref[1]
+                        binocSample[38]=rightRawPupil[0]
+                        binocSample[39]=rightRawPupil[1]
+                        binocSample[40]=rightPupilSize
+                        binocSample[44]=ppd[0]
+                        binocSample[45]=ppd[1]
+
+                        self._setLatestSample(binocSample)
 
                         g=[pylink.MISSING_DATA,pylink.MISSING_DATA]
                         for i in range(2):
@@ -689,47 +686,29 @@ class EyeTracker(EyeTrackerDevice):
                         href=eyeData.getHREF()
                         gaze=self._eyeTrackerToDisplayCoords(eyeData.getGaze())
 
-                        # TO DO: EyeLink pyLink does not expose sample velocity fields. Patch and fix.
-                        vel_x=-1.0
-                        vel_y=-1.0
-                        vel_xy=-1.0
-
-                        monoSample=[0,
-                                    0,
-                                    0, #device id (not currently used)
-                                    Computer._getNextEventID(),
-                                    event_type,
-                                    ne.event_timestamp,
-                                    ne.logged_time,
-                                    ne.timestamp,
-                                    confidenceInterval,
-                                    ne.event_delay,
-                                    0,
-                                    myeye,
-                                    gaze[0],
-                                    gaze[1],
-                                    EyeTrackerConstants.UNDEFINED,
-                                    EyeTrackerConstants.UNDEFINED,
-                                    EyeTrackerConstants.UNDEFINED,
-                                    EyeTrackerConstants.UNDEFINED,
-                                    href[0],
-                                    href[1],
-                                    rawPupil[0],
-                                    rawPupil[1],
-                                    pupilSize,
-                                    EyeTrackerConstants.PUPIL_AREA,
-                                    EyeTrackerConstants.UNDEFINED,
-                                    EyeTrackerConstants.UNDEFINED,
-                                    ppd[0],
-                                    ppd[1],
-                                    vel_x,
-                                    vel_y,
-                                    vel_xy,
-                                    0
-                                    ]
+                        # the fields not set here always hold their _MONOCULAR_SAMPLE_TEMPLATE values.
+                        monoSample=self._monocular_sample_pool.acquire()
+                        monoSample[3]=Computer._getNextEventID()
+                        monoSample[4]=event_type
+                        monoSample[5]=ne.event_timestamp
+                        monoSample[6]=ne.logged_time
+                        monoSample[7]=ne.timestamp
+                        monoSample[8]=confidenceInterval
+                        monoSample[9]=ne.event_delay
+                        monoSample[10]=0 # filter_id
+                        monoSample[11]=myeye
+                        monoSample[12]=gaze[0]
+                        monoSample[13]=gaze[1]
+                        monoSample[18]=href[0]
+                        monoSample[19]=href[1]
+                        monoSample[20]=rawPupil[0]
+                        monoSample[21]=rawPupil[1]
+                        monoSample[22]=pupilSize
+                        monoSample[26]=ppd[0]
+                        monoSample[27]=ppd[1]
                        #EyeTracker._eventArrayLengths['MONOC_EYE_SAMPLE']=len(monoSample)
                         self._latest_gaze_position=gaze
-                        self._latest_sample=monoSample
+                        self._setLatestSample(monoSample)
                         self._addNativeEventToBuffer(monoSample)
 
                 elif isinstance(ne,pylink.EndFixationEvent):
@@ -59,6 +59,11 @@ class ioHubKeyboardDevice(Device):
         cEvents=self._getCharEvents()
         [self._addNativeEventToBuffer(e) for e in cEvents]
 
+    def _handleEvents(self,events):
+        Device._handleEvents(self,events)
+        cEvents=self._getCharEvents()
+        [self._addNativeEventToBuffer(e) for e in cEvents]
+
     def _getCharEvents(self):
         '''
         _getCharEvents is called automatically as part of the keyboard event handling process within ioHub.
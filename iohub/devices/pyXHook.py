@@ -56,6 +56,7 @@ from keyboard.keysym2ucs import keysym2ucs
 from .. import print2err
 from ..devices import Computer
 from ..constants import EventConstants,MouseConstants
+from ..util import EventRecordPool
 
 getTime = Computer.getTime
 #######################################################################
@@ -69,6 +70,16 @@ class HookManager(threading.Thread):
     to the associated callback functions set.
     """
     DEVICE_TIME_TO_SECONDS = 0.001
+
+    # The values each key and mouse event record starts with; experiment_id,
+    # session_id, device_id, event_id, confidence_interval and delay are not
+    # set by the hook, nor are the mouse scroll_dx and scroll_x fields, which
+    # are not supported.
+    KEY_EVENT_TEMPLATE=(0,0,0,0,0,0.0,0.0,0.0,0.0,0.0,0,
+                        0,0,0,0,'',0,0)
+    MOUSE_EVENT_TEMPLATE=(0,0,0,0,0,0.0,0.0,0.0,0.0,0.0,0,
+                          0,0,0,0,0,0,0,0,0,0,0)
+
     def __init__(self):
         threading.Thread.__init__(self)
         self.finished = threading.Event()
@@ -86,6 +97,10 @@ class HookManager(threading.Thread):
         # release event. So values > 1 == auto repeat keys.
         self.key_states=dict()
 
+        # records the keyboard and mouse events are created in.
+        self._key_event_pool=EventRecordPool(self.KEY_EVENT_TEMPLATE)
+        self._mouse_event_pool=EventRecordPool(self.MOUSE_EVENT_TEMPLATE)
+
         # Compile our regex statements.
         self.isshift = re.compile('^SHIFT')
         self.iscaps = re.compile('^CAPS_LOCK')                                                                                                       
@@ -370,25 +385,21 @@ class HookManager(threading.Thread):
             ioHubEventID =EventConstants.KEYBOARD_RELEASE
 
         
-        return [[0,
-                0,
-                0, #device id (not currently used)
-                0, #to be assigned by ioHub server# Computer._getNextEventID(),
-                ioHubEventID,
-                event.time*self.DEVICE_TIME_TO_SECONDS,
-                event.iohub_logged_time,
-                event.iohub_logged_time,
-                0.0, # confidence interval not set for keybaord or mouse devices.
-                0.0, # delay not set for keybaord or mouse devices.
-                0,   # filter level not used
-                auto_repeat,
-                event.detail, #scan / Keycode of event.
-                keysym, # KeyID / VK code for key pressed
-                ucode,  # unicode value for char, otherwise, 0
-                key, # utf-8 encoded char or label for the key. (depending on whether it is a visible char or not)
-                event.state,  # The logical state of the button and modifier keys just before the event. 
-                int(storewm["handle"], base=16)
-                ],]
+        # the fields not set here always hold their KEY_EVENT_TEMPLATE values.
+        record=self._key_event_pool.acquire()
+        record[4]=ioHubEventID
+        record[5]=event.time*self.DEVICE_TIME_TO_SECONDS
+        record[6]=event.iohub_logged_time
+        record[7]=event.iohub_logged_time
+        record[10]=0 # filter_id
+        record[11]=auto_repeat
+        record[12]=event.detail #scan / Keycode of event.
+        record[13]=keysym # KeyID / VK code for key pressed
+        record[14]=ucode  # unicode value for char, otherwise, 0
+        record[15]=key # utf-8 encoded char or label for the key. (depending on whether it is a visible char or not)
+        record[16]=event.state  # The logical state of the button and modifier keys just before the event. 
+        record[17]=int(storewm["handle"], base=16)
+        return (record,)
     
     def makemousehookevent(self, event):
         """
@@ -497,28 +508,23 @@ class HookManager(threading.Thread):
             else:
                 self.pressedMouseButtons-=currentButtonID
                 
-        return[ [0,
-                0,
-                0, #device id (not currently used)
-                0, #to be assigned by ioHub server# Computer._getNextEventID(),
-                ioHubEventID,
-                event.time*self.DEVICE_TIME_TO_SECONDS ,
-                event.iohub_logged_time,
-                event.iohub_logged_time,
-                0.0, # confidence interval not set for keybaord or mouse devices.
-                0.0, # delay not set for keybaord or mouse devices.
-                0,   # filter level not used            
-                display_index, #event.DisplayIndex,
-            pressed, 
-            currentButtonID,            
-            self.pressedMouseButtons, 
-            px, #mouse x pos
-            py, # mouse y post
-            0, #scroll_dx not supported
-            0, #scroll_x
-            dy,
-            self.scroll_y, 
-            int(storewm["handle"], base=16)],]
+        # the fields not set here always hold their MOUSE_EVENT_TEMPLATE values.
+        record=self._mouse_event_pool.acquire()
+        record[4]=ioHubEventID
+        record[5]=event.time*self.DEVICE_TIME_TO_SECONDS
+        record[6]=event.iohub_logged_time
+        record[7]=event.iohub_logged_time
+        record[10]=0 # filter_id
+        record[11]=display_index #event.DisplayIndex,
+        record[12]=pressed
+        record[13]=currentButtonID
+        record[14]=self.pressedMouseButtons
+        record[15]=px #mouse x pos
+        record[16]=py # mouse y post
+        record[19]=dy
+        record[20]=self.scroll_y
+        record[21]=int(storewm["handle"], base=16)
+        return (record,)
       # TO DO: Implement multimonitor location based on mouse location support.
         # Currently always uses monitor index 0
         
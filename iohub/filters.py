@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+ioHub
+.. file: ioHub/filters.py
+
+Copyright (C) 2012-2013 iSolver Software Solutions
+Distributed under the terms of the GNU General Public License (GPL version 3 or any later version).
+
+.. moduleauthor:: Sol Simpson <sol@isolver-software.com> + contributors, please see credits section of documentation.
+.. fileauthor:: Sol Simpson <sol@isolver-software.com>
+"""
+
+from abc import ABCMeta, abstractmethod
+import numpy as N
+
+from .constants import EventConstants
+from .devices import Computer, DeviceEvent
+from .util import convertCamelToSnake
+
+class EventFilter(object):
+    """
+    EventFilter is the abstract base class of ioHub Server event filters. A
+    filter is added to one device, for the event types given in 
+    input_event_type_ids, and is given the events of those types in batches
+    as they are processed. filterEvents() returns a filtered copy of each
+    event, with the filtered field values, a new event_id, and filter_id set
+    to the filter's filter_id. The events given to the filter are not 
+    changed. The device's event listeners receive each copy after the event
+    it was made from, so event buffers and the DataStore hold both, told 
+    apart by filter_id, which is 0 for events that have not been filtered.
+    A filter's filter_id must therefore not be 0.
+
+    The values of the event fields named in fields are passed to
+    filterValues() as a 2D numpy array with one row per event, so filters
+    can be implemented with vectorized numpy operations. Subclasses must
+    implement filterValues(); filters that need to work on whole events can
+    override filterEvents() as well.
+    """
+    __metaclass__=ABCMeta
+
+    def __init__(self,filter_id,name,input_event_type_ids,fields,**kwargs):
+        if not filter_id:
+            raise ValueError("The filter_id of event filter %s must not be 0."%(name,))
+        self.filter_id=filter_id
+        self.name=name
+        self.input_event_type_ids=input_event_type_ids
+        self.fields=fields
+        self._field_indexes=dict()
+
+    def _getFieldIndexes(self,event_type_id):
+        field_indexes=self._field_indexes.get(event_type_id)
+        if field_indexes is None:
+            attribute_names=EventConstants.getClass(event_type_id).CLASS_ATTRIBUTE_NAMES
+            field_indexes=[attribute_names.index(f) for f in self.fields]
+            self._field_indexes[event_type_id]=field_indexes
+        return field_indexes
+
+    def filterEvents(self,events):
+        """
+        Returns a filtered copy of each event in events, a list of events of
+        one type. events are not changed.
+        """
+        event_type_id=events[0][DeviceEvent.EVENT_TYPE_ID_INDEX]
+        field_indexes=self._getFieldIndexes(event_type_id)
+        values=N.array([[e[i] for i in field_indexes] for e in events],dtype=N.float64)
+        filtered_values=self.filterValues(event_type_id,values).tolist()
+
+        event_id_index=DeviceEvent.EVENT_ID_INDEX
+        filter_id_index=DeviceEvent.EVENT_FILTER_ID_INDEX
+        filter_id=self.filter_id
+        filtered_events=[]
+        for e,filtered_row in zip(events,filtered_values):
+            fe=list(e)
+            fe[event_id_index]=Computer._getNextEventID()
+            fe[filter_id_index]=filter_id
+            for i,v in zip(field_indexes,filtered_row):
+                fe[i]=v
+            filtered_events.append(fe)
+        return filtered_events
+
+    @abstractmethod
+    def filterValues(self,event_type_id,values):
+        """
+        Returns the filtered version of values, a 2D numpy array with one row
+        per event and one column per filtered field.
+        """
+
+class CausalWindowFilter(EventFilter):
+    """
+    Base class of filters that compute each output value from the current
+    and the window-1 previous input values of a field. The last window-1
+    rows of input are kept for each event type, so results are continuous
+    across batches. Until window rows have been seen, the window is padded
+    with the first row.
+    """
+    def __init__(self,filter_id,name,input_event_type_ids,fields,window=5,**kwargs):
+        EventFilter.__init__(self,filter_id,name,input_event_type_ids,fields,**kwargs)
+        self.window=window
+        self._history=dict()
+        self._coefficients=self._getCoefficients()
+
+    @abstractmethod
+    def _getCoefficients(self):
+        """
+        Returns the window weights applied to the input values, oldest first.
+        """
+
+    def filterValues(self,event_type_id,values):
+        history=self._history.get(event_type_id)
+        if history is None:
+            history=N.repeat(values[:1],self.window-1,axis=0)
+        padded=N.concatenate((history,values))
+        self._history[event_type_id]=padded[len(padded)-(self.window-1):]
+
+        # each output row is the weighted sum of the window of rows ending at
+        # the matching input row.
+        result=N.zeros_like(values)
+        row_count=len(values)
+        for i,c in enumerate(self._coefficients):
+            result+=c*padded[i:i+row_count]
+        return result
+
+class MovingAverageFilter(CausalWindowFilter):
+    """
+    Replaces each field value with the mean of it and the previous window-1
+    values.
+    """
+    def _getCoefficients(self):
+        return N.ones(self.window)/self.window
+
+class SavitzkyGolayFilter(CausalWindowFilter):
+    """
+    Replaces each field value with the value at the current sample of a
+    least squares polynomial of the given order, fit to it and the previous
+    window-1 values. Compared to a moving average of the same window, this
+    reduces noise while following fast changes, like saccades, more closely.
+    """
+    def __init__(self,filter_id,name,input_event_type_ids,fields,window=7,order=2,**kwargs):
+        self.order=order
+        CausalWindowFilter.__init__(self,filter_id,name,input_event_type_ids,fields,window,**kwargs)
+
+    def _getCoefficients(self):
+        t=N.arange(-(self.window-1),1,dtype=N.float64)
+        A=t[:,N.newaxis]**N.arange(self.order+1)
+        # row 0 of the pseudo inverse gives the polynomial's constant term,
+        # which is its value at t=0, the current sample.
+        return N.linalg.pinv(A)[0]
+
+FILTER_CLASSES=dict(MovingAverageFilter=MovingAverageFilter,SavitzkyGolayFilter=SavitzkyGolayFilter)
+
+def createEventFilter(filter_config):
+    """
+    Creates an event filter from an entry of the event_filters list in the
+    ioHub config. filter_config must have 'class', 'filter_id', 'name',
+    'event_types' and 'fields' keys; any other keys are passed to the filter
+    class as keyword arguments. 'class' is the name of a filter in
+    FILTER_CLASSES, or the full module path of any EventFilter subclass.
+    """
+    filter_config=dict(filter_config)
+    class_name=filter_config.pop('class')
+    filter_class=FILTER_CLASSES.get(class_name)
+    if filter_class is None:
+        module_name,class_name=class_name.rsplit('.',1)
+        module=__import__(module_name,fromlist=[class_name])
+        filter_class=getattr(module,class_name)
+
+    filter_id=filter_config.pop('filter_id')
+    name=filter_config.pop('name')
+    event_type_ids=[getattr(EventConstants,convertCamelToSnake(event_class_name[:-5],False)) for event_class_name in filter_config.pop('event_types')]
+    fields=filter_config.pop('fields')
+    filter_config.pop('device',None)
+    return filter_class(filter_id,name,event_type_ids,fields,**filter_config)
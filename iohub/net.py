@@ -11,28 +11,182 @@ Distributed under the terms of the GNU General Public License (GPL version 3 or
 """
 
 from gevent import socket
+import socket as std_socket
 import msgpack
 import struct
+import select
+import os
+import mmap
+import sys
+import tempfile
+from collections import deque
+from .util import ioHubConnectionException
 
 MAX_PACKET_SIZE=64*1024
 
+# Requested socket send / receive buffer size for the unix domain socket
+# transport. The OS may limit the actual size (on Linux to net.core.wmem_max
+# and net.core.rmem_max).
+UNIX_SOCKET_BUFFER_SIZE=4*1024*1024
+
+# Largest datagram sent in one packet over the unix domain socket transport;
+# larger messages are sent as chunk packets. macOS limits unix domain 
+# datagrams to net.local.dgram.maxdgram, which is 2048 bytes by default.
+if sys.platform == 'darwin':
+    UNIX_MAX_DATAGRAM_SIZE=2048
+else:
+    UNIX_MAX_DATAGRAM_SIZE=128*1024
+
+# Requested socket receive buffer size for the UDP transport. It needs to
+# hold all the packets of a large multipacket reply, which can arrive 
+# faster than they are read.
+UDP_SOCKET_BUFFER_SIZE=4*1024*1024
+
+# Replies too large for one packet are sent as a sequence of chunk packets.
+# Each chunk packet starts with a CHUNK_HEADER holding CHUNK_MAGIC, the id 
+# of the multipacket message, the chunk index, the number of chunks in the
+# message, the byte offset of the chunk within the message, and the total 
+# message length. A msgpack encoded reply never starts with CHUNK_MAGIC, so 
+# chunk packets can be told apart from single packet replies.
+CHUNK_MAGIC='IOHC'
+CHUNK_HEADER=struct.Struct('!4sIHHII')
+
+# How long the receiver waits for the next chunk of an incomplete message 
+# before asking the sender to resend the missing chunks, and how many 
+# times it asks before giving up on the message.
+CHUNK_RESEND_TIMEOUT=0.05
+CHUNK_RESEND_ATTEMPTS=5
+
+def getTransportType(config):
+    """
+    Returns the transport to use for the connection between the Experiment 
+    Process and the ioHub Process, based on the 'transport' setting of the 
+    ioHub config: 'unix' for a unix domain datagram socket, or 'udp'. 
+    'unix' falls back to 'udp' on platforms that do not support unix domain
+    sockets.
+    """
+    transport=config.get('transport','udp')
+    if transport == 'unix' and hasattr(socket,'AF_UNIX'):
+        return 'unix'
+    return 'udp'
+
+def getUnixSocketPath(config):
+    """
+    Returns the path of the unix domain socket the ioHub Server listens on;
+    the 'unix_socket_path' setting of the ioHub config, or a path in the
+    temp dir based on the udp_port if it is not set.
+    """
+    path=config.get('unix_socket_path')
+    if path:
+        return path
+    return os.path.join(tempfile.gettempdir(),'iohub_%d.sock'%(config.get('udp_port',9000)))
+
+def createUnixDatagramSocket(path):
+    """
+    Creates a unix domain datagram socket bound to path, with larger than 
+    default send and receive buffers.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UNIX_SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UNIX_SOCKET_BUFFER_SIZE)
+    sock.bind(path)
+    return sock
+
+def getMaxDatagramSize(sock):
+    """
+    Returns the largest datagram that should be sent using the unix domain 
+    socket sock in one packet: UNIX_MAX_DATAGRAM_SIZE, or less if the send 
+    buffer granted by the OS is smaller. Linux reports double the send 
+    buffer size that was actually granted, so half the reported size is used.
+    """
+    return min(UNIX_MAX_DATAGRAM_SIZE,sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)//2)
+
+def unpackBuffer(data,offset,length):
+    """
+    Unpacks the msgpack encoded message held in length bytes of data 
+    (a bytearray or string) starting at offset, without copying them.
+    """
+    return msgpack.unpackb(buffer(data,offset,length),use_list=True)
+
+class MultipacketMessage(object):
+    """
+    Reassembles the chunk packets of one multipacket message, in whatever
+    order they arrive.
+    """
+    def __init__(self,msg_id,total,total_length,address):
+        self.msg_id=msg_id
+        self.address=address
+        self.resend_attempts=0
+        self._data=bytearray(total_length)
+        self._received=[False,]*total
+        self._remaining=total
+
+    def addChunk(self,index,offset,chunk):
+        """
+        Copies chunk into its place in the message. Returns True once every
+        chunk of the message has been received.
+        """
+        if self._received[index] is False:
+            self._data[offset:offset+len(chunk)]=chunk
+            self._received[index]=True
+            self._remaining-=1
+        return self._remaining == 0
+
+    def getMissingChunks(self):
+        return [i for i,r in enumerate(self._received) if r is False]
+
+    def unpack(self):
+        return unpackBuffer(self._data,0,len(self._data))
+
+def sendChunk(sock,packet_buffer,data,msg_id,index,chunk_size,address):
+    """
+    Sends chunk index of the multipacket message data to address using sock.
+    The chunk packet is assembled in packet_buffer, a bytearray of at least
+    CHUNK_HEADER.size+chunk_size bytes that is reused for every chunk, so 
+    no packet sized sub strings are created.
+    """
+    data_length=len(data)
+    total=(data_length+chunk_size-1)//chunk_size
+    offset=index*chunk_size
+    chunk_length=min(chunk_size,data_length-offset)
+    CHUNK_HEADER.pack_into(packet_buffer,0,CHUNK_MAGIC,msg_id,index,total,offset,data_length)
+    packet_length=CHUNK_HEADER.size+chunk_length
+    packet_buffer[CHUNK_HEADER.size:packet_length]=memoryview(data)[offset:offset+chunk_length]
+    sock.sendto(buffer(packet_buffer,0,packet_length),address)
+
 class SocketConnection(object):
     def __init__(self,local_host=None,local_port=None,remote_host=None,remote_port=None,rcvBufferLength=1492, broadcast=False, blocking=0, timeout=0):
         self._local_port= local_port
         self._local_host = local_host
         self._remote_host= remote_host
         self._remote_port = remote_port
+        self._remote_address = remote_host, remote_port
         self._rcvBufferLength=rcvBufferLength
         self.lastAddress=None
         self.sock=None
         self.initSocket()
 
+        # Datagrams are received directly into a preallocated buffer and 
+        # unpacked from it, so no new string is created per packet received.
+        self._rcvBuffer=bytearray(self._rcvBufferLength)
+        self._rcvView=memoryview(self._rcvBuffer)
+
+        # size in bytes, and number of chunk packets (0 for a single packet
+        # message), of the last message returned by receive().
+        self.lastReceiveByteCount=0
+        self.lastReceiveChunkCount=0
+
+        # incomplete multipacket messages, by (sender address, message id),
+        # and the keys of recently completed ones, so late duplicate chunks
+        # are ignored.
+        self._multipacketMessages=dict()
+        self._completedMultipacketMessages=deque(maxlen=64)
+        
         self.coder=msgpack
         self.packer=msgpack.Packer()
-        self.unpacker=msgpack.Unpacker(use_list=True)
         self.pack=self.packer.pack
-        self.feed=self.unpacker.feed
-        self.unpack=self.unpacker.unpack
 
     def initSocket(self,broadcast=False,blocking=0, timeout=0):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -49,33 +203,73 @@ class SocketConnection(object):
 
     def sendTo(self,data,address=None):
         if address is None:
-            address=self._remote_host, self._remote_port
+            address=self._remote_address
         d=self.pack(data)
-        byte_count=len(d)+2
-        self.sock.sendto(d+'\r\n',address)
-        return byte_count
+        self.sock.sendto(d,address)
+        return len(d)
 
     def receive(self):
         try:
-            data, address = self.sock.recvfrom(self._rcvBufferLength)
-            self.lastAddress=address
-            self.feed(data[:-2])
-            result=self.unpack()
-            if result[0] == 'IOHUB_MULTIPACKET_RESPONSE':
-                num_packets=result[1]
-
-                for p in xrange(num_packets-1):
-                    data, address = self.sock.recvfrom(self._rcvBufferLength)
-                    self.feed(data)
-
-                data, address = self.sock.recvfrom(self._rcvBufferLength)
-                self.feed(data[:-2])
-                result=self.unpack()
-            return result,address
+            while True:
+                if self._multipacketMessages and not self.isDataAvailable(CHUNK_RESEND_TIMEOUT):
+                    self._requestMissingChunks()
+                    continue
+                    
+                nbytes, address = self.sock.recvfrom_into(self._rcvBuffer)
+                self.lastAddress=address
+                if nbytes >= CHUNK_HEADER.size and self._rcvBuffer[:4] == CHUNK_MAGIC:
+                    result=self._addChunk(nbytes,address)
+                    if result is None:
+                        continue
+                    return result,address
+                self.lastReceiveByteCount=nbytes
+                self.lastReceiveChunkCount=0
+                return unpackBuffer(self._rcvBuffer,0,nbytes),address
         except Exception as e:
             print "Error during SocketConnection.receive: ",e
             raise e
 
+    def _addChunk(self,nbytes,address):
+        """
+        Adds the chunk packet held in the receive buffer to its multipacket 
+        message. Returns the unpacked message if it is now complete, 
+        otherwise None.
+        """
+        magic,msg_id,index,total,offset,total_length=CHUNK_HEADER.unpack_from(self._rcvBuffer)
+        key=(address,msg_id)
+        if key in self._completedMultipacketMessages:
+            return None
+        message=self._multipacketMessages.get(key)
+        if message is None:
+            message=MultipacketMessage(msg_id,total,total_length,address)
+            self._multipacketMessages[key]=message
+        if message.addChunk(index,offset,self._rcvView[CHUNK_HEADER.size:nbytes]):
+            del self._multipacketMessages[key]
+            self._completedMultipacketMessages.append(key)
+            self.lastReceiveByteCount=total_length
+            self.lastReceiveChunkCount=total
+            return message.unpack()
+        return None
+
+    def _requestMissingChunks(self):
+        """
+        Asks the sender of each incomplete multipacket message to resend the 
+        chunks that have not been received yet.
+        """
+        for key,message in self._multipacketMessages.items():
+            message.resend_attempts+=1
+            if message.resend_attempts > CHUNK_RESEND_ATTEMPTS:
+                del self._multipacketMessages[key]
+                raise ioHubConnectionException("Multipacket message %d is incomplete after %d resend requests."%(message.msg_id,CHUNK_RESEND_ATTEMPTS))
+            self.sendTo(('IOHUB_RESEND',message.msg_id,message.getMissingChunks()),message.address)
+
+    def isDataAvailable(self,timeout=0.0):
+        """
+        Returns True if a datagram can be read from the socket within
+        timeout sec.msec, without reading it.
+        """
+        return len(select.select([self.sock],[],[],timeout)[0])>0
+
     def close(self):
         self.sock.close()
 
@@ -85,4 +279,217 @@ class UDPClientConnection(SocketConnection):
         SocketConnection.__init__(self,remote_host=remote_host,remote_port=remote_port,rcvBufferLength=rcvBufferLength,broadcast=broadcast,blocking=blocking, timeout=timeout)
     def initSocket(self,**kwargs):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MAX_PACKET_SIZE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_SOCKET_BUFFER_SIZE)
+
+class UnixDatagramClientConnection(SocketConnection):
+    """
+    Client connection to an ioHub Server listening on a unix domain datagram 
+    socket. Message semantics are the same as for the UDPClientConnection,
+    but replies can be much larger before needing to be split over several 
+    packets. The client socket is bound to local_path, so the ioHub Server
+    has an address to reply to. Requests larger than the datagram size 
+    limit of the platform are sent as chunk packets.
+    """
+    def __init__(self,remote_path,local_path=None):
+        if local_path is None:
+            local_path=os.path.join(tempfile.gettempdir(),'iohub_client_%d.sock'%(os.getpid()))
+        self._local_path=local_path
+        self._nextMultipacketID=0
+        self._chunkBuffer=None
+        SocketConnection.__init__(self,remote_host=remote_path)
+        self._remote_address=remote_path
+    def initSocket(self,**kwargs):
+        self.sock = createUnixDatagramSocket(self._local_path)
+        self._maxDatagramSize=getMaxDatagramSize(self.sock)
+        self._rcvBufferLength=UNIX_MAX_DATAGRAM_SIZE
+    def sendTo(self,data,address=None):
+        if address is None:
+            address=self._remote_address
+        d=self.pack(data)
+        if len(d) <= self._maxDatagramSize:
+            self.sock.sendto(d,address)
+            return len(d)
+        if self._chunkBuffer is None:
+            self._chunkBuffer=bytearray(self._maxDatagramSize)
+        chunk_size=self._maxDatagramSize-CHUNK_HEADER.size
+        msg_id=self._nextMultipacketID
+        self._nextMultipacketID=(msg_id+1)%0xFFFFFFFF
+        for index in xrange((len(d)+chunk_size-1)//chunk_size):
+            sendChunk(self.sock,self._chunkBuffer,d,msg_id,index,chunk_size,address)
+        return len(d)
+    def close(self):
+        SocketConnection.close(self)
+        try:
+            os.remove(self._local_path)
+        except:
+            pass
+
+class EventSubscriptionConnection(SocketConnection):
+    """
+    The socket the ioHub Server pushes subscribed events to. A standard 
+    (non gevent) socket is used, since it is read by an event subscription's
+    receiver thread in the Experiment Process. The socket type matches the
+    transport being used for requests to the ioHub Server.
+    """
+    def __init__(self,transport='udp',local_path=None):
+        self._transport=transport
+        self._local_path=local_path
+        SocketConnection.__init__(self)
+    def initSocket(self,**kwargs):
+        if self._transport == 'unix':
+            if os.path.exists(self._local_path):
+                os.remove(self._local_path)
+            self.sock = std_socket.socket(std_socket.AF_UNIX, std_socket.SOCK_DGRAM)
+            self.sock.setsockopt(std_socket.SOL_SOCKET, std_socket.SO_RCVBUF, UNIX_SOCKET_BUFFER_SIZE)
+            self.sock.bind(self._local_path)
+            self._rcvBufferLength=UNIX_MAX_DATAGRAM_SIZE
+        else:
+            self.sock = std_socket.socket(std_socket.AF_INET, std_socket.SOCK_DGRAM)
+            self.sock.setsockopt(std_socket.SOL_SOCKET, std_socket.SO_RCVBUF, UDP_SOCKET_BUFFER_SIZE)
+            self.sock.bind(('127.0.0.1',0))
+            self._rcvBufferLength=MAX_PACKET_SIZE
+    def getAddress(self):
+        return self.sock.getsockname()
+    def close(self):
+        SocketConnection.close(self)
+        if self._local_path:
+            try:
+                os.remove(self._local_path)
+            except:
+                pass
+
+def getEventRingFilePath(udp_port):
+    """
+    Returns the path of the memory mapped file used for the shared memory
+    event ring of the ioHub Server listening on udp_port. Both the ioHub
+    Process and the Experiment Process derive the path from the hub config,
+    so it never needs to be sent over the UDP connection.
+    """
+    return os.path.join(tempfile.gettempdir(),'iohub_events_%d.ring'%(udp_port))
+
+def getWorkerRingFilePath(udp_port,device_name):
+    """
+    Returns the path of the memory mapped file used for the shared memory
+    event ring that the worker process of the named device writes its events
+    to, for the ioHub Server listening on udp_port.
+    """
+    return os.path.join(tempfile.gettempdir(),'iohub_worker_%d_%s.ring'%(udp_port,device_name))
+
+class SharedMemoryEventRing(object):
+    """
+    A single producer / single consumer ring buffer of msgpack encoded ioHub 
+    events, held in a memory mapped file that is shared by the ioHub Process 
+    (the producer) and the Experiment Process (the consumer).
+
+    The first HEADER_SIZE bytes of the file hold the total number of bytes
+    ever written, the total number of bytes ever read, and the number of 
+    events dropped because the ring was full. Event data follows the header. 
+    The producer only ever updates the write position, and only after the 
+    event bytes have been copied into the ring; the consumer only ever 
+    updates the read position. Since msgpack records are self delimiting, 
+    the consumer can unpack everything between the two positions in one go.
+    """
+    HEADER_SIZE=64
+    WRITE_POS_OFFSET=0
+    READ_POS_OFFSET=8
+    DROPPED_OFFSET=16
+    
+    def __init__(self,file_path,size=None,create=False):
+        self.file_path=file_path
+        if create is True:
+            f=open(file_path,'w+b')
+            f.write('\x00'*(self.HEADER_SIZE+size))
+            f.flush()
+        else:
+            f=open(file_path,'r+b')
+            size=os.path.getsize(file_path)-self.HEADER_SIZE
+        self._file=f
+        self.size=size
+        self._mmap=mmap.mmap(f.fileno(),self.HEADER_SIZE+size)
+        self._long=struct.Struct('<Q')
+        self.packer=msgpack.Packer()
+        self.unpacker=msgpack.Unpacker(use_list=True)
+
+    def _getPos(self,offset):
+        return self._long.unpack_from(self._mmap,offset)[0]
+        
+    def _setPos(self,offset,value):
+        self._long.pack_into(self._mmap,offset,value)
+        
+    def getDroppedCount(self):
+        return self._getPos(self.DROPPED_OFFSET)
+
+    def getAvailableByteCount(self):
+        return self._getPos(self.WRITE_POS_OFFSET)-self._getPos(self.READ_POS_OFFSET)
+        
+    def _handleEvent(self,event):
+        """
+        Producer side. Used as an ioHub Device event listener by the ioHub 
+        Server, so each converted event is written to the ring. If the ring 
+        does not have room for the event, it is dropped and the dropped 
+        count is incremented.
+        """
+        if self._write(self.packer.pack(event)) is False:
+            self._setPos(self.DROPPED_OFFSET,self.getDroppedCount()+1)
+            return False
+        return True
+
+    def _handleEvents(self,events):
+        """
+        Producer side. Writes a list of events to the ring with a single 
+        update of the write position. If they do not all fit, the events are
+        written one at a time, so as many as fit are written and the rest are
+        dropped.
+        """
+        pack=self.packer.pack
+        if self._write(''.join([pack(e) for e in events])) is False:
+            for e in events:
+                self._handleEvent(e)
+
+    def _write(self,data):
+        # copies data into the ring and then moves the write position past 
+        # it. Returns False, without writing anything, if data does not fit.
+        dlen=len(data)
+        write_pos=self._getPos(self.WRITE_POS_OFFSET)
+        if dlen > self.size-(write_pos-self._getPos(self.READ_POS_OFFSET)):
+            return False
+        start=self.HEADER_SIZE+write_pos%self.size
+        first_part=min(dlen,self.HEADER_SIZE+self.size-start)
+        self._mmap[start:start+first_part]=data[:first_part]
+        if first_part < dlen:
+            self._mmap[self.HEADER_SIZE:self.HEADER_SIZE+dlen-first_part]=data[first_part:]
+        self._setPos(self.WRITE_POS_OFFSET,write_pos+dlen)
+        return True
+        
+    def readEvents(self):
+        """
+        Consumer side. Returns a list of all events written to the ring since
+        the last call to readEvents() or clear(), oldest event first.
+        """
+        read_pos=self._getPos(self.READ_POS_OFFSET)
+        write_pos=self._getPos(self.WRITE_POS_OFFSET)
+        dlen=write_pos-read_pos
+        if dlen == 0:
+            return []
+        start=self.HEADER_SIZE+read_pos%self.size
+        first_part=min(dlen,self.HEADER_SIZE+self.size-start)
+        self.unpacker.feed(buffer(self._mmap,start,first_part))
+        if first_part < dlen:
+            self.unpacker.feed(buffer(self._mmap,self.HEADER_SIZE,dlen-first_part))
+        self._setPos(self.READ_POS_OFFSET,write_pos)
+        return list(self.unpacker)
+        
+    def clear(self):
+        """
+        Consumer side. Discards any unread events in the ring.
+        """
+        self._setPos(self.READ_POS_OFFSET,self._getPos(self.WRITE_POS_OFFSET))
+
+    def close(self,remove=False):
+        try:
+            self._mmap.close()
+            self._file.close()
+            if remove is True:
+                os.remove(self.file_path)
+        except:
+            pass
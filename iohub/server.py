@@ -10,18 +10,31 @@ Distributed under the terms of the GNU General Public License (GPL version 3 or
 """
 
 import gevent
+import gevent.event
+import gevent.socket
 from gevent.server import DatagramServer
 from gevent import Greenlet
 import os,sys
+import socket
+import errno
+import ctypes
+import ctypes.util
+from heapq import heappush, heappop, heapify, heapreplace
 from operator import itemgetter
 from collections import deque
+from itertools import islice, groupby
+import inspect
 
 import iohub
 import iohub.client
-from iohub.util import OrderedDict,print2err, printExceptionDetailsToStdErr, ioHubError, createErrorResult,convertCamelToSnake,MonotonicClock
+from iohub.util import OrderedDict,print2err, printExceptionDetailsToStdErr, ioHubError, createErrorResult,convertCamelToSnake,MonotonicClock,Histogram,BoundedEventDeque,holdEvents,releaseEvents
 from iohub.constants import DeviceConstants,EventConstants
-from iohub.devices import Computer, DeviceEvent, import_device        
+from iohub.devices import Computer, DeviceEvent, import_device, projectEvents, eventsToArrays, mergeEvents, getDeviceClass
 from iohub.devices.deviceConfigValidation import validateDeviceConfiguration
+from iohub.filters import createEventFilter
+from iohub.workers import WorkerDeviceProxy
+from iohub.net import SharedMemoryEventRing, getEventRingFilePath, getWorkerRingFilePath, unpackBuffer, sendChunk, CHUNK_HEADER, CHUNK_MAGIC, MultipacketMessage
+from iohub.net import getTransportType, getUnixSocketPath, createUnixDatagramSocket, getMaxDatagramSize, UNIX_MAX_DATAGRAM_SIZE
 
 from yaml import load
 try:
@@ -35,32 +48,113 @@ import json
 import msgpack
     
 class udpServer(DatagramServer):
-    def __init__(self,ioHubServer,address,coder='msgpack'):
+    # number of multipacket replies kept for resending missed chunks
+    MULTIPACKET_REPLY_CACHE_LENGTH=16
+    
+    def __init__(self,ioHubServer,address,coder='msgpack',max_packet_size=None,rcv_buffer_size=None):
         self.iohub=ioHubServer
-        self.feed=None
         self._running=True
+        self._rcv_buffer=None
+        self._rcv_buffer_size=rcv_buffer_size
+        if rcv_buffer_size is None:
+            self._rcv_buffer_size=iohub.net.MAX_PACKET_SIZE
+
+        # incomplete multipacket requests, by (sender address, message id).
+        self._multipacket_requests=dict()
+        
+        # Recently sent multipacket replies, by message id, kept so chunks 
+        # the receiver missed can be resent.
+        self._multipacket_replies=OrderedDict()
+        self._next_multipacket_id=0
+        self._chunk_buffer=None
+        self.max_packet_size=max_packet_size
+        if max_packet_size is None:
+            self.max_packet_size=iohub.net.MAX_PACKET_SIZE/2-20
         if coder == 'msgpack':
             self.iohub.log("ioHub Server configuring msgpack...")
             self.coder=msgpack
             self.packer=msgpack.Packer()
             self.pack=self.packer.pack
-            self.unpacker=msgpack.Unpacker(use_list=True)
-            self.unpack=self.unpacker.unpack      
-            self.feed=self.unpacker.feed
         DatagramServer.__init__(self,address)
+
+    def do_read(self):
+        # Requests are received directly into a preallocated buffer and 
+        # unpacked from it before the handler greenlet is spawned, so the 
+        # buffer can be reused for the next request right away.
+        if self._rcv_buffer is None:
+            self._rcv_buffer=bytearray(self._rcv_buffer_size)
+        try:
+            nbytes, address = getattr(self,'_socket',self.socket).recvfrom_into(self._rcv_buffer)
+        except socket.error, err:
+            if err.args[0] == errno.EWOULDBLOCK:
+                return
+            raise
+        if nbytes >= CHUNK_HEADER.size and self._rcv_buffer[:4] == CHUNK_MAGIC:
+            return self._addRequestChunk(nbytes,address)
+        return unpackBuffer(self._rcv_buffer,0,nbytes), address
+
+    def _addRequestChunk(self,nbytes,address):
+        """
+        Adds the chunk packet of a request that was too large for one 
+        datagram to its multipacket message. Returns the unpacked request 
+        and address once every chunk has been received, otherwise None. 
+        Chunked requests are only sent over the unix domain socket transport,
+        which does not drop datagrams, so missing chunks are not requested.
+        """
+        magic,msg_id,index,total,offset,total_length=CHUNK_HEADER.unpack_from(self._rcv_buffer)
+        key=(address,msg_id)
+        message=self._multipacket_requests.get(key)
+        if message is None:
+            message=MultipacketMessage(msg_id,total,total_length,address)
+            self._multipacket_requests[key]=message
+        if message.addChunk(index,offset,memoryview(self._rcv_buffer)[CHUNK_HEADER.size:nbytes]):
+            del self._multipacket_requests[key]
+            return message.unpack(), address
+        return None
          
     def handle(self, request, replyTo):
         if self._running is False:
             return False
-        
-        self.feed(request[:-2])
-        request = self.unpack()   
+
+        # Requests sent with a leading int request id get the same id back
+        # as the first element of the reply, so the client can have more
+        # than one request outstanding at a time.
+        request_id=None
+        if isinstance(request[0],(int,long)):
+            request_id=request.pop(0)
+
+        if request[0] == 'IOHUB_RESEND':
+            self._resendChunks(request[1],request[2],replyTo)
+            return True
+            
+        handling_start=Computer.getTime()
+        reply=self._handleRequest(request)
+        if reply is None:
+            return True
+
+        # replies to requests with an id also carry the sec.msec the ioHub
+        # Server spent handling the request, for the client's transport stats.
+        handled=reply[0] != 'IOHUB_SERVER_ERROR'
+        if request_id is not None:
+            reply=(request_id,reply,Computer.getTime()-handling_start)
+        self.sendResponse(reply,replyTo)
+        return handled
+
+    def _handleRequest(self,request):
         request_type= request.pop(0)
         
         if request_type == 'GET_EVENTS':
-            return self.handleGetEvents(replyTo)
+            if request:
+                return self.handleGetEvents(request.pop(0))
+            return self.handleGetEvents()
+        elif request_type == 'GET_EVENT_ARRAYS':
+            if request:
+                return self.handleGetEventArrays(request.pop(0))
+            return self.handleGetEventArrays()
         elif request_type == 'EXP_DEVICE':
-            return self.handleExperimentDeviceRequest(request,replyTo)
+            return self.handleExperimentDeviceRequest(request)
+        elif request_type == 'BATCH':
+            return self.handleBatchRequest(request.pop(0))
         elif request_type == 'RPC':
             callable_name=request.pop(0)
             args=None
@@ -74,11 +168,9 @@ class udpServer(DatagramServer):
             try:
                 result=getattr(self,callable_name)
             except:
-                self.sendResponse(createErrorResult('RPC_ATTRIBUTE_ERROR',
+                return createErrorResult('RPC_ATTRIBUTE_ERROR',
                                         msg="The method name referenced could not be found by the RPC server.",
-                                        method_name=callable_name),
-                                    replyTo)
-                return False
+                                        method_name=callable_name)
                 
             if result and callable(result):
                 funcPtr=result
@@ -91,63 +183,102 @@ class udpServer(DatagramServer):
                         result = funcPtr(*args)
                     elif not args and kwargs:
                         result = funcPtr(**kwargs)
-                    edata=('RPC_RESULT',callable_name,result)
-                    self.sendResponse(edata,replyTo)
-                    return True
+                    return ('RPC_RESULT',callable_name,result)
                 except Exception,e:
-                    self.sendResponse(createErrorResult('RPC_RUNTIME_ERROR',
+                    return createErrorResult('RPC_RUNTIME_ERROR',
                                       msg="An error occurred on the ioHub Server while evaulating an RPC request",
                                       method_name=callable_name,
                                       args=args,
                                       kwargs=kwargs,
                                       exception=str(e))
-                                ,replyTo)
-                    return False
             else:
-                self.sendResponse(createErrorResult('RPC_NOT_CALLABLE_ERROR',
+                return createErrorResult('RPC_NOT_CALLABLE_ERROR',
                                     msg="The method name give is not callable (it is not a method).",
                                     method_name=callable_name,
                                     resolved_result=str(result))
-                                ,replyTo)
-                return False
         elif request_type == 'STOP_IOHUB_SERVER':
             try:
                 self.shutDown()
             except:
                 printExceptionDetailsToStdErr
+            return None
         else:
-            self.sendResponse(createErrorResult('RPC_TYPE_NOT_SUPPORTED_ERROR',
+            return createErrorResult('RPC_TYPE_NOT_SUPPORTED_ERROR',
                                     msg="The request type provided is not recognized by the ioHub Server.",
-                                    request_type=request_type),
-                                replyTo)
-            return False
+                                    request_type=request_type)
             
-    def handleGetEvents(self,replyTo):
+    def _readGlobalEvents(self,filters=None):
+        # Events are read from the global event buffer after the cursor given
+        # in filters, without removing them, so several clients can read the
+        # same events. Requests without a cursor share the ioServer's default
+        # cursor. Returns the events and the cursor for the next read.
+        if filters is None:
+            filters=dict()
+        cursor=filters.get('cursor',None)
+        use_default_cursor=cursor is None
+        if use_default_cursor:
+            cursor=self.iohub.default_event_cursor
+
+        currentEvents,cursor=self.iohub.eventBuffer.read(cursor,
+                                                   filters.get('event_type_ids'),
+                                                   filters.get('since_time'),
+                                                   filters.get('until_time'),
+                                                   filters.get('max_count'))
+        if use_default_cursor:
+            self.iohub.default_event_cursor=cursor
+        return currentEvents,cursor
+
+    def getEventBufferPosition(self):
+        """
+        Returns the position the next event added to the global event buffer
+        will have. A client clears the global event buffer for its connection
+        by moving its cursor to this position.
+        """
+        return self.iohub.eventBuffer.getNextPosition()
+
+    def handleGetEvents(self,filters=None):
         try:
-            currentEvents=list(self.iohub.eventBuffer)
-            self.iohub.eventBuffer.clear()
+            currentEvents,cursor=self._readGlobalEvents(filters)
 
             if len(currentEvents)>0:
-                sorted(currentEvents, key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
-                self.sendResponse(('GET_EVENTS_RESULT',currentEvents),replyTo)
+                # the global event buffer is already in hub time order.
+                if filters and filters.get('fields'):
+                    currentEvents=projectEvents(currentEvents,filters['fields'])
+                return ('GET_EVENTS_RESULT',currentEvents,cursor)
             else:
-                self.sendResponse(('GET_EVENTS_RESULT', None),replyTo)
-            return True
+                return ('GET_EVENTS_RESULT', None,cursor)
         except Exception,e:
-            self.sendResponse(createErrorResult('IOHUB_GET_EVENTS_ERROR',
+            return createErrorResult('IOHUB_GET_EVENTS_ERROR',
                                     msg="An error occurred while events were being retrived from the ioHub Server",
-                                    exception=str(e)),
-                                replyTo)
-            return False
+                                    exception=str(e))
 
-    def handleExperimentDeviceRequest(self,request,replyTo):
+    def handleGetEventArrays(self,filters=None):
+        # Events are grouped by type and sent as the raw bytes of a numpy 
+        # structured array per type, using the event class EVENT_ARRAY_DTYPE.
+        try:
+            currentEvents,cursor=self._readGlobalEvents(filters)
+            arrays=eventsToArrays(currentEvents)
+            return ('GET_EVENT_ARRAYS_RESULT',[(etype,earray.tostring()) for etype,earray in arrays.iteritems()],cursor)
+        except Exception,e:
+            return createErrorResult('IOHUB_GET_EVENTS_ERROR',
+                                    msg="An error occurred while event arrays were being retrived from the ioHub Server",
+                                    exception=str(e))
+
+    def handleBatchRequest(self,requests):
+        # Each request in the batch is handled in order, exactly as if it had
+        # been sent on its own, and the replies are returned together.
+        replies=[]
+        for r in requests:
+            replies.append(self._handleRequest(list(r)))
+        return ('BATCH_RESULT',replies)
+
+    def handleExperimentDeviceRequest(self,request):
         request_type= request.pop(0)
         if request_type == 'EVENT_TX':
             exp_events=request.pop(0)
             for eventAsTuple in exp_events:
                 ioServer.deviceDict['Experiment']._nativeEventCallback(eventAsTuple)
-            self.sendResponse(('EVENT_TX_RESULT',len(exp_events)),replyTo)
-            return True
+            return ('EVENT_TX_RESULT',len(exp_events))
         elif request_type == 'DEV_RPC':
             dclass=request.pop(0)
             dmethod=request.pop(0)
@@ -171,19 +302,15 @@ class udpServer(DatagramServer):
                 dev=ioServer.deviceDict.get(dclass,None)
             
             if dev is None:
-                self.sendResponse(createErrorResult('IOHUB_DEVICE_ERROR',
+                return createErrorResult('IOHUB_DEVICE_ERROR',
                                         msg="An instance of the ioHub Device class provided is not enabled on the ioHub Server",
-                                        device_class=dclass),
-                                    replyTo)                
-                return False
+                                        device_class=dclass)
             
             try:
                 method=getattr(dev,dmethod)
             except:
-                self.sendResponse(createErrorResult('IOHUB_DEVICE_METHOD_ERROR',
-                                        msg="Device class {0} does not have a method called {1}".format(dclass,dmethod)),
-                                    replyTo)                
-                return False
+                return createErrorResult('IOHUB_DEVICE_METHOD_ERROR',
+                                        msg="Device class {0} does not have a method called {1}".format(dclass,dmethod))
                 
             result=[]
             try:
@@ -195,34 +322,43 @@ class udpServer(DatagramServer):
                     result=method(**kwargs)
                 else:
                     result=method()
-                self.sendResponse(('DEV_RPC_RESULT',result),replyTo)
-                return True
+                return ('DEV_RPC_RESULT',result)
             except Exception, e:
-                self.sendResponse(createErrorResult('RPC_DEVICE_RUNTIME_ERROR',
+                return createErrorResult('RPC_DEVICE_RUNTIME_ERROR',
                                       msg="An error occurred on the ioHub Server while evaulating an Device RPC request",
                                       device=dclass,
                                       dmethod=dmethod,
                                       args=args,
                                       kwargs=kwargs,
                                       exception=str(e))
-                                ,replyTo)
-                return False
         elif request_type == 'GET_DEVICE_LIST':
             try:            
                 dev_list=[]
                 for d in self.iohub.devices:
-                    dev_list.append((d.name,d.__class__.__name__))
-                self.sendResponse(('GET_DEV_LIST_RESULT',len(dev_list),dev_list),replyTo)
-                return True
+                    dev_list.append((d.name,getDeviceClass(d).__name__))
+                return ('GET_DEV_LIST_RESULT',len(dev_list),dev_list)
             except Exception, e:
                 printExceptionDetailsToStdErr()
-                self.sendResponse(createErrorResult('RPC_DEVICE_RUNTIME_ERROR',
+                return createErrorResult('RPC_DEVICE_RUNTIME_ERROR',
                                       msg="An error occurred on the ioHub Server while getting the Device list for the Experiment Process",
                                       devices=str(self.iohub.devices),
                                       dev_list=str(dev_list),
                                       exception=str(e))
-                                ,replyTo)
-                return False                
+
+        elif request_type == 'GET_DEVICE_BOOTSTRAP':
+            # Everything the Experiment Process needs to create its view of 
+            # each device, in one reply: the device name, class name, RPC 
+            # interface and configuration.
+            try:            
+                dev_list=[]
+                for d in self.iohub.devices:
+                    dev_list.append((d.name,getDeviceClass(d).__name__,d._getRPCInterface(),d.getConfiguration()))
+                return ('GET_DEVICE_BOOTSTRAP_RESULT',dev_list)
+            except Exception, e:
+                return createErrorResult('RPC_DEVICE_RUNTIME_ERROR',
+                                      msg="An error occurred on the ioHub Server while getting the Device bootstrap information for the Experiment Process",
+                                      devices=str(self.iohub.devices),
+                                      exception=str(e))
 
         elif request_type == 'GET_DEV_INTERFACE':
             dclass=request.pop(0)
@@ -238,14 +374,11 @@ class udpServer(DatagramServer):
                     data=dev._getRPCInterface()
                     
             if data:
-                self.sendResponse(('GET_DEV_INTERFACE',data),replyTo)
-                return True
+                return ('GET_DEV_INTERFACE',data)
             else:
-                self.sendResponse(createErrorResult('GET_DEV_INTERFACE_ERROR',
+                return createErrorResult('GET_DEV_INTERFACE_ERROR',
                                         msg="An error occurred on the ioHub Server while retrieving device interface information.",
-                                        device=dclass),
-                                  replyTo)
-                return False
+                                        device=dclass)
         elif request_type == 'ADD_DEVICE':
             dclass_name=request.pop(0)
             dconfig_dict=request.pop(1)
@@ -255,34 +388,25 @@ class udpServer(DatagramServer):
             # end adding device to server
                     
             if data:
-                self.sendResponse(('ADD_DEVICE',data),replyTo)
-                return True
+                return ('ADD_DEVICE',data)
             else:
-                self.sendResponse(createErrorResult('ADD_DEVICE_ERROR',
+                return createErrorResult('ADD_DEVICE_ERROR',
                                         msg="An error occurred on the ioHub Server while adding a device to be monitored.",
                                         device=dclass_name,
-                                        config=dconfig_dict),
-                                  replyTo)
-            return False
+                                        config=dconfig_dict)
         else:
-            self.sendResponse(createErrorResult('DEVICE_RPC_TYPE_NOT_SUPPORTED_ERROR',
+            return createErrorResult('DEVICE_RPC_TYPE_NOT_SUPPORTED_ERROR',
                                     msg="The device RPC request type provided is not recognized by the ioHub Server.",
-                                    request_type=request_type),
-                              replyTo)
-            return False
+                                    request_type=request_type)
             
     def sendResponse(self,data,address):
         packet_data=None
         try:
-            max_size=iohub.net.MAX_PACKET_SIZE/2-20
-            packet_data=self.pack(data)+'\r\n'
+            max_size=self.max_packet_size
+            packet_data=self.pack(data)
             packet_data_length=len(packet_data)
-            if packet_data_length>= max_size:
-                num_packets=len(packet_data)/max_size+1
-                self.sendResponse(('IOHUB_MULTIPACKET_RESPONSE',num_packets),address)
-                for p in xrange(num_packets-1):
-                    self.socket.sendto(packet_data[p*max_size:(p+1)*max_size],address)
-                self.socket.sendto(packet_data[(p+1)*max_size:packet_data_length],address)
+            if packet_data_length > max_size:
+                self._sendMultipacketResponse(packet_data,address)
             else:
                 self.socket.sendto(packet_data,address)
         except:
@@ -310,10 +434,38 @@ class udpServer(DatagramServer):
                                    first_data_element=str(first_data_element),
                                    packet_data_length=packet_data_length,
                                    max_packet_size=max_size)
-            packet_data=self.pack(data)+'\r\n'
+            packet_data=self.pack(data)
             packet_data_length=len(packet_data)            
             self.socket.sendto(packet_data,address)
             
+    def _sendMultipacketResponse(self,packet_data,address):
+        """
+        Sends packet_data to address as a sequence of chunk packets, and 
+        keeps it for MULTIPACKET_REPLY_CACHE_LENGTH multipacket replies so
+        any chunks that were not received can be resent.
+        """
+        chunk_size=self.max_packet_size-CHUNK_HEADER.size
+        if self._chunk_buffer is None:
+            self._chunk_buffer=bytearray(self.max_packet_size)
+        msg_id=self._next_multipacket_id
+        self._next_multipacket_id=(msg_id+1)%0xFFFFFFFF
+        self._multipacket_replies[msg_id]=packet_data
+        while len(self._multipacket_replies) > self.MULTIPACKET_REPLY_CACHE_LENGTH:
+            self._multipacket_replies.popitem(last=False)
+        for index in xrange((len(packet_data)+chunk_size-1)//chunk_size):
+            sendChunk(self.socket,self._chunk_buffer,packet_data,msg_id,index,chunk_size,address)
+
+    def _resendChunks(self,msg_id,chunk_indexes,address):
+        packet_data=self._multipacket_replies.get(msg_id)
+        if packet_data is None:
+            self.sendResponse(createErrorResult('IOHUB_MULTIPACKET_RESEND_ERROR',
+                                   msg="The requested multipacket reply is no longer available on the ioHub Server.",
+                                   msg_id=msg_id),address)
+            return
+        chunk_size=self.max_packet_size-CHUNK_HEADER.size
+        for index in chunk_indexes:
+            sendChunk(self.socket,self._chunk_buffer,packet_data,msg_id,index,chunk_size,address)
+            
     def setExperimentInfo(self,experimentInfoList):
         self.iohub.experimentInfoList=experimentInfoList
         if self.iohub.emrt_file:
@@ -363,15 +515,34 @@ class udpServer(DatagramServer):
     def clearEventBuffer(self):
         return self.iohub.clearEventBuffer()
 
+    def addEventSubscription(self,address,event_type_ids=None,device_class_names=None):
+        return self.iohub.addEventSubscription(address,event_type_ids,device_class_names)
+
+    def removeEventSubscription(self,subscription_id):
+        return self.iohub.removeEventSubscription(subscription_id)
+
     def enableHighPriority(self,disable_gc=True):
         Computer.enableHighPriority(disable_gc)
 
     def disableHighPriority(self):
         Computer.disableHighPriority()
 
+    def enableRealTimePriority(self,disable_gc=True):
+        Computer.enableRealTimePriority(disable_gc)
+        return Computer.inHighPriorityMode
+
+    def disableRealTimePriority(self):
+        Computer.disableRealTimePriority()
+
     def getProcessAffinity(self):
         return Computer.getCurrentProcessAffinity()
 
+    def getPollSchedulerStats(self):
+        return self.iohub.pollScheduler.getStats()
+
+    def getServerStats(self):
+        return self.iohub.getServerStats()
+
     def setProcessAffinity(self, processorList):
         return Computer.setCurrentProcessAffinity(processorList)
 
@@ -392,22 +563,562 @@ class udpServer(DatagramServer):
             printExceptionDetailsToStdErr()
             sys.exit(1)
 
-class DeviceMonitor(Greenlet):
+class SequencedEventBuffer(object):
+    """
+    A fixed length buffer of events, where each event added is given the next
+    position in a monotonically increasing sequence. Readers keep a cursor,
+    the position of the first event they have not read, and read the events
+    after it. Reading does not remove events, so any number of readers can
+    read the same events. When the buffer is full, the overflow policy of 
+    the BoundedEventDeque holding the events decides which event is lost.
+
+    Events that do not match the criteria of a filtered read are not read,
+    so they are returned by a later read with other criteria. After such a
+    read the cursor is a [position, read_positions] list, where 
+    read_positions are the positions after position of the events that 
+    have already been returned.
+
+    Events created by an EventRecordPool are held while they are in the
+    buffer.
+    """
+    def __init__(self,maxlen):
+        self._events=BoundedEventDeque(maxlen,'global_event_buffer')
+        self._next_position=0
+
+    def __len__(self):
+        return len(self._events)
+
+    def append(self,event):
+        events=self._events
+        removed=None
+        if len(events) == events.maxlen:
+            # the global event buffer is only added to by the ioHub Server
+            # greenlet, so overflows are counted as each event is added.
+            events.checkOverflow()
+            if events.policy != 'drop_newest':
+                removed=events[0]
+        if events.append(event) is not False:
+            self._next_position+=1
+            holdEvents((event,))
+            if removed is not None:
+                releaseEvents((removed,))
+
+    def getOverflowBuffer(self):
+        return self._events
+
+    def getFirstPosition(self):
+        return self._next_position-len(self._events)
+
+    def getNextPosition(self):
+        return self._next_position
+
+    def clear(self):
+        # Positions continue from where they were, so existing cursors stay valid.
+        releaseEvents(self._events)
+        self._events.clear()
+
+    def getUnreadCount(self,cursor):
+        """
+        Returns the number of events in the buffer that the reader with 
+        cursor has not read.
+        """
+        position,read_positions=self._splitCursor(cursor)
+        first_position=self.getFirstPosition()
+        position=max(position,first_position)
+        return self._next_position-position-len([p for p in read_positions if p >= position])
+
+    @staticmethod
+    def _splitCursor(cursor):
+        if isinstance(cursor,(int,long)):
+            return cursor,[]
+        return cursor[0],cursor[1]
+
+    def read(self,cursor,event_type_ids=None,since_time=None,until_time=None,max_count=None):
+        """
+        Returns the events after cursor that match the given criteria, oldest 
+        first, and the cursor to use for the next read. Events that do not 
+        match the criteria, and matching events beyond max_count, are returned
+        by later reads.
+        """
+        position,read_positions=self._splitCursor(cursor)
+        first_position=self.getFirstPosition()
+        if position < first_position:
+            position=first_position
+        if position >= self._next_position:
+            return [],self._next_position
+        read_positions=set(read_positions)
+
+        events=islice(self._events,position-first_position,None)
+        if not event_type_ids and since_time is None and until_time is None and max_count is None:
+            if read_positions:
+                return [e for p,e in enumerate(events,position) if p not in read_positions],self._next_position
+            return list(events),self._next_position
+
+        time_index=DeviceEvent.EVENT_HUB_TIME_INDEX
+        type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
+        matched=[]
+        # the position of the first event that has not been returned, once
+        # one has been found, and the positions after it that have been.
+        next_position=None
+        next_read_positions=[]
+        p=position
+        for e in events:
+            if max_count is not None and len(matched)>=max_count:
+                break
+            if p in read_positions:
+                if next_position is not None:
+                    next_read_positions.append(p)
+            elif (event_type_ids and e[type_index] not in event_type_ids) or \
+                    (since_time is not None and e[time_index] < since_time) or \
+                    (until_time is not None and e[time_index] > until_time):
+                if next_position is None:
+                    next_position=p
+            else:
+                matched.append(e)
+                if next_position is not None:
+                    next_read_positions.append(p)
+            p+=1
+
+        # p is the position of the first event that was not examined.
+        if next_position is None:
+            next_position=p
+        next_read_positions.extend(sorted([rp for rp in read_positions if rp >= p]))
+        if next_read_positions:
+            return matched,[next_position,next_read_positions]
+        return matched,next_position
+
+class EventSubscription(object):
+    """
+    Device event listener for an event subscription made by the Experiment
+    Process. Events are collected as they are dispatched, and are pushed to
+    the subscriber's socket address once per device event processing 
+    iteration, as a ('SUBSCRIBED_EVENTS', subscription_id, events) message.
+    """
+    def __init__(self,subscription_id,address):
+        self.subscription_id=subscription_id
+        self.address=address
+        self.events=[]
+
+    def _handleEvent(self,event):
+        self.events.append(event)
+
+    def _handleEvents(self,events):
+        self.events.extend(events)
+
+class DeviceEventStream(object):
+    """
+    The events of one device that are waiting in an EventStreamMerger, in 
+    hub time order. Used as an event listener of the device. latest_time is
+    the latest hub time of the events the stream has been given, and 
+    receive_time the time events were last given to it; both are None until
+    the stream has been given events. Events are held while they are in 
+    the stream, and released by EventStreamMerger.release().
+    """
+    def __init__(self):
+        self.events=deque()
+        self.latest_time=None
+        self.receive_time=None
+
+    def _handleEvent(self,event):
+        self._handleEvents([event,])
+
+    def _handleEvents(self,events):
+        time_index=DeviceEvent.EVENT_HUB_TIME_INDEX
+        holdEvents(events)
+        self.receive_time=Computer.getTime()
+        latest_time=max([e[time_index] for e in events])
+        if self.latest_time is None or latest_time > self.latest_time:
+            self.latest_time=latest_time
+        stream=self.events
+        if not stream or events[0][time_index] >= stream[-1][time_index]:
+            stream.extend(events)
+        else:
+            # events of another type that occurred before events already in
+            # the stream; only the few waiting events need to be merged.
+            self.events=deque(mergeEvents([stream,sorted(events,key=itemgetter(time_index))]))
+
+class EventStreamMerger(object):
+    """
+    Merges the event streams of each device into a single stream in hub time
+    order, which is given to output, a function taking a list of events.
+    
+    Events are kept in their device's stream until release() is called with
+    a hub time after theirs. getWatermark() gives the hub time up to which 
+    events can be released: the lowest latest_time of the active streams,
+    those that have been given events within the last reorder_window 
+    sec.msec. Events are only held back while a device with an earlier 
+    latest event time is active, so events that a device reports later than
+    the events of other devices are still given to output in order, and 
+    nothing is held back when only one device is reporting events. Each 
+    release merges the streams with a heap based k-way merge. Events 
+    released after events with a later hub time are counted as late events.
+    """
+    def __init__(self,output,reorder_window):
+        self._output=output
+        self.reorder_window=reorder_window
+        self._streams=[]
+        self._last_released_time=None
+        self.released_event_count=0
+        self.late_event_count=0
+
+    def createStream(self):
+        stream=DeviceEventStream()
+        self._streams.append(stream)
+        return stream
+
+    def hasPendingEvents(self):
+        for stream in self._streams:
+            if stream.events:
+                return True
+        return False
+
+    def getWatermark(self,now):
+        """
+        Returns the hub time up to which events can be released at time now,
+        or None if no stream is active, in which case all events can be.
+        """
+        watermark=None
+        active_since=now-self.reorder_window
+        for s in self._streams:
+            if s.receive_time is not None and s.receive_time >= active_since:
+                if watermark is None or s.latest_time < watermark:
+                    watermark=s.latest_time
+        return watermark
+
+    def release(self,until_time=None):
+        """
+        Gives the events with a hub time <= until_time, or all events if 
+        until_time is None, to output in hub time order. Returns the number of
+        events released.
+        """
+        time_index=DeviceEvent.EVENT_HUB_TIME_INDEX
+        heap=[(s.events[0][time_index],i,s.events) for i,s in enumerate(self._streams) if s.events]
+        heapify(heap)
+        released=[]
+        append=released.append
+        while heap:
+            t,i,events=heap[0]
+            if until_time is not None and t > until_time:
+                break
+            append(events.popleft())
+            if events:
+                heapreplace(heap,(events[0][time_index],i,events))
+            else:
+                heappop(heap)
+
+        if released:
+            last_released_time=self._last_released_time
+            if last_released_time is not None:
+                for e in released:
+                    if e[time_index] >= last_released_time:
+                        break
+                    self.late_event_count+=1
+            if last_released_time is None or released[-1][time_index] > last_released_time:
+                self._last_released_time=released[-1][time_index]
+            self.released_event_count+=len(released)
+            self._output(released)
+            releaseEvents(released)
+        return len(released)
+
+    def getStats(self):
+        return dict(reorder_window=self.reorder_window,
+                    pending_event_count=sum([len(s.events) for s in self._streams]),
+                    released_event_count=self.released_event_count,
+                    late_event_count=self.late_event_count)
+
+# listener class : True if events should be given to listeners of the class
+# as a batch, using their _handleEvents method.
+_batch_event_listener_classes=dict()
+
+def dispatchEvents(listener,events):
+    """
+    Gives events, a list of events of one type, to the event listener.
+    Listeners with a _handleEvents method get the whole list in one call, 
+    unless _handleEvent is overridden by a subclass of the class defining
+    _handleEvents; those, and listeners without a _handleEvents method, get
+    each event through _handleEvent.
+    """
+    listener_class=listener.__class__
+    handles_batches=_batch_event_listener_classes.get(listener_class)
+    if handles_batches is None:
+        batch_class=single_class=None
+        for c in inspect.getmro(listener_class):
+            if batch_class is None and '_handleEvents' in c.__dict__:
+                batch_class=c
+            if single_class is None and '_handleEvent' in c.__dict__:
+                single_class=c
+        handles_batches=batch_class is not None and (single_class is None or issubclass(batch_class,single_class))
+        _batch_event_listener_classes[listener_class]=handles_batches
+    if handles_batches:
+        listener._handleEvents(events)
+    else:
+        handleEvent=listener._handleEvent
+        for e in events:
+            handleEvent(e)
+
+class EventProcessingWakeup(object):
+    """
+    Wakes the ioHub Server device event processing loop when a device adds
+    a native event to its buffer, so the loop can wait without polling while
+    there is nothing to process. signal() can be called from any thread, 
+    including device callback threads like the pyXHook thread, since it uses 
+    a gevent loop async watcher to set the event the loop waits on.
+    """
+    def __init__(self):
+        loop=gevent.get_hub().loop
+        # the watcher factory was renamed to async_ in gevent 1.3, as async 
+        # is a keyword in newer Python versions.
+        create_async_watcher=getattr(loop,'async_',None) or getattr(loop,'async')
+        self._event=gevent.event.Event()
+        self._watcher=create_async_watcher()
+        self._watcher.start(self._event.set)
+
+    def signal(self):
+        self._watcher.send()
+
+    def clear(self):
+        self._event.clear()
+
+    def wait(self,timeout=None):
+        return self._event.wait(timeout)
+
+    def close(self):
+        self._watcher.stop()
+        self._event.set()
+
+class DeviceMonitor(object):
+    """
+    The poll schedule of one device, whose _poll() method is called by the 
+    DevicePollScheduler every sleep_interval sec.msec. Poll deadlines are 
+    kept on a fixed grid from the time the monitor was scheduled, so time 
+    spent polling or waking late does not make the poll rate drift. The
+    lateness of each poll, and the number of periods skipped because a poll
+    was more than a full period late, are recorded.
+    """
+    # upper edges of the lateness and poll duration histogram bins, in sec.msec.
+    LATENESS_BIN_EDGES=(0.00005,0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025)
+    
     def __init__(self, device,sleep_interval):
-        Greenlet.__init__(self)
         self.device = device
         self.sleep_interval=sleep_interval
+        self.running=True
+        self.next_deadline=None
+        self.poll_count=0
+        self.missed_periods=0
+        self.lateness=Histogram(self.LATENESS_BIN_EDGES)
+        self.poll_duration=Histogram(self.LATENESS_BIN_EDGES)
+        self.first_poll_time=None
+        self.last_poll_time=None
+        self.events_produced=0
+
+    def getName(self):
+        return getattr(self.device,'name',None) or self.device.__class__.__name__
+
+    def getAchievedRate(self):
+        """
+        Returns the average number of polls per second since polling started,
+        or None if fewer than two polls have been done.
+        """
+        if self.poll_count > 1 and self.last_poll_time > self.first_poll_time:
+            return (self.poll_count-1)/(self.last_poll_time-self.first_poll_time)
+        return None
+
+    def getStats(self):
+        events_per_poll=None
+        if self.poll_count:
+            events_per_poll=float(self.events_produced)/self.poll_count
+        return dict(interval=self.sleep_interval,configured_rate=1.0/self.sleep_interval,
+                    achieved_rate=self.getAchievedRate(),poll_count=self.poll_count,
+                    missed_periods=self.missed_periods,events_per_poll=events_per_poll,
+                    lateness=self.lateness.toDict(),poll_duration=self.poll_duration.toDict())
+
+class DeviceEventStats(object):
+    """
+    Event processing statistics of one device, updated by the ioServer 
+    device event processing loop: the number of events processed, the 
+    largest number of native events found waiting in the device's native 
+    event buffer, and the distribution of the delay between the time an 
+    event was logged by the device callback and the time it was processed.
+    """
+    # upper edges of the processing delay histogram bins, in sec.msec.
+    DELAY_BIN_EDGES=(0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1)
+
+    def __init__(self):
+        self.event_count=0
+        self.native_buffer_high_water=0
+        self.processing_delay=Histogram(self.DELAY_BIN_EDGES)
+
+    def toDict(self):
+        return dict(event_count=self.event_count,native_buffer_high_water=self.native_buffer_high_water,
+                    processing_delay=self.processing_delay.toDict())
+
+class LinuxTimerFD(object):
+    """
+    A one shot CLOCK_MONOTONIC Linux timerfd, accessed using ctypes. Waiting
+    for it to expire using the gevent loop gives sub millisecond wakeup 
+    precision, where gevent timers are limited by the millisecond timeout 
+    resolution of the loop's poll call.
+    """
+    CLOCK_MONOTONIC=1
+    TFD_NONBLOCK=04000
+    TFD_CLOEXEC=02000000
+
+    class itimerspec(ctypes.Structure):
+        # it_interval and it_value are each a struct timespec (tv_sec, tv_nsec).
+        _fields_=[('it_interval',ctypes.c_long*2),('it_value',ctypes.c_long*2)]
+
+    def __init__(self):
+        self._libc=ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        self._fd=self._libc.timerfd_create(self.CLOCK_MONOTONIC,self.TFD_NONBLOCK|self.TFD_CLOEXEC)
+        if self._fd < 0:
+            errno_value=ctypes.get_errno()
+            raise OSError(errno_value,os.strerror(errno_value))
+
+    def arm(self,delay):
+        """
+        Sets the timer to expire in delay sec.msec. A delay <= 0 makes the 
+        timer expire right away.
+        """
+        sec=int(delay)
+        nsec=int((delay-sec)*1000000000)
+        if sec <= 0 and nsec <= 0:
+            sec,nsec=0,1
+        spec=self.itimerspec()
+        spec.it_value[0]=sec
+        spec.it_value[1]=nsec
+        self._libc.timerfd_settime(self._fd,0,ctypes.byref(spec),None)
+
+    def wait(self):
+        """
+        Waits, without blocking other greenlets, until the timer expires.
+        """
+        gevent.socket.wait_read(self._fd)
+        try:
+            os.read(self._fd,8)
+        except OSError:
+            # the timer was re-armed after it was seen to be readable.
+            pass
+
+    def close(self):
+        os.close(self._fd)
+
+class DevicePollScheduler(Greenlet):
+    """
+    Calls the _poll() method of each scheduled DeviceMonitor when its next 
+    poll deadline is reached, using a single greenlet and a priority queue 
+    of deadlines for all polled devices. Deadlines are compared to 
+    Computer.currentSec. If a poll is more than a full period late, the 
+    missed periods are skipped rather than polled back to back. 
+
+    When use_timerfd is True and the platform supports it, the scheduler 
+    sleeps until the next deadline using a Linux timerfd; otherwise a 
+    gevent timer is used.
+    """
+    def __init__(self,use_timerfd=False):
+        Greenlet.__init__(self)
         self.running=False
+        self._schedule=[]
+        self._next_entry_id=0
+        self._wakeup=gevent.event.Event()
+        self._timer=None
+        if use_timerfd and sys.platform.startswith('linux'):
+            try:
+                self._timer=LinuxTimerFD()
+            except Exception:
+                print2err("Could not create a timerfd for the DevicePollScheduler; using gevent timers.")
+                printExceptionDetailsToStdErr()
         
+    def addMonitor(self,monitor):
+        """
+        Schedules monitor, with its first poll due now.
+        """
+        monitor.next_deadline=Computer.currentSec()
+        heappush(self._schedule,(monitor.next_deadline,self._next_entry_id,monitor))
+        self._next_entry_id+=1
+        self._wake()
+
+    def getStats(self):
+        """
+        Returns a dict of device name : poll stats dict, for each scheduled device.
+        """
+        return dict([(monitor.getName(),monitor.getStats()) for deadline,entry_id,monitor in self._schedule])
+
+    def stop(self):
+        self.running=False
+        self._wake()
+
+    def _wake(self):
+        # makes the scheduler recheck its next deadline.
+        if self._timer:
+            self._timer.arm(0.0)
+        else:
+            self._wakeup.set()
+
+    def _sleep(self,delay):
+        if self._timer:
+            if delay is not None:
+                self._timer.arm(delay)
+            self._timer.wait()
+        else:
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
     def _run(self):
-        self.running = True
+        self.running=True
         ctime=Computer.currentSec
+        schedule=self._schedule
         while self.running is True:
-            stime=ctime()
-            self.device._poll()
-            i=self.sleep_interval-(ctime()-stime)
-            if i > 0.0:
-                gevent.sleep(i)    
+            if not schedule:
+                self._sleep(None)
+                continue
+            
+            deadline,entry_id,monitor=schedule[0]
+            now=ctime()
+            if deadline > now:
+                self._sleep(deadline-now)
+                continue
+
+            heappop(schedule)
+            if monitor.running is False:
+                continue
+
+            monitor.lateness.add(now-deadline)
+            monitor.poll_count+=1
+            if monitor.first_poll_time is None:
+                monitor.first_poll_time=now
+            monitor.last_poll_time=now
+            
+            # events produced by the poll are counted from the change in the
+            # native event buffer length, as the event processing greenlet
+            # can not run during the poll.
+            native_buffer=getattr(monitor.device,'_native_event_buffer',None)
+            if native_buffer is not None:
+                buffered_count=len(native_buffer)
+            try:
+                monitor.device._poll()
+            except:
+                printExceptionDetailsToStdErr()
+            if native_buffer is not None:
+                monitor.events_produced+=max(len(native_buffer)-buffered_count,0)
+
+            interval=monitor.sleep_interval
+            next_deadline=deadline+interval
+            poll_start=now
+            now=ctime()
+            monitor.poll_duration.add(now-poll_start)
+            if next_deadline <= now:
+                missed=int((now-next_deadline)/interval)+1
+                monitor.missed_periods+=missed
+                next_deadline+=missed*interval
+            monitor.next_deadline=next_deadline
+            heappush(schedule,(next_deadline,entry_id,monitor))
+
+            # let the udp server and event processing greenlets run between polls.
+            gevent.sleep(0)
+
+        if self._timer:
+            self._timer.close()
+            self._timer=None
 
         
 class ioServer(object):
@@ -425,20 +1136,61 @@ class ioServer(object):
         self.config=config
         self.devices=[]
         self.deviceMonitors=[]
+        self._device_event_stats=dict()
+        self.pollScheduler=DevicePollScheduler(config.get('poll_scheduler',{}).get('use_timerfd',False))
         self.sessionInfoDict=None
         self.experimentInfoList=None
         self.filterLookupByInput={}
         self.filterLookupByOutput={}
         self.filterLookupByName={}  
+        self._device_filters=dict()
         self._hookDevice=None
+        self._event_subscriptions=OrderedDict()
+        self._next_subscription_id=1
 
         import iohub        
-        ioServer.eventBuffer=deque(maxlen=config.get('global_event_buffer',2048))
+        ioServer.eventBuffer=SequencedEventBuffer(config.get('global_event_buffer',2048))
+        self._overflow_config=config.get('event_buffer_overflow',{})
+        self._configureOverflowBuffer(self.eventBuffer.getOverflowBuffer(),
+                                      self._overflow_config.get('global_event_buffer','drop_oldest'))
+        self.default_event_cursor=0
+
+        # optional shared memory event ring, used in place of the global
+        # event buffer when enabled.
+        self._event_ring=None
+        event_ring_config=config.get('event_ring',{})
+        if event_ring_config.get('enable',False) is True:
+            ring_path=getEventRingFilePath(config.get('udp_port',9000))
+            self._event_ring=SharedMemoryEventRing(ring_path,event_ring_config.get('size',4194304),create=True)
+            self.log("Shared memory event ring created: %s"%(ring_path,))
 
         self._running=True
+
+        # signalled by devices when native events are added to their buffer.
+        self._event_wakeup=EventProcessingWakeup()
+
+        # events for the global event buffer, or the shared memory event ring,
+        # are merged into hub time order before being added to it.
+        self._eventMerger=EventStreamMerger(self._addMergedEvents,
+                                            config.get('event_merge',{}).get('reorder_window',0.002))
+
+        # devices run in their own worker process, by device name.
+        self._device_workers_config=config.get('device_workers',{})
+
+        Computer.realTimeSettings.update(config.get('realtime_mode',{}))
+        self._device_workers=OrderedDict()
         
-        # start UDP service
-        self.udpService=udpServer(self,':%d'%config.get('udp_port',9000))
+        # start UDP service, or unix domain datagram socket service if 
+        # that transport has been selected.
+        self._unix_socket_path=None
+        if getTransportType(config) == 'unix':
+            self._unix_socket_path=getUnixSocketPath(config)
+            listener=createUnixDatagramSocket(self._unix_socket_path)
+            self.udpService=udpServer(self,listener,max_packet_size=getMaxDatagramSize(listener),
+                                      rcv_buffer_size=UNIX_MAX_DATAGRAM_SIZE)
+            self.log("Using unix domain socket transport: %s"%(self._unix_socket_path,))
+        else:
+            self.udpService=udpServer(self,':%d'%config.get('udp_port',9000))
 
         # read temp paths file
         iohub.data_paths=None
@@ -492,6 +1244,13 @@ class ioServer(object):
             printExceptionDetailsToStdErr()
             raise ioHubError("Error during device creation ....")
 
+        # create the event filters given in the config.
+        for filter_config in config.get('event_filters') or []:
+            try:
+                self.addEventFilter(filter_config)
+            except:
+                print2err("Error creating event filter: ",filter_config)
+                printExceptionDetailsToStdErr()
 
         # initial time offset
         #print2err("-- ioServer Init Complete -- ")
@@ -534,8 +1293,8 @@ class ioServer(object):
             device_instance_and_config=self.addDeviceToMonitor(device_class_name,deviceConfig)
             if device_instance_and_config:
                 device_instance,device_config,device_event_ids,event_classes=device_instance_and_config 
-                DeviceConstants.addClassMapping(device_instance.__class__)
-                EventConstants.addClassMappings(device_instance.__class__,device_event_ids,event_classes)
+                DeviceConstants.addClassMapping(getDeviceClass(device_instance))
+                EventConstants.addClassMappings(getDeviceClass(device_instance),device_event_ids,event_classes)
             else:
                 print2err('## Device was not started by the ioHub Server: ',device_class_name)
                 raise ioHubError("Device config validation failed")
@@ -561,11 +1320,11 @@ class ioServer(object):
         if self.emrt_file is not None:
             if device_config['save_events']:
                 device_instance._addEventListener(self.emrt_file,device_event_ids)
-                self.log("DataStore listener for device added: device: %s eventIDs: %s"%(device_instance.__class__.__name__,device_event_ids))
+                self.log("DataStore listener for device added: device: %s eventIDs: %s"%(getDeviceClass(device_instance).__name__,device_event_ids))
                 #print2err("DataStore listener for device added: device: %s eventIDs: %s"%(device_instance.__class__.__name__,device_event_ids))
             else:
                 #print2err("DataStore saving disabled for device: %s"%(device_instance.__class__.__name__,))
-                self.log("DataStore saving disabled for device: %s"%(device_instance.__class__.__name__,))
+                self.log("DataStore saving disabled for device: %s"%(getDeviceClass(device_instance).__name__,))
         else:
             #print2err("DataStore Not Evabled. No events will be saved.")
             self.log("DataStore Not Enabled. No events will be saved.")
@@ -610,7 +1369,7 @@ class ioServer(object):
                     #print2err("Creating pyHook Monitor......")
                     self._hookDevice=pyHookDevice()
                     hookMonitor=DeviceMonitor(self._hookDevice,0.00375)
-                    self.deviceMonitors.append(hookMonitor)
+                    self._addDeviceMonitor(hookMonitor)
                 
                     #print2err("Created pyHook Monitor.")
                 else:
@@ -681,14 +1440,14 @@ class ioServer(object):
                 if  device_class_name == 'Mouse' and 'Mouse' not in self._hookDevice:
                     #print2err("Hooking OSX Mouse.....")
                     mouseHookMonitor=DeviceMonitor(deviceDict['Mouse'],0.004)
-                    self.deviceMonitors.append(mouseHookMonitor)
+                    self._addDeviceMonitor(mouseHookMonitor)
                     deviceDict['Mouse']._CGEventTapEnable(deviceDict['Mouse']._tap, True)
                     self._hookDevice.append('Mouse')
                     #print2err("Done Hooking OSX Mouse.....")
                 if device_class_name == 'Keyboard'  and 'Keyboard' not in self._hookDevice:
                     #print2err("Hooking OSX Keyboard.....")
                     kbHookMonitor=DeviceMonitor(deviceDict['Keyboard'],0.004)
-                    self.deviceMonitors.append(kbHookMonitor)
+                    self._addDeviceMonitor(kbHookMonitor)
                     deviceDict['Keyboard']._CGEventTapEnable(deviceDict['Keyboard']._tap, True)
                     self._hookDevice.append('Keyboard')
                     #print2err("DONE Hooking OSX Keyboard.....")
@@ -750,7 +1509,10 @@ class ioServer(object):
             if device_class_name != 'Display' and DeviceClass._display_device is None:
                 DeviceClass._display_device=ioServer.deviceDict['Display']  
                 
-            deviceInstance=DeviceClass(dconfig=device_config)
+            if self._isWorkerDevice(device_config):
+                deviceInstance=self._createWorkerDevice(DeviceClass,device_module_path,device_config)
+            else:
+                deviceInstance=DeviceClass(dconfig=device_config)
 
             self.log("Device Instance Created: %s"%(device_class_name,))
             #print2err("Device Instance Created: %s"%(device_class_name,))
@@ -758,11 +1520,15 @@ class ioServer(object):
             self.devices.append(deviceInstance)
             ioServer.deviceDict[device_class_name]=deviceInstance
 
+            device_policies=self._overflow_config.get('device_event_buffers',{})
+            self._configureOverflowBuffer(deviceInstance._getNativeEventBuffer(),
+                                          device_policies.get(deviceInstance.name,device_policies.get('default','drop_oldest')))
+
             if 'device_timer' in device_config:
                 interval = device_config['device_timer']['interval']
                 self.log("%s has requested a timer with period %.5f"%(device_class_name, interval))
                 dPoller=DeviceMonitor(deviceInstance,interval)
-                self.deviceMonitors.append(dPoller)
+                self._addDeviceMonitor(dPoller)
 
             eventIDs=[]
             monitor_events_list=device_config.get('monitor_event_types',[])
@@ -776,8 +1542,9 @@ class ioServer(object):
             # add event listeners for streaming events
             if device_config.get('stream_events') is True:
                 self.log("Online event access is being enabled for: %s"%device_class_name)
-                # add listener for global event queue
-                deviceInstance._addEventListener(self,eventIDs)
+                # add listener for global event queue, or the shared memory
+                # event ring if it is being used.
+                deviceInstance._addEventListener(self._eventMerger.createStream(),eventIDs)
                 #ioHub.print2err("ioServer event stream listener added: device=%s eventIDs=%s"%(device_class_name,eventIDs))
                 self.log("Standard event stream listener added for ioServer for event ids %s"%(str(eventIDs),))
                 # add listener for device event queue
@@ -788,6 +1555,43 @@ class ioServer(object):
             return deviceInstance,device_config,eventIDs,event_classes
 
 
+    def _isWorkerDevice(self,device_config):
+        workers_config=self._device_workers_config
+        if workers_config.get('enable',False) is not True:
+            return False
+        if device_config.get('name') not in workers_config.get('devices',[]):
+            return False
+        if Computer.system == 'win32':
+            print2err("WARNING: Device worker processes are not supported on Windows. Running device in the ioHub Process: ",device_config.get('name'))
+            return False
+        if 'device_timer' not in device_config:
+            # devices that get their events through callbacks must stay in
+            # the ioHub Process, where the callbacks are registered.
+            print2err("WARNING: Only polled devices can be run in a worker process. Running device in the ioHub Process: ",device_config.get('name'))
+            return False
+        return True
+
+    def _createWorkerDevice(self,DeviceClass,device_module_path,device_config):
+        """
+        Starts a worker process that creates and polls the device, and returns
+        the WorkerDeviceProxy that the ioHub Server uses in place of the
+        device.
+        """
+        workers_config=self._device_workers_config
+        device_name=device_config.get('name')
+        display_config=None
+        display=ioServer.deviceDict.get('Display')
+        if display is not None:
+            display_config=display.getConfiguration()
+        processor_list=workers_config.get('processor_affinity',{}).get(device_name)
+        proxy=WorkerDeviceProxy(self,len(self._device_workers),DeviceClass,device_module_path,
+                                device_config,display_config,
+                                getWorkerRingFilePath(self.config.get('udp_port',9000),device_name),
+                                workers_config.get('ring_size',1048576),processor_list)
+        self._device_workers[device_name]=proxy
+        self.log("Device worker process started: %s pid: %d"%(device_name,proxy.getWorkerStats()['pid']))
+        return proxy
+
     def log(self,text,level=None):
         try:
             log_time=currentSec()
@@ -817,36 +1621,214 @@ class ioServer(object):
             pytablesfile.flush()
             pytablesfile.close()
             
-    def processDeviceEvents(self,sleep_interval):
+    def _configureOverflowBuffer(self,buffer,policy):
+        spill_directory=self._overflow_config.get('spill_directory')
+        spill_file_path=None
+        if spill_directory:
+            spill_file_path=os.path.join(spill_directory,'iohub_overflow_%s.msgpack'%(buffer.name,))
+        buffer.setPolicy(policy,spill_file_path)
+        buffer.alert_interval=self._overflow_config.get('alert_interval',1.0)
+        buffer.alert_handler=self._onEventBufferOverflow
+
+    def _onEventBufferOverflow(self,buffer):
+        self.log("Event buffer %s is full; %d events have been dropped."%(buffer.name,buffer.dropped_count),'WARNING')
+
+    def getServerStats(self):
+        """
+        Returns performance statistics of the ioHub Server, as a dict with a
+        'devices' key, holding a dict of device name : device stats dict, and
+        a 'global_event_buffer' key, holding the overflow stats of the global
+        event buffer, and an 'event_merge' key, holding the EventStreamMerger
+        stats. Each device stats dict has an 'event_processing' key, 
+        holding the DeviceEventStats of the device, a 'native_event_buffer' 
+        key, holding the overflow stats of the device's native event buffer,
+        and a 'polling' key, holding the poll stats of the device if it is 
+        polled by the DevicePollScheduler. Devices run in a worker process
+        also have a 'worker' key, holding the WorkerDeviceProxy worker stats.
+        """
+        devices=dict()
+        for device in self.devices:
+            stats=self._device_event_stats.get(device)
+            if stats is not None:
+                stats=stats.toDict()
+            devices[device.name or device.__class__.__name__]=dict(event_processing=stats,polling=None,
+                                native_event_buffer=device._getNativeEventBuffer().getStats())
+        for monitor in self.deviceMonitors:
+            devices.setdefault(monitor.getName(),dict(event_processing=None,native_event_buffer=None))['polling']=monitor.getStats()
+        for device_name,proxy in self._device_workers.iteritems():
+            devices.setdefault(device_name,dict())['worker']=proxy.getWorkerStats()
+        return dict(devices=devices,global_event_buffer=self.eventBuffer.getOverflowBuffer().getStats(),
+                    event_merge=self._eventMerger.getStats())
+
+    def addEventFilter(self,filter_config):
+        """
+        Creates an event filter from filter_config, an entry of the 
+        event_filters list in the ioHub config, and adds it to the filters 
+        of the device named by the 'device' key of filter_config.
+        """
+        device_name=filter_config.get('device')
+        devices=[d for d in self.devices if d.name == device_name]
+        if not devices:
+            raise ioHubError("The device of the event filter was not found: ",device_name)
+        device=devices[0]
+        
+        event_filter=createEventFilter(filter_config)
+        self._device_filters.setdefault(device,[]).append(event_filter)
+        for event_type_id in event_filter.input_event_type_ids:
+            self.filterLookupByInput.setdefault(event_type_id,[]).append(event_filter)
+        self.filterLookupByOutput[event_filter.filter_id]=event_filter
+        self.filterLookupByName[event_filter.name]=event_filter
+        self.log("Event filter %s (filter_id %d) added for device %s"%(event_filter.name,event_filter.filter_id,device_name))
+        return event_filter
+
+    def _addDeviceMonitor(self,monitor):
+        self.deviceMonitors.append(monitor)
+        self.pollScheduler.addMonitor(monitor)
+
+    def processDeviceEvents(self):
+        # The wakeup is cleared before each iteration, so events added while
+        # the iteration runs cause the wait to return right away.
         while self._running:
+            self._event_wakeup.clear()
             self._processDeviceEventIteration()
-            gevent.sleep(sleep_interval)
+            # events held back by the event merger are released once the 
+            # streams holding them back are idle, even if no new events arrive.
+            timeout=None
+            if self._eventMerger.hasPendingEvents():
+                timeout=self._eventMerger.reorder_window
+            self._event_wakeup.wait(timeout)
 
     def _processDeviceEventIteration(self):
+        type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
+        logged_time_index=DeviceEvent.EVENT_LOGGED_TIME_INDEX
+        # the events created this iteration; released once every listener,
+        # and the event subscriptions, have been given them.
+        processed_events=[]
         for device in self.devices:
+            etype=None
             try:
                 events=device._getNativeEventBuffer()
-                #if events and len(events)>0:
-                #    ioHub.print2err("_processDeviceEventIteration.....", device._event_listeners)
-                while len(events)>0:
-                    evt=events.popleft()
-                    e=device._getIOHubEventObject(evt)
-                    if e is not None:
-                        for l in device._getEventListeners(e[DeviceEvent.EVENT_TYPE_ID_INDEX]):
-                            l._handleEvent(e)
+                event_count=len(events)
+                if event_count == 0:
+                    continue
+                stats=self._device_event_stats.get(device)
+                if stats is None:
+                    stats=self._device_event_stats[device]=DeviceEventStats()
+                if event_count > stats.native_buffer_high_water:
+                    stats.native_buffer_high_water=event_count
+                events.checkOverflow()
+                processing_time=Computer.getTime()
+
+                # Drain the native events in one step. Only this greenlet 
+                # removes events, so popping the number of events seen is 
+                # safe while device callback threads add more.
+                popleft=events.popleft
+                ioevents=device._getIOHubEventObjects([popleft() for i in xrange(event_count)])
+                if not ioevents:
+                    continue
+                processed_events.append(ioevents)
+
+                stats.event_count+=len(ioevents)
+                addDelay=stats.processing_delay.add
+                for e in ioevents:
+                    addDelay(processing_time-e[logged_time_index])
+
+                # Each run of consecutive events of the same type is given to
+                # the listeners of that type as one batch; grouping runs, 
+                # rather than all events of a type, keeps listeners receiving
+                # events in the order they occurred. The filtered copies made
+                # by the device's event filters follow the event each was 
+                # made from, so the batch stays in hub time order.
+                filters=self._device_filters.get(device)
+                for etype,type_events in groupby(ioevents,itemgetter(type_index)):
+                    type_events=list(type_events)
+                    if filters:
+                        filtered=[event_filter.filterEvents(type_events) for event_filter in filters
+                                  if etype in event_filter.input_event_type_ids]
+                        if filtered:
+                            type_events=[e for event_copies in zip(type_events,*filtered) for e in event_copies]
+                    for l in device._getEventListeners(etype):
+                        dispatchEvents(l,type_events)
             except:
                 printExceptionDetailsToStdErr()
-                print2err("Error in processDeviceEvents: ", device, " : ", len(events), " : ", e)
-                print2err("Event type ID: ",e[DeviceEvent.EVENT_TYPE_ID_INDEX], " : " , EventConstants.getName(e[DeviceEvent.EVENT_TYPE_ID_INDEX]))
+                print2err("Error in processDeviceEvents: ", device)
+                if etype is not None:
+                    print2err("Event type ID: ",etype, " : " , EventConstants.getName(etype))
                 print2err("--------------------------------------")
+        try:
+            self._eventMerger.release(self._eventMerger.getWatermark(Computer.getTime()))
+        except:
+            printExceptionDetailsToStdErr()
+        if self._event_subscriptions:
+            self._sendSubscribedEvents()
+        for ioevents in processed_events:
+            releaseEvents(ioevents)
+
+    def _sendSubscribedEvents(self):
+        for subscription in self._event_subscriptions.itervalues():
+            if subscription.events:
+                events=subscription.events
+                subscription.events=[]
+                self.udpService.sendResponse(('SUBSCRIBED_EVENTS',subscription.subscription_id,events),subscription.address)
+
+    def addEventSubscription(self,address,event_type_ids=None,device_class_names=None):
+        """
+        Registers an event subscription for the Experiment Process socket at
+        address. Events of the types in event_type_ids (all types if None) 
+        from the devices in device_class_names (all devices if None) are
+        pushed to the address as they are processed. Returns the id of the
+        new subscription.
+        """
+        if isinstance(address,list):
+            address=tuple(address)
+        subscription_id=self._next_subscription_id
+        self._next_subscription_id+=1
+        subscription=EventSubscription(subscription_id,address)
+        
+        for device_class_name,device in self.deviceDict.iteritems():
+            if device_class_names and device_class_name not in device_class_names:
+                continue
+            # devices run by a worker process are WorkerDeviceProxy objects,
+            # so the event classes are taken from the device class.
+            event_class_names=getDeviceClass(device).EVENT_CLASS_NAMES
+            eventIDs=[getattr(EventConstants,convertCamelToSnake(event_class_name[:-5],False)) for event_class_name in event_class_names]
+            if event_type_ids:
+                eventIDs=[eid for eid in eventIDs if eid in event_type_ids]
+            if eventIDs:
+                device._addEventListener(subscription,eventIDs)
+                
+        self._event_subscriptions[subscription_id]=subscription
+        self.log("Event subscription %d added for %s"%(subscription_id,str(address)))
+        return subscription_id
+
+    def removeEventSubscription(self,subscription_id):
+        subscription=self._event_subscriptions.pop(subscription_id,None)
+        if subscription is None:
+            return False
+        for device in self.devices:
+            device._removeEventListener(subscription)
+        return True
 
     def _handleEvent(self,event):
         #ioHub.print2err("ioServer Handle event: ",event)
         self.eventBuffer.append(event)
 
+    def _handleEvents(self,events):
+        append=self.eventBuffer.append
+        for event in events:
+            append(event)
+
+    def _addMergedEvents(self,events):
+        if self._event_ring is not None:
+            self._event_ring._handleEvents(events)
+        else:
+            self._handleEvents(events)
+
     def clearEventBuffer(self):
-        l= len(self.eventBuffer)
-        self.eventBuffer.clear()
+        # Only the default cursor, used by requests that do not give their 
+        # own cursor, is moved; other readers are not affected.
+        l=self.eventBuffer.getUnreadCount(self.default_event_cursor)
+        self.default_event_cursor=self.eventBuffer.getNextPosition()
         return l
 
     def shutdown(self):
@@ -860,8 +1842,18 @@ class ioServer(object):
             while len(self.deviceMonitors) > 0:
                 m=self.deviceMonitors.pop(0)
                 m.running=False
+            self.pollScheduler.stop()
+            self._event_wakeup.close()
+            self.eventBuffer.getOverflowBuffer().close()
+            for d in self.devices:
+                d._getNativeEventBuffer().close()
             if self.eventBuffer:
                 self.clearEventBuffer()
+            if self._event_ring:
+                self._event_ring.close(remove=True)
+                self._event_ring=None
+            if self._unix_socket_path and os.path.exists(self._unix_socket_path):
+                os.remove(self._unix_socket_path)
             try:
                 self.closeDataStoreFile()
             except:
@@ -924,10 +1916,9 @@ def run(rootScriptPathDir,configFilePath):
         s.log('Receiving datagrams on :9000')
         s.udpService.start()
 
-        for m in s.deviceMonitors:
-            m.start()
+        s.pollScheduler.start()
 
-        gevent.spawn(s.processDeviceEvents,0.001)
+        gevent.spawn(s.processDeviceEvents)
 
         sys.stdout.write("IOHUB_READY\n\r\n\r")
         sys.stdout.flush()
@@ -65,9 +65,8 @@ else:
 
 from variableProvider import ExperimentVariableProvider
 
-from visualUtil import FullScreenWindow, SinusoidalMotion
-from visualUtil import TimeTrigger,DeviceEventTrigger
-from visualUtil import ScreenState,ClearScreen,InstructionScreen,ImageScreen
+# visualUtil imports iohub.devices, which imports the event buffer classes 
+# defined below, so it is imported at the end of the module.
 #
 ## Windows Message Pumping
 #
@@ -230,6 +229,476 @@ class NumPyRingBuffer(object):
         return self.getLength()
         
         
+###############################################################################
+#
+## A fixed capacity ring buffer of events of one type, held in a numpy 
+## structured array using the event class EVENT_ARRAY_DTYPE, along with the
+## events themselves. Used for the device level event buffers.
+#
+
+class EventArrayRingBuffer(object):
+    """
+    Holds up to max_size events, as rows of a numpy structured array of the
+    given dtype. As with NumPyRingBuffer, each row is written twice, max_size
+    rows apart, so the events in the buffer are always one contiguous slice 
+    of the array, oldest first, and reading them never copies. When the 
+    buffer is full, adding events removes the oldest ones, which are counted
+    in overflow_count.
+
+    The events added are also kept, the same way, in a list, so getEvents()
+    returns them with their original values; converting to the dtype can 
+    round floats, and truncates text to the field length.
+
+    If index_field, the position of a field in the event lists, is given, 
+    the values of that field, which must be in ascending order as events are
+    added (i.e. event hub time), are also kept in a contiguous float64 array,
+    so getIndexRange() can find the events in a range of values with a 
+    binary search. The values are taken from the events before they are 
+    converted to the dtype, so are not rounded to a float32 field.
+
+    Events created by an EventRecordPool are held while they are in the 
+    buffer, and released when they are removed or overwritten.
+    """
+    def __init__(self,max_size,dtype,index_field=None):
+        self.max_size=max_size
+        self.dtype=dtype
+        self.index_field=index_field
+        self._npa=numpy.zeros(max_size*2,dtype=dtype)
+        self._events=[None,]*(max_size*2)
+        self._index=None
+        if index_field is not None:
+            self._index=numpy.zeros(max_size*2,dtype=numpy.float64)
+        # absolute positions of the oldest event, and after the newest event.
+        self._start=0
+        self._end=0
+        self.overflow_count=0
+
+    def __len__(self):
+        return self._end-self._start
+
+    def _toArray(self,events):
+        try:
+            return numpy.array([tuple(e) for e in events],dtype=self.dtype)
+        except UnicodeEncodeError:
+            # non ascii text (i.e. keyboard chars) is stored utf-8 encoded in string fields.
+            return numpy.array([tuple([v.encode('utf-8') if isinstance(v,unicode) else v for v in e]) for e in events],dtype=self.dtype)
+
+    def _bufferedEvents(self,start=0,stop=None):
+        # the events at indexes start to stop-1 of getElements().
+        if stop is None:
+            stop=len(self)
+        i=self._start%self.max_size
+        return self._events[i+start:i+stop]
+
+    def _write(self,position,rows,events,index_values=None):
+        # writes rows, the events they were created from, and their index
+        # values, at the absolute position, and again max_size rows later.
+        max_size=self.max_size
+        npa=self._npa
+        buffered_events=self._events
+        row_count=len(rows)
+        i=position%max_size
+        first_part=min(row_count,max_size-i)
+        npa[i:i+first_part]=rows[:first_part]
+        npa[i+max_size:i+max_size+first_part]=rows[:first_part]
+        buffered_events[i:i+first_part]=events[:first_part]
+        buffered_events[i+max_size:i+max_size+first_part]=events[:first_part]
+        if first_part < row_count:
+            rest=row_count-first_part
+            npa[:rest]=rows[first_part:]
+            npa[max_size:max_size+rest]=rows[first_part:]
+            buffered_events[:rest]=events[first_part:]
+            buffered_events[max_size:max_size+rest]=events[first_part:]
+        if index_values is not None:
+            index=self._index
+            index[i:i+first_part]=index_values[:first_part]
+            index[i+max_size:i+max_size+first_part]=index_values[:first_part]
+            if first_part < row_count:
+                index[:rest]=index_values[first_part:]
+                index[max_size:max_size+rest]=index_values[first_part:]
+
+    def extend(self,events):
+        """
+        Adds events, a list of events in list form, converting them to rows 
+        of the buffer's array in one call.
+        """
+        if len(events) > self.max_size:
+            self.overflow_count+=len(events)-self.max_size
+            events=events[len(events)-self.max_size:]
+        if len(events) == 0:
+            return
+        index_values=None
+        if self._index is not None:
+            index_field=self.index_field
+            index_values=numpy.array([e[index_field] for e in events],dtype=numpy.float64)
+        evicted_count=len(self)+len(events)-self.max_size
+        evicted=None
+        if evicted_count > 0:
+            evicted=self._bufferedEvents(0,evicted_count)
+        holdEvents(events)
+        self._write(self._end,self._toArray(events),events,index_values)
+        self._end+=len(events)
+        if evicted:
+            releaseEvents(evicted)
+            self.overflow_count+=evicted_count
+            self._start=self._end-self.max_size
+
+    def getElements(self):
+        """
+        Returns the events in the buffer, oldest first, as a view of the 
+        buffer's numpy structured array.
+        """
+        i=self._start%self.max_size
+        return self._npa[i:i+len(self)]
+
+    def getEvents(self,start=0,stop=None):
+        """
+        Returns the events at indexes start to stop-1 of getElements(), or to
+        the newest event if stop is None, as the events (in list form) that 
+        were added. A new list is returned for each event.
+        """
+        if stop is None or stop > len(self):
+            stop=len(self)
+        return [list(e) for e in self._bufferedEvents(start,stop)]
+
+    def getIndexRange(self,low=None,high=None):
+        """
+        Returns the (start, stop) indexes into getElements() of the events 
+        whose index_field value is >= low and <= high. A bound that is None
+        is not applied. Takes O(log n) time.
+        """
+        i=self._start%self.max_size
+        index=self._index[i:i+len(self)]
+        start=0
+        stop=len(index)
+        if low is not None:
+            start=int(numpy.searchsorted(index,low,'left'))
+        if high is not None:
+            stop=int(numpy.searchsorted(index,high,'right'))
+        return start,max(start,stop)
+
+    def getIndexValues(self,start=0,stop=None):
+        """
+        Returns the index_field values of the events at indexes start to 
+        stop-1 of getElements(), as a view of the float64 index array.
+        """
+        if stop is None:
+            stop=len(self)
+        i=self._start%self.max_size
+        return self._index[i+start:i+stop]
+
+    def remove(self,start,stop):
+        """
+        Removes the events at indexes start to stop-1 of getElements(). Events
+        before start are moved up to take the place of the removed events.
+        """
+        start=max(start,0)
+        stop=min(stop,len(self))
+        if stop <= start:
+            return
+        removed=self._bufferedEvents(start,stop)
+        if start > 0:
+            i=self._start%self.max_size
+            kept=self.getElements()[:start].copy()
+            kept_events=self._events[i:i+start]
+            kept_index=None
+            if self._index is not None:
+                kept_index=self._index[i:i+start].copy()
+            self._write(self._start+stop-start,kept,kept_events,kept_index)
+        self._start+=stop-start
+        releaseEvents(removed)
+
+    def clear(self):
+        releaseEvents(self._bufferedEvents())
+        self._start=self._end
+
+###############################################################################
+#
+## Histogram of values counted into fixed bins, with running count, mean, min 
+## and max. Used for timing statistics, where keeping every value is not needed.
+#
+
+from bisect import bisect_left
+
+class Histogram(object):
+    """
+    Histogram counts values into the bins defined by bin_edges, a sorted 
+    list of the upper edge of each bin. A value is counted in the first bin
+    whose edge is >= the value; values larger than the last edge are counted
+    in an extra overflow bin. The count, mean, min and max of all values 
+    added are also kept.
+    """
+    def __init__(self,bin_edges):
+        self.bin_edges=list(bin_edges)
+        self.clear()
+
+    def add(self,value):
+        """
+        Adds value to the histogram.
+        
+        :param float value: The value to add.
+        :returns None:
+        """
+        self.counts[bisect_left(self.bin_edges,value)]+=1
+        self.count+=1
+        self.total+=value
+        if self.min is None or value < self.min:
+            self.min=value
+        if self.max is None or value > self.max:
+            self.max=value
+
+    def getMean(self):
+        """
+        Returns the mean of the values added, or None if no values have been added.
+        """
+        if self.count:
+            return self.total/self.count
+        return None
+
+    def clear(self):
+        """
+        Removes all values from the histogram.
+        """
+        self.counts=[0,]*(len(self.bin_edges)+1)
+        self.count=0
+        self.total=0.0
+        self.min=None
+        self.max=None
+
+    def toDict(self):
+        """
+        Returns the histogram as a dict with bin_edges, counts, count, mean, min
+        and max keys.
+        """
+        return dict(bin_edges=list(self.bin_edges),counts=list(self.counts),count=self.count,
+                    mean=self.getMean(),min=self.min,max=self.max)
+
+###############################################################################
+#
+## A fixed length deque of events that counts overflows and applies an
+## overflow policy, used for the ioHub Server global and device event buffers.
+#
+
+from collections import deque
+import os
+import tempfile
+
+class BoundedEventDeque(deque):
+    """
+    BoundedEventDeque is a deque of at most maxlen events which keeps count
+    of the events lost to overflow, and the largest number of events it has
+    held (the high-water mark). When an event is appended while the deque is
+    full, the overflow policy decides what happens:
+    
+        #. 'drop_oldest': the oldest event is discarded, like a standard deque with a maxlen (the default).
+        #. 'drop_newest': the event being appended is discarded.
+        #. 'spill': the oldest event is written, msgpack encoded, to the spill file at spill_file_path before being removed from the deque. Events that can not be encoded are dropped.
+        #. 'alert': the oldest event is discarded, and alert_handler (if not None) is called with the deque, at most once every alert_interval sec.msec.
+        
+    With the 'drop_oldest' and 'alert' policies, events are added by the 
+    standard deque append(), so adding an event, which is often done from a
+    device callback thread, costs no more than for a plain deque. Overflow 
+    is then detected by the consumer of the events, which calls 
+    checkOverflow() before reading them; alert_handler is only called from 
+    checkOverflow(), so it runs in the consumer's greenlet. Each call that 
+    finds the deque full counts one overflow and one dropped event, so if 
+    more events are added between reads, dropped_count is a lower bound.
+
+    The 'drop_newest' and 'spill' policies have to act as each event is 
+    added, so with those policies append() is replaced by one that applies 
+    the policy and returns False if the event was discarded.
+    """
+    POLICIES=('drop_oldest','drop_newest','spill','alert')
+    
+    def __init__(self,maxlen,name=None,policy='drop_oldest',spill_file_path=None,alert_handler=None,alert_interval=1.0):
+        deque.__init__(self,maxlen=maxlen)
+        self.name=name
+        self.overflow_count=0
+        self.dropped_count=0
+        self.spilled_count=0
+        self.high_water=0
+        self.alert_handler=alert_handler
+        self.alert_interval=alert_interval
+        self._last_alert_time=None
+        self._spill_file=None
+        self.setPolicy(policy,spill_file_path)
+
+    def setPolicy(self,policy,spill_file_path=None):
+        """
+        Sets the overflow policy, one of BoundedEventDeque.POLICIES. 
+        spill_file_path is the file events are written to by the 'spill' 
+        policy; if None, a file in the system temp directory is used.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown event buffer overflow policy: %s"%(policy,))
+        self.policy=policy
+        if policy == 'spill' and spill_file_path is None:
+            spill_file_path=os.path.join(tempfile.gettempdir(),'iohub_overflow_%s_%d.msgpack'%(self.name,os.getpid()))
+        self.spill_file_path=spill_file_path
+        if policy in ('drop_newest','spill'):
+            self.append=self._appendWithPolicy
+        else:
+            self.__dict__.pop('append',None)
+
+    def checkOverflow(self):
+        """
+        Called by the consumer of the events before reading them. Updates the
+        high-water mark and, if the deque is full with the 'drop_oldest' or 
+        'alert' policy, counts the overflow and calls alert_handler for the 
+        'alert' policy. Returns True if the deque is full.
+        """
+        length=len(self)
+        if length > self.high_water:
+            self.high_water=length
+        if length < self.maxlen:
+            return False
+        if self.policy in ('drop_oldest','alert'):
+            self.overflow_count+=1
+            self.dropped_count+=1
+            if self.policy == 'alert':
+                self._alert()
+        return True
+
+    def _appendWithPolicy(self,event):
+        # append() for the 'drop_newest' and 'spill' policies. 
+        if len(self) < self.maxlen:
+            deque.append(self,event)
+            return True
+
+        self.overflow_count+=1
+        if self.policy == 'drop_newest':
+            self.dropped_count+=1
+            return False
+        self._spill(self.popleft())
+        deque.append(self,event)
+        return True
+
+    def _spill(self,event):
+        import msgpack
+        try:
+            if self._spill_file is None:
+                self._spill_file=open(self.spill_file_path,'ab')
+            self._spill_file.write(msgpack.packb(event))
+            self.spilled_count+=1
+        except Exception:
+            self.dropped_count+=1
+
+    def _alert(self):
+        if self.alert_handler is None:
+            return
+        now=getTime()
+        if self._last_alert_time is None or now-self._last_alert_time >= self.alert_interval:
+            self._last_alert_time=now
+            self.alert_handler(self)
+
+    def getStats(self):
+        """
+        Returns the overflow statistics of the deque as a dict.
+        """
+        if len(self) > self.high_water:
+            self.high_water=len(self)
+        return dict(length=len(self),maxlen=self.maxlen,policy=self.policy,high_water=self.high_water,
+                    overflow_count=self.overflow_count,dropped_count=self.dropped_count,
+                    spilled_count=self.spilled_count)
+
+    def close(self):
+        """
+        Closes the spill file, if one was opened.
+        """
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file=None
+
+###############################################################################
+#
+## A pool of event records (lists) that a device fills in place for each new
+## event. The event buffers that keep events hold the records they store, 
+## and release them when the events are removed; a record is reused once 
+## every holder has released it, so events can be created at high rates 
+## without allocating a new list, or a tuple of its values, for each one.
+#
+
+class EventRecord(list):
+    """
+    An event, in list form, created by an EventRecordPool. Code that keeps 
+    an EventRecord after the device event processing iteration it was 
+    dispatched in must call holdEvents() for it, and releaseEvents() once it
+    is done with it; otherwise the record can be refilled with a new event
+    while it is still being used.
+    """
+    __slots__=('_pool','_holds')
+
+    def __reduce__(self):
+        # records are sent to other processes as plain lists.
+        return (list,(list(self),))
+
+def holdEvents(events):
+    """
+    Adds a hold to each EventRecord in events, so it is not reused until
+    releaseEvents() has been called for it. Other events are ignored.
+    """
+    for e in events:
+        if type(e) is EventRecord:
+            e._holds+=1
+
+def releaseEvents(events):
+    """
+    Releases a hold on each EventRecord in events; a record is returned to
+    its pool when its last hold is released. Other events are ignored.
+    """
+    for e in events:
+        if type(e) is EventRecord:
+            e._holds-=1
+            if e._holds == 0:
+                e._pool._recycle(e)
+
+class EventRecordPool(object):
+    """
+    Hands out EventRecords created from template, the values each event 
+    field starts with. acquire() returns a record holding one hold, for the
+    device event processing that the event is created for; the ioHub Server 
+    releases it once the event has been given to every listener, and each 
+    event buffer that stores the event holds it until the event is removed.
+    Released records are kept for reuse, up to max_size of them; when none 
+    is free a new record is created.
+
+    A reused record keeps the values of its previous event, so the device 
+    must set every field that can differ from template by element 
+    assignment, for example record[5]=device_time. Filling a record this 
+    way creates no tuple or list for the event. Records that are never 
+    released, for example events dropped by a full native event buffer, 
+    are freed normally once they are no longer referenced.
+
+    acquire() can be called from a device callback thread: taking a record
+    from, and returning one to, the free records are single deque 
+    operations, which are atomic.
+    """
+    def __init__(self,template,max_size=4096):
+        self.template=list(template)
+        self.max_size=max_size
+        self._free=deque()
+        self.allocated_count=0
+        self.reused_count=0
+
+    def acquire(self):
+        try:
+            record=self._free.pop()
+            self.reused_count+=1
+        except IndexError:
+            record=EventRecord(self.template)
+            record._pool=self
+            self.allocated_count+=1
+        record._holds=1
+        return record
+
+    def _recycle(self,record):
+        if len(self._free) < self.max_size:
+            self._free.append(record)
+
+    def getStats(self):
+        return dict(free=len(self._free),max_size=self.max_size,
+                    allocated_count=self.allocated_count,reused_count=self.reused_count)
+
 ###############################################################################
 #
 ## Generate a set of points in a NxM grid. Useful for creating calibration target positions,
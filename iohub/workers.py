@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+ioHub
+.. file: ioHub/workers.py
+
+Copyright (C) 2012-2013 iSolver Software Solutions
+Distributed under the terms of the GNU General Public License (GPL version 3 or any later version).
+
+.. moduleauthor:: Sol Simpson <sol@isolver-software.com> + contributors, please see credits section of documentation.
+.. fileauthor:: Sol Simpson <sol@isolver-software.com>
+"""
+
+import os
+import sys
+import socket
+import subprocess
+import _multiprocessing
+from itertools import groupby
+from operator import itemgetter
+
+import gevent
+from gevent.socket import wait_read
+try:
+    from gevent.lock import Semaphore
+except ImportError:
+    from gevent.coros import Semaphore
+
+from .util import printExceptionDetailsToStdErr, ioHubError, convertCamelToSnake, MonotonicClock, BoundedEventDeque, releaseEvents
+from .constants import DeviceConstants, EventConstants
+from .devices import Computer, DeviceEvent, ioDeviceError, import_device, _psutil_available, registerDeviceProxy, unregisterDeviceProxy
+from .net import SharedMemoryEventRing
+
+# Event ids are only unique within a process, so each worker process starts
+# numbering its events at (worker_index+1)*WORKER_EVENT_ID_BLOCK.
+WORKER_EVENT_ID_BLOCK=2**28
+
+# sec.msec the ioHub Server waits for a worker to create its device.
+WORKER_START_TIMEOUT=30.0
+
+def runDeviceWorker(worker_index,device_module_path,device_class_name,device_config,
+                    display_config,ring_path,clock_offset,connection,processor_list=None):
+    """
+    The entry point of a device worker process. Creates the device, then
+    polls it every device_timer interval, converts the native events it
+    produces to ioHub events, and writes them to the shared memory event
+    ring at ring_path for the ioHub Server to read. Between polls, device
+    method calls sent by the WorkerDeviceProxy over connection are run.
+    """
+    Computer.isIoHubProcess=True
+    Computer.globalClock=MonotonicClock(clock_offset)
+    Computer._nextEventID=(worker_index+1)*WORKER_EVENT_ID_BLOCK
+
+    device=None
+    ring=None
+    try:
+        if processor_list and _psutil_available:
+            import psutil
+            psutil.Process(os.getpid()).set_cpu_affinity(processor_list)
+
+        DeviceClass,device_class_name,event_classes=import_device(device_module_path,device_class_name)
+        # events are handed to the ioHub Server through the ring, not by
+        # waking its event processing loop.
+        DeviceClass._iohub_server=None
+        if device_class_name != 'Display' and DeviceClass._display_device is None and display_config is not None:
+            DisplayClass,_,_=import_device('iohub.devices.display','Display')
+            DeviceClass._display_device=DisplayClass(dconfig=display_config)
+
+        event_ids=[getattr(EventConstants,convertCamelToSnake(event_class_name[:-5],False))
+                   for event_class_name in device_config.get('monitor_event_types',[])]
+        DeviceConstants.addClassMapping(DeviceClass)
+        EventConstants.addClassMappings(DeviceClass,event_ids,event_classes)
+
+        device=DeviceClass(dconfig=device_config)
+        if device_config.get('stream_events') is True:
+            # the device event buffer is kept by the worker, as the device
+            # methods that read it are run here.
+            device._addEventListener(device,event_ids)
+        ring=SharedMemoryEventRing(ring_path)
+        connection.send(('READY',device._getRPCInterface()))
+    except Exception, e:
+        printExceptionDetailsToStdErr()
+        connection.send(('ERROR',str(e)))
+        return
+
+    interval=device_config['device_timer']['interval']
+    native_buffer=device._getNativeEventBuffer()
+    ctime=Computer.currentSec
+    next_deadline=ctime()
+    running=True
+    try:
+        while running is True:
+            now=ctime()
+            if now >= next_deadline:
+                try:
+                    device._poll()
+                    native_event_count=len(native_buffer)
+                    if native_event_count:
+                        native_buffer.checkOverflow()
+                        popleft=native_buffer.popleft
+                        events=device._getIOHubEventObjects([popleft() for i in xrange(native_event_count)])
+                        if events:
+                            for event_type_id,type_events in groupby(events,itemgetter(DeviceEvent.EVENT_TYPE_ID_INDEX)):
+                                if device in device._getEventListeners(event_type_id):
+                                    device._handleEvents(list(type_events))
+                            ring._handleEvents(events)
+                            releaseEvents(events)
+                except:
+                    printExceptionDetailsToStdErr()
+
+                # keep deadlines on a fixed grid, skipping missed periods.
+                next_deadline+=interval
+                now=ctime()
+                if next_deadline <= now:
+                    next_deadline+=(int((now-next_deadline)/interval)+1)*interval
+
+            # wait for the next deadline, or a request from the ioHub Server.
+            if connection.poll(max(next_deadline-ctime(),0.0)):
+                request=connection.recv()
+                if request[0] == 'STOP':
+                    running=False
+                elif request[0] == 'RPC':
+                    method_name,args,kwargs=request[1:]
+                    try:
+                        connection.send(('RESULT',getattr(device,method_name)(*args,**kwargs)))
+                    except Exception, e:
+                        connection.send(('ERROR',str(e)))
+    except (EOFError,IOError):
+        # the ioHub Server closed its end of the connection.
+        pass
+    finally:
+        try:
+            device._close()
+        except:
+            printExceptionDetailsToStdErr()
+        ring.close()
+        connection.close()
+
+def _runWorkerProcess():
+    # The entry point of the Python interpreter started by WorkerProcess. 
+    # The connection to the ioHub Server is the socket given as stdin, and 
+    # the first message sent over it holds the runDeviceWorker arguments.
+    connection=_multiprocessing.Connection(os.dup(0))
+    devnull=os.open(os.devnull,os.O_RDONLY)
+    os.dup2(devnull,0)
+    os.close(devnull)
+    worker_kwargs=connection.recv()
+    runDeviceWorker(connection=connection,**worker_kwargs)
+
+class WorkerProcess(object):
+    """
+    A device worker process. The worker is started by running a new Python 
+    interpreter, rather than by forking the ioHub Server, so it does not 
+    inherit the ioHub Server's gevent hub, sockets, timerfd or other open 
+    files. It is given one end of a socket pair as its stdin, which it uses 
+    as a multiprocessing Connection; start() returns the Connection for the 
+    other end. Has the parts of the multiprocessing.Process interface that 
+    WorkerDeviceProxy uses.
+    """
+    def __init__(self,name,worker_kwargs):
+        self.name=name
+        self._worker_kwargs=worker_kwargs
+        self._popen=None
+        self.pid=None
+
+    def start(self):
+        parent_socket,child_socket=socket.socketpair()
+        try:
+            # the worker imports iohub from the same location as the ioHub Server.
+            env=dict(os.environ)
+            python_path=[os.path.dirname(os.path.dirname(os.path.abspath(__file__))),]
+            if env.get('PYTHONPATH'):
+                python_path.append(env['PYTHONPATH'])
+            env['PYTHONPATH']=os.pathsep.join(python_path)
+            self._popen=subprocess.Popen([sys.executable,'-c','from iohub.workers import _runWorkerProcess; _runWorkerProcess()'],
+                                         stdin=child_socket.fileno(),close_fds=True,env=env)
+            connection=_multiprocessing.Connection(os.dup(parent_socket.fileno()))
+        finally:
+            parent_socket.close()
+            child_socket.close()
+        self.pid=self._popen.pid
+        connection.send(self._worker_kwargs)
+        return connection
+
+    def is_alive(self):
+        return self._popen is not None and self._popen.poll() is None
+
+    def join(self,timeout):
+        end_time=Computer.currentSec()+timeout
+        while self.is_alive() and Computer.currentSec() < end_time:
+            gevent.sleep(0.01)
+
+    def terminate(self):
+        if self.is_alive():
+            self._popen.terminate()
+            self._popen.wait()
+
+class WorkerDeviceProxy(object):
+    """
+    Stands in for a device that is run in a separate worker process by the
+    ioHub Server. The proxy is polled by the ioHub Server like the device
+    would be, and each poll moves the ioHub events the worker has written
+    to the shared memory event ring into the proxy's native event buffer.
+    The events are already converted, so they are passed through as is by
+    _getIOHubEventObjects, and are then given to the event listeners of the
+    proxy the same way events from in process devices are.
+
+    Device methods that are part of the device's RPC interface are run in
+    the worker process, so the proxy can be used by the ioHub Server, and
+    by the Experiment Process ioHubDeviceView, in place of the device. The
+    proxy is registered as a device proxy of the device's class, so 
+    iohub.devices.getDeviceClass() returns the device's class for it.
+    """
+    RPC_TIMEOUT=5.0
+
+    def __init__(self,iohub_server,worker_index,DeviceClass,device_module_path,device_config,
+                 display_config,ring_path,ring_size,processor_list=None):
+        self._device_class=DeviceClass
+        self._iohub_server=iohub_server
+        self.name=device_config.get('name')
+        self._configuration=device_config
+        self._event_listeners=dict()
+        self._native_event_buffer=BoundedEventDeque(device_config.get('event_buffer_length',1024),self.name)
+        self._rpc_lock=Semaphore()
+        self._rpc_interface=[]
+
+        self._ring=SharedMemoryEventRing(ring_path,ring_size,create=True)
+        self._process=WorkerProcess("ioHubWorker_%s"%(self.name,),
+                                    dict(worker_index=worker_index,device_module_path=device_module_path,
+                                         device_class_name=DeviceClass.__name__,device_config=device_config,
+                                         display_config=display_config,ring_path=ring_path,
+                                         clock_offset=Computer.globalClock.getLastResetTime(),
+                                         processor_list=processor_list))
+        self._connection=self._process.start()
+
+        # other greenlets run while the worker creates the device.
+        try:
+            wait_read(self._connection.fileno(),WORKER_START_TIMEOUT)
+        except socket.timeout:
+            self._stopWorker()
+            raise ioHubError("Device worker process did not start",device=self.name)
+        status,result=self._connection.recv()
+        if status != 'READY':
+            self._stopWorker()
+            raise ioHubError("Device worker process could not create the device",device=self.name,error=result)
+        self._rpc_interface=result
+        registerDeviceProxy(self,DeviceClass)
+
+    def __getattr__(self,name):
+        if name[0] != '_' and name in self._rpc_interface:
+            return lambda *args,**kwargs: self._callWorker(name,args,kwargs)
+        raise AttributeError(name)
+
+    def _callWorker(self,method_name,args,kwargs):
+        self._rpc_lock.acquire()
+        try:
+            self._connection.send(('RPC',method_name,args,kwargs))
+            # other greenlets run while waiting for the reply.
+            try:
+                wait_read(self._connection.fileno(),self.RPC_TIMEOUT)
+            except socket.timeout:
+                raise ioDeviceError(self,"No reply from the device worker process for %s()"%(method_name,))
+            status,result=self._connection.recv()
+        finally:
+            self._rpc_lock.release()
+        if status == 'ERROR':
+            raise ioDeviceError(self,result)
+        return result
+
+    def _poll(self):
+        events=self._ring.readEvents()
+        if events:
+            append=self._native_event_buffer.append
+            for e in events:
+                append(e)
+            self._iohub_server._event_wakeup.signal()
+        return True
+
+    def _getIOHubEventObjects(self,native_events):
+        return native_events
+
+    def _getNativeEventBuffer(self):
+        return self._native_event_buffer
+
+    def _handleEvent(self,e):
+        # the device event buffer is kept by the worker process.
+        pass
+
+    def _handleEvents(self,events):
+        pass
+
+    def _addEventListener(self,l,eventTypeIDs):
+        for ei in eventTypeIDs:
+            listeners=self._event_listeners.setdefault(ei,[])
+            if l not in listeners:
+                listeners.append(l)
+        return True
+
+    def _removeEventListener(self,l):
+        for etypelisteners in self._event_listeners.values():
+            if l in etypelisteners:
+                etypelisteners.remove(l)
+
+    def _getEventListeners(self,forEventType):
+        return self._event_listeners.get(forEventType,[])
+
+    def _getRPCInterface(self):
+        return self._rpc_interface
+
+    def getConfiguration(self):
+        return self._configuration
+
+    def getWorkerStats(self):
+        """
+        Returns a dict with the pid of the worker process, whether it is still
+        running, and the number of events dropped because the shared memory
+        event ring was full.
+        """
+        return dict(pid=self._process.pid,alive=self._process.is_alive(),
+                    ring_dropped_events=self._ring.getDroppedCount())
+
+    def _stopWorker(self):
+        try:
+            if self._process.is_alive():
+                self._connection.send(('STOP',))
+                self._process.join(1.0)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._connection.close()
+        except:
+            printExceptionDetailsToStdErr()
+        self._ring.close(remove=True)
+
+    def _close(self):
+        self._stopWorker()
+        unregisterDeviceProxy(self)
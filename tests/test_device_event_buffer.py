@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Device level event buffer: events added with
+Device._handleEvents() are returned by Device.getEvents() with the values
+they were added with.
+
+Run with: python -m unittest discover tests
+"""
+import unittest
+
+import numpy as N
+
+from iohub.constants import EventConstants
+from iohub.devices import DeviceEvent
+from iohub.devices.experiment import Experiment, MessageEvent, LogEvent
+from iohub.util import EventRecordPool, releaseEvents
+
+def createMessageEvent(event_id,hub_time,text):
+    return [0,0,0,event_id,EventConstants.MESSAGE,
+            hub_time-0.000123456789,hub_time+0.000987654321,hub_time,
+            0.0,0.000123456789,0,0.333333333333,u'ÜÖ',text]
+
+def createLogEvent(event_id,hub_time,text):
+    return [0,0,0,event_id,EventConstants.LOG,
+            hub_time,hub_time,hub_time,0.0,0.0,0,10,text]
+
+def createExperimentDevice(event_buffer_length):
+    device=Experiment.__new__(Experiment)
+    device.event_buffer_length=event_buffer_length
+    device._iohub_event_buffer=dict()
+    return device
+
+class DeviceEventBufferTests(unittest.TestCase):
+    def setUp(self):
+        EventConstants.addClassMappings(Experiment,[EventConstants.MESSAGE,EventConstants.LOG],
+                                        dict(MessageEvent=MessageEvent,LogEvent=LogEvent))
+        self.device=createExperimentDevice(8)
+        # hub times after hours of running, which float32 can not hold to
+        # the usec, and text longer than the 128 char text field.
+        self.events=[createMessageEvent(i,12345.678901+i*0.001,u'Über %d '%(i)+u'x'*200) for i in range(5)]
+        self.device._handleEvents([list(e) for e in self.events])
+
+    def test_getEventsReturnsEventsUnchanged(self):
+        self.assertEqual(self.device.getEvents(),self.events)
+        self.assertEqual(self.device.getEvents(),[])
+
+    def test_getEventsTimeWindowReturnsEventsUnchanged(self):
+        hub_time=DeviceEvent.EVENT_HUB_TIME_INDEX
+        since_time=self.events[1][hub_time]
+        until_time=self.events[3][hub_time]
+        self.assertEqual(self.device.getEvents(since_time=since_time,until_time=until_time,peek=True),
+                         self.events[1:4])
+        self.assertEqual(self.device.getEvents(since_time=since_time,max_count=1),
+                         self.events[1:2])
+        self.assertEqual(self.device.getEvents(),self.events[:1]+self.events[2:])
+
+    def test_getEventsTimeWindowUsesFullTimePrecision(self):
+        # 10 usec apart, far less than the float32 resolution at this time.
+        device=createExperimentDevice(8)
+        events=[createMessageEvent(i,12345.678901+i*0.00001,u'text') for i in range(5)]
+        device._handleEvents([list(e) for e in events])
+        since_time=events[2][DeviceEvent.EVENT_HUB_TIME_INDEX]
+        self.assertEqual(device.getEvents(since_time=since_time,peek=True),events[2:])
+        self.assertEqual(device.getEvents(until_time=since_time-0.000001),events[:2])
+
+    def test_getEventsAfterOverflowReturnsNewestEvents(self):
+        newer_events=[createMessageEvent(i,12345.678901+i*0.001,u'text') for i in range(5,12)]
+        self.device._handleEvents([list(e) for e in newer_events])
+        self.assertEqual(self.device.getEvents(),(self.events+newer_events)[-8:])
+
+    def test_getEventsReturnsPooledEventsUnchanged(self):
+        # records held by the device event buffer are not reused for new
+        # events until they are removed from it.
+        device=createExperimentDevice(4)
+        pool=EventRecordPool(createMessageEvent(0,0.0,u''))
+        events=[]
+        for i in range(6):
+            record=pool.acquire()
+            record[3]=i
+            record[7]=12345.678901+i*0.001
+            record[13]=u'text %d'%(i)
+            events.append(list(record))
+            device._handleEvents([record,])
+            releaseEvents([record,])
+        self.assertEqual(pool.allocated_count,5)
+        self.assertEqual(device.getEvents(),events[2:])
+
+    def test_getEventArraysKeepsTimePrecision(self):
+        etype,data=self.device.getEventArrays()[0]
+        earray=N.frombuffer(data,dtype=MessageEvent.EVENT_ARRAY_DTYPE)
+        for field in ('device_time','logged_time','time','delay'):
+            field_index=MessageEvent.CLASS_ATTRIBUTE_NAMES.index(field)
+            self.assertEqual(earray[field].tolist(),[e[field_index] for e in self.events])
+
+    def test_getEventArraysTimeWindowAndPeek(self):
+        hub_time=DeviceEvent.EVENT_HUB_TIME_INDEX
+        since_time=self.events[1][hub_time]
+        until_time=self.events[3][hub_time]
+        event_arrays=self.device.getEventArrays(since_time=since_time,until_time=until_time,peek=True)
+        self.assertEqual(len(event_arrays),1)
+        earray=N.frombuffer(event_arrays[0][1],dtype=MessageEvent.EVENT_ARRAY_DTYPE)
+        self.assertEqual(earray['event_id'].tolist(),[1,2,3])
+        self.assertEqual(self.device.getEvents(peek=True),self.events)
+
+        self.device.getEventArrays(since_time=since_time,until_time=until_time)
+        self.assertEqual(self.device.getEvents(),self.events[:1]+self.events[4:])
+
+    def test_getEventArraysMaxCountReturnsOldestOfAllTypes(self):
+        # log events between the message events at index 1 and 2.
+        log_events=[createLogEvent(10+i,12345.68+i*0.0001,'log') for i in range(3)]
+        self.device._handleEvents([list(e) for e in log_events])
+        event_arrays=dict(self.device.getEventArrays(max_count=4))
+        messages=N.frombuffer(event_arrays[EventConstants.MESSAGE],dtype=MessageEvent.EVENT_ARRAY_DTYPE)
+        logs=N.frombuffer(event_arrays[EventConstants.LOG],dtype=LogEvent.EVENT_ARRAY_DTYPE)
+        self.assertEqual(messages['event_id'].tolist(),[0,1])
+        self.assertEqual(logs['event_id'].tolist(),[10,11])
+        self.assertEqual(self.device.getEvents(),log_events[2:]+self.events[2:])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ioServer event subscriptions.
+
+Run with: python -m unittest discover tests
+"""
+import unittest
+
+from iohub.constants import EventConstants
+from iohub.devices import registerDeviceProxy, unregisterDeviceProxy
+from iohub.devices.experiment import Experiment
+from iohub.server import ioServer, EventSubscription
+from iohub.util import OrderedDict
+from iohub.workers import WorkerDeviceProxy
+
+def createWorkerDeviceProxy(DeviceClass,name):
+    # a proxy without a worker process; only its event listeners are used.
+    proxy=WorkerDeviceProxy.__new__(WorkerDeviceProxy)
+    proxy.name=name
+    proxy._event_listeners=dict()
+    proxy._rpc_interface=[]
+    registerDeviceProxy(proxy,DeviceClass)
+    return proxy
+
+def createServer(deviceDict):
+    server=ioServer.__new__(ioServer)
+    server.deviceDict=deviceDict
+    server.devices=deviceDict.values()
+    server._event_subscriptions=OrderedDict()
+    server._next_subscription_id=1
+    server.log=lambda text,level=None: None
+    return server
+
+class EventSubscriptionTests(unittest.TestCase):
+    def setUp(self):
+        self.proxy=createWorkerDeviceProxy(Experiment,'experiment')
+        self.server=createServer(OrderedDict(Experiment=self.proxy))
+
+    def tearDown(self):
+        unregisterDeviceProxy(self.proxy)
+
+    def test_subscribeToWorkerDevice(self):
+        subscription_id=self.server.addEventSubscription(['127.0.0.1',9001],[EventConstants.MESSAGE])
+        subscription=self.server._event_subscriptions[subscription_id]
+        self.assertTrue(isinstance(subscription,EventSubscription))
+        self.assertEqual(subscription.address,('127.0.0.1',9001))
+        self.assertEqual(self.proxy._getEventListeners(EventConstants.MESSAGE),[subscription])
+        self.assertEqual(self.proxy._getEventListeners(EventConstants.LOG),[])
+
+        self.assertTrue(self.server.removeEventSubscription(subscription_id))
+        self.assertEqual(self.proxy._getEventListeners(EventConstants.MESSAGE),[])
+
+if __name__ == '__main__':
+    unittest.main()